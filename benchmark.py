@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+离线端到端吞吐基准：在本地假 CMC 与假 Pinecone 服务上运行同步流程，
+报告每个阶段的调用次数、处理条数、耗时与吞吐，以及整体 records/sec 和峰值 RSS。
+
+每个场景都在独立的子进程和临时目录中运行，峰值 RSS 与状态文件互不影响。
+
+用法示例：
+    python benchmark.py --coins 2000 --scenarios main,daily,process
+    python benchmark.py --coins 500 --cmc-latency 0.05 --cmc-error-rate 0.02
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import resource
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict
+
+SCENARIOS = ("main", "daily", "quotes", "process")
+
+
+class StageTimer:
+    """包装被测函数，累计每个阶段的调用次数、处理条数与耗时（流水线中各阶段并发，耗时之和可能大于总耗时）"""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, name: str, fn: Callable, count: Callable[[tuple, Any], int]) -> Callable:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self.stages.setdefault(name, {"calls": 0, "records": 0, "seconds": 0.0})
+                stage["calls"] += 1
+                stage["records"] += count(args, result)
+                stage["seconds"] += elapsed
+            return result
+        return wrapper
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+
+def _install(options: Dict[str, Any], timer: StageTimer):
+    """把同步流程的外部依赖指向假服务，并为各阶段安装计时包装"""
+    from fake_services import FakeCMCDataset, FakeCMCServer, FakePinecone
+    import cmc_fetcher
+    import daily_update
+    import main
+    import quotes_refresh
+    from config import CMC_CONFIG
+    from rate_limiter import TokenBucket
+
+    dataset = FakeCMCDataset(options["coins"], description_len=options["description_len"])
+    server = FakeCMCServer(dataset, latency=options["cmc_latency"], error_rate=options["cmc_error_rate"]).start()
+    pinecone = FakePinecone(latency=options["pinecone_latency"], error_rate=options["pinecone_error_rate"])
+
+    CMC_CONFIG["base_url"] = server.url
+    cmc_fetcher._cmc_limiter = TokenBucket(options["cmc_rpm"], max(1, options["cmc_rpm"] // 60))
+    for module in (main, quotes_refresh, daily_update):
+        module.init_pinecone_client = lambda: pinecone
+        module.get_or_create_index = lambda pc, namespace=None: pinecone.Index("coindata")
+
+    main.fetch_ucids = daily_update.fetch_ucids = timer.wrap(
+        "discover", cmc_fetcher.fetch_ucids, lambda a, r: len(r))
+    daily_update.fetch_new_ucids = timer.wrap(
+        "discover", cmc_fetcher.fetch_new_ucids, lambda a, r: len(r or []))
+    main.fetch_details_and_market_data = timer.wrap(
+        "fetch", main.fetch_details_and_market_data, lambda a, r: len(a[0]))
+    main.process_data = timer.wrap("process", main.process_data, lambda a, r: len(r))
+    main.embed_texts_with_pinecone = timer.wrap("embed", main.embed_texts_with_pinecone, lambda a, r: len(a[1]))
+    main.upsert_data_to_pinecone = timer.wrap("upsert", main.upsert_data_to_pinecone, lambda a, r: r)
+    main.update_metadata_in_pinecone = timer.wrap(
+        "metadata_update", main.update_metadata_in_pinecone, lambda a, r: len(r))
+    quotes_refresh.fetch_market_data = timer.wrap("fetch_quotes", quotes_refresh.fetch_market_data, lambda a, r: len(a[0]))
+    quotes_refresh.update_metadata_in_pinecone = timer.wrap(
+        "metadata_update", quotes_refresh.update_metadata_in_pinecone, lambda a, r: len(r))
+    return dataset, server, pinecone
+
+
+def _age_info_cache(seconds: float):
+    """把 /info 缓存的写入时间前移，模拟每日更新发生在全量同步一天之后，缓存年龄与真实运行一致"""
+    from config import INFO_CACHE_CONFIG
+    if not os.path.exists(INFO_CACHE_CONFIG["path"]):
+        return
+    with contextlib.closing(sqlite3.connect(INFO_CACHE_CONFIG["path"])) as conn:
+        conn.execute("UPDATE info SET fetched_at = fetched_at - ?", (seconds,))
+        conn.commit()
+
+
+def _run_scenario(scenario: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """在当前进程中运行一个场景，返回测量结果"""
+    timer = StageTimer()
+    records = options["coins"]
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        output = io.StringIO()
+        redirect = contextlib.nullcontext() if options["verbose"] else contextlib.redirect_stdout(output)
+        with redirect:
+            if scenario == "process":
+                from fake_services import FakeCMCDataset
+                from data_processor import process_data
+                dataset = FakeCMCDataset(options["coins"], description_len=options["description_len"])
+                ucids = list(range(1, options["coins"] + 1))
+                details = {str(u): dataset.info(u) for u in ucids}
+                market = {str(u): dataset.quote(u) for u in ucids}
+                process = timer.wrap("process", process_data, lambda a, r: len(r))
+                start = time.perf_counter()
+                process(ucids, details, market)
+                wall = time.perf_counter() - start
+                extra = {}
+            else:
+                import daily_update
+                import main
+                dataset, server, pinecone = _install(options, timer)
+                try:
+                    if scenario != "main":
+                        # daily / quotes 需要先有一次全量同步建立的状态，这部分不计入结果
+                        main.main()
+                        mutation = dataset.mutate(description_fraction=options["churn"],
+                                                  market_fraction=options["churn"],
+                                                  add=int(options["coins"] * options["churn"]))
+                        _age_info_cache(86400)
+                        timer.reset()
+                        pinecone.call_counts.clear()
+                        server.request_counts.clear()
+                        server.connections = 0
+                        records = len(dataset.active_ids)
+                    start = time.perf_counter()
+                    if scenario == "main":
+                        main.main()
+                    elif scenario == "daily":
+                        daily_update.daily_update()
+                    else:
+                        main.quotes_only_refresh()
+                    wall = time.perf_counter() - start
+                    extra = {"cmc_requests": dict(server.request_counts), "cmc_throttled": server.throttled,
+                             "cmc_connections": server.connections,
+                             "pinecone_calls": dict(pinecone.call_counts), "pinecone_throttled": pinecone.throttled,
+                             "vectors": pinecone.Index("coindata").describe_index_stats()["total_vector_count"]}
+                    if scenario != "main":
+                        extra["mutation"] = {k: len(v) for k, v in mutation.items()}
+                finally:
+                    server.stop()
+    return {
+        "scenario": scenario,
+        "records": records,
+        "wall_seconds": wall,
+        "records_per_sec": records / wall if wall else 0.0,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": timer.stages,
+        **extra,
+    }
+
+
+def _child(scenario: str, options: Dict[str, Any], results):
+    results.put(_run_scenario(scenario, options))
+
+
+def run_benchmark(scenario: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """在独立子进程中运行一个场景，保证峰值 RSS 只反映该场景"""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=_child, args=(scenario, options, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\n📊 场景 {result['scenario']}：{result['records']} 条记录，总耗时 {result['wall_seconds']:.2f} 秒，"
+          f"{result['records_per_sec']:.1f} 条/秒，峰值 RSS {result['peak_rss_mb']:.1f} MB")
+    print(f"   {'阶段':<16}{'调用':>8}{'条数':>10}{'耗时(s)':>12}{'条/秒':>12}")
+    for name, stage in result["stages"].items():
+        rate = stage["records"] / stage["seconds"] if stage["seconds"] else 0.0
+        print(f"   {name:<16}{stage['calls']:>8}{stage['records']:>10}{stage['seconds']:>12.2f}{rate:>12.1f}")
+    for key in ("cmc_requests", "cmc_throttled", "cmc_connections", "pinecone_calls", "pinecone_throttled", "vectors", "mutation"):
+        if key in result:
+            print(f"   {key}: {result[key]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地假服务上测量同步流程吞吐")
+    parser.add_argument("--coins", type=int, default=1000, help="数据集代币数量")
+    parser.add_argument("--scenarios", default="main,daily,process", help=f"逗号分隔，可选 {','.join(SCENARIOS)}")
+    parser.add_argument("--description-len", type=int, default=800, help="每个代币描述的长度")
+    parser.add_argument("--churn", type=float, default=0.05, help="daily/quotes 场景中发生变化与新增的代币比例")
+    parser.add_argument("--cmc-latency", type=float, default=0.0, help="假 CMC 每个请求的延迟（秒）")
+    parser.add_argument("--cmc-error-rate", type=float, default=0.0, help="假 CMC 返回 429 的概率")
+    parser.add_argument("--cmc-rpm", type=int, default=6000, help="CMC 令牌桶每分钟调用次数")
+    parser.add_argument("--pinecone-latency", type=float, default=0.0, help="假 Pinecone 每次调用的延迟（秒）")
+    parser.add_argument("--pinecone-error-rate", type=float, default=0.0, help="假 Pinecone 抛出 429 的概率")
+    parser.add_argument("--verbose", action="store_true", help="显示被测流程自身的输出")
+    args = parser.parse_args()
+
+    options = vars(args).copy()
+    scenarios = [s.strip() for s in options.pop("scenarios").split(",") if s.strip()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"未知场景: {scenario}")
+        print_report(run_benchmark(scenario, options))
+
+
+if __name__ == "__main__":
+    main()
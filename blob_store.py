@@ -0,0 +1,169 @@
+import atexit
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Optional
+from config import METADATA_BUDGET_CONFIG
+from data_processor import BLOB_FIELDS_KEY
+from fast_json import dumps_bytes, loads
+
+
+class BlobStore:
+    """
+    基于 SQLite 的元数据 blob 存储，每条向量一行，以向量 ID（cmc-{ucid}）为键。
+
+    保存因超出元数据预算而在 Pinecone 中只保留预览的字段的完整值，JSON 序列化后用 zlib 压缩。
+    同时统计写入的元数据原始字节数与裁剪后的字节数，每次同步结束时报告节省的体积。
+    """
+
+    def __init__(self, path: str, compress_level: int):
+        self.compress_level = compress_level
+        self.records = 0
+        self.original_bytes = 0
+        self.stored_bytes = 0
+        self.compressed_bytes = 0
+        self.offloaded_fields: Counter = Counter()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " id TEXT PRIMARY KEY,"
+            " payload BLOB NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def put_many(self, blobs: Dict[str, Dict[str, Any]]):
+        """
+        写入 {向量 ID: {字段: 完整值}}。字段为空的 ID 表示该向量已没有被移出的字段，删除其旧 blob。
+        """
+        now = time.time()
+        rows = [(vector_id, zlib.compress(dumps_bytes(fields), self.compress_level), now)
+                for vector_id, fields in blobs.items() if fields]
+        empty = [(vector_id,) for vector_id, fields in blobs.items() if not fields]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", rows)
+            self._conn.executemany("DELETE FROM blobs WHERE id = ?", empty)
+            self._conn.commit()
+            self.compressed_bytes += sum(len(payload) for _, payload, _ in rows)
+
+    def get(self, vector_id: str) -> Dict[str, Any]:
+        """读取一条向量被移出的字段，不存在时返回空字典"""
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM blobs WHERE id = ?", (vector_id,)).fetchone()
+        return loads(zlib.decompress(row[0])) if row else {}
+
+    def delete_many(self, vector_ids: Iterable[str]):
+        """删除已从索引中删除的向量的 blob"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM blobs WHERE id = ?", [(vector_id,) for vector_id in vector_ids])
+            self._conn.commit()
+
+    def merge_shard(self, path: str, owns: Callable[[int], bool]):
+        """
+        合并一个分片的 blob 存储：只采用该分片负责的代币（owns(ucid) 为真）的行，同一向量保留较新的一条，
+        重复合并同一分片结果不变。
+        """
+        with self._lock:
+            self._conn.create_function("owns", 1, lambda vector_id: bool(owns(int(vector_id.split("-", 1)[1]))),
+                                       deterministic=True)
+            self._conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                self._conn.execute(
+                    "INSERT INTO blobs (id, payload, updated_at)"
+                    " SELECT id, payload, updated_at FROM shard.blobs WHERE owns(id)"
+                    " ON CONFLICT(id) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at"
+                    " WHERE excluded.updated_at > blobs.updated_at"
+                )
+                self._conn.commit()
+            finally:
+                self._conn.execute("DETACH DATABASE shard")
+
+    def record_governed(self, original_bytes: int, stored_bytes: int, fields: Iterable[str]):
+        with self._lock:
+            self.records += 1
+            self.original_bytes += original_bytes
+            self.stored_bytes += stored_bytes
+            for field in fields:
+                self.offloaded_fields[field] += 1
+
+    def report(self):
+        """打印自上次报告以来（即本次同步）写入的元数据体积统计，并清零计数"""
+        with self._lock:
+            records, original_bytes, stored_bytes = self.records, self.original_bytes, self.stored_bytes
+            compressed_bytes, offloaded_fields = self.compressed_bytes, self.offloaded_fields
+            self.records = self.original_bytes = self.stored_bytes = self.compressed_bytes = 0
+            self.offloaded_fields = Counter()
+        if not records:
+            return
+        saved = original_bytes - stored_bytes
+        print(f"🗜️ 元数据预算：{records} 条元数据原始 {original_bytes / 1024:.1f} KB，"
+              f"写入索引 {stored_bytes / 1024:.1f} KB，节省 {saved / 1024:.1f} KB ({saved / max(original_bytes, 1):.0%})")
+        if offloaded_fields:
+            fields = "，".join(f"{field} {count}" for field, count in offloaded_fields.most_common())
+            print(f"   移入 blob 存储的字段：{fields}；压缩后共 {compressed_bytes / 1024:.1f} KB")
+
+    def close(self):
+        """关闭前把 WAL 合并回主库文件，便于与状态库一样直接提交数据库文件；重复关闭时忽略"""
+        with self._lock:
+            if self._closed:
+                return
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+            self._closed = True
+
+
+_store: Optional[BlobStore] = None
+_store_path = METADATA_BUDGET_CONFIG["blob_store_path"]
+_store_lock = threading.Lock()
+
+
+def set_blob_store_path(path: str):
+    """在首次打开全局 blob 存储之前切换其路径（分片同步时每个分片写入各自的 blob 存储）"""
+    global _store_path
+    with _store_lock:
+        if _store is not None and _store_path != path:
+            raise RuntimeError(f"blob 存储 {_store_path} 已打开，无法切换到 {path}")
+        _store_path = path
+
+
+def get_blob_store() -> Optional[BlobStore]:
+    """获取全局 blob 存储（首次调用时打开，并在进程退出时关闭），打开失败时返回 None"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = BlobStore(_store_path, METADATA_BUDGET_CONFIG["compress_level"])
+            except sqlite3.Error as e:
+                print(f"⚠️ 打开元数据 blob 存储失败，超出预算的字段只保留预览: {e}")
+                return None
+            atexit.register(_store.close)
+        return _store
+
+
+def expand_metadata(vector_id: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    按需还原完整元数据：metadata 为查询结果中的元数据，blob_fields 非空时从 blob 存储读取这些字段的完整值。
+    blob 存储不可用或缺少该向量时原样返回预览。
+    """
+    if not metadata.get(BLOB_FIELDS_KEY):
+        return metadata
+    store = get_blob_store()
+    if store is None:
+        return metadata
+    try:
+        fields = store.get(vector_id)
+    except (sqlite3.Error, zlib.error, ValueError) as e:
+        print(f"⚠️ 读取 {vector_id} 的元数据 blob 失败: {e}")
+        return metadata
+    return {**metadata, **fields}
+
+
+def report_blob_store_stats():
+    """打印元数据预算的节省统计；本进程未写入元数据时不输出"""
+    if _store is not None:
+        _store.report()
@@ -1,169 +1,445 @@
+import re
 import requests
 import time
-from typing import List, Dict, Any
-from config import CMC_CONFIG, BATCH_SIZE, REQUEST_DELAY
-
-def _make_request_with_retry(url: str, headers: Dict, params: Dict, max_retries: int = 3) -> requests.Response:
-    """带重试机制的请求函数"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from config import (CMC_CONFIG, CMC_CALLS_PER_MINUTE, CMC_RATE_BURST, FETCH_CONCURRENCY,
+                    UCID_DISCOVERY_OVERLAP, HTTP_CONFIG, JSON_CONFIG)
+from credit_planner import batch_size_for, plan_calls, record_credits, request_credits
+from fast_json import iter_array, loads
+from http_client import LatencyTracker, get_session, hedged_call, request_timeout
+from info_cache import get_info_cache
+from metrics import inc, observe
+from profiler import profile_stage
+from rate_limiter import TokenBucket, backoff_delay, parse_retry_after
+
+# 所有 CMC 请求共享的令牌桶，按套餐每分钟调用次数放行
+_cmc_limiter = TokenBucket(CMC_CALLS_PER_MINUTE, CMC_RATE_BURST)
+
+# 近期 CMC 请求耗时，用于计算对冲阈值
+_latencies = LatencyTracker()
+
+# 可重试的 HTTP 状态码：限流与服务端临时错误
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# API Key 无效、欠费或套餐不支持该端点：对所有请求都一样，既不重试也不拆分批次
+_AUTH_STATUS = {401, 402, 403}
+# 对应的 CMC 错误码（API_KEY_INVALID ... API_KEY_DISABLED）
+_AUTH_ERROR_CODES = set(range(1001, 1008))
+
+class CMCAuthError(Exception):
+    """CMC 鉴权或套餐错误。继续请求没有意义，也不能据此把代币记入死信，应中止本次运行"""
+
+def _check_auth_status(status: Any):
+    """响应的 status.error_code 为鉴权或套餐错误时抛出 CMCAuthError"""
+    if isinstance(status, dict) and status.get("error_code") in _AUTH_ERROR_CODES:
+        raise CMCAuthError(f"CMC 鉴权失败 ({status.get('error_code')}): {status.get('error_message')}")
+
+def _hedge_threshold() -> Optional[float]:
+    """返回对冲等待时间；未启用或样本不足时返回 None"""
+    if not HTTP_CONFIG["hedge_enabled"] or len(_latencies) < HTTP_CONFIG["hedge_min_samples"]:
+        return None
+    return max(HTTP_CONFIG["hedge_min_delay"], _latencies.percentile(HTTP_CONFIG["hedge_percentile"]))
+
+def _endpoint_label(url: str) -> str:
+    """把请求 URL 还原为 CMC_CONFIG 中的端点名，用作指标标签"""
+    for endpoint_key, path in CMC_CONFIG["endpoints"].items():
+        if url.endswith(path):
+            return endpoint_key
+    return "other"
+
+def _get(url: str, headers: Dict, params: Dict, stream: bool = False) -> requests.Response:
+    """
+    通过共享连接池发送一次 GET 请求，耗时超过 p95 时按配置发起对冲请求。
+
+    stream 为 True 时只读取响应头，响应体由调用方边读边解析；这类请求不对冲，
+    因为落后一方的响应体无人读取，会一直占用连接。
+    """
+    session = get_session()
+    endpoint = _endpoint_label(url)
+
+    def call() -> requests.Response:
+        start = time.perf_counter()
+        response = session.get(url=url, headers=headers, params=params, timeout=request_timeout(), stream=stream)
+        elapsed = time.perf_counter() - start
+        _latencies.record(elapsed)
+        observe("cmc_request_seconds", elapsed, endpoint=endpoint)
+        inc("cmc_requests_total", endpoint=endpoint, status=response.status_code)
+        if stream and not response.ok:
+            response.content  # 错误响应体很小，读完以便释放连接并保留错误信息
+        response.raise_for_status()
+        return response
+
+    # 对冲请求同样消耗调用配额，令牌不足时不对冲
+    return hedged_call(call, None if stream else _hedge_threshold(), _cmc_limiter.try_acquire)
+
+def _make_request_with_retry(url: str, headers: Dict, params: Dict, max_retries: Optional[int] = None,
+                             stream: bool = False) -> requests.Response:
+    """
+    带重试机制的请求函数，每次尝试前都从共享令牌桶获取配额。
+
+    429/5xx 与网络错误按带抖动的指数退避重试，响应带 Retry-After 时按其等待；其他 HTTP 错误直接抛出。
+    """
+    max_retries = max_retries or HTTP_CONFIG["max_retries"]
     for attempt in range(max_retries):
+        waited = _cmc_limiter.acquire()
+        if waited:
+            inc("rate_limit_wait_seconds_total", waited, limiter="cmc")
         try:
-            response = requests.get(url=url, headers=headers, params=params, timeout=30)
-            response.raise_for_status()
-            return response
+            return _get(url, headers, params, stream)
         except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:  # Too Many Requests
-                wait_time = (attempt + 1) * 10  # 递增等待时间：10s, 20s, 30s
-                print(f"⚠️ API限流，等待 {wait_time} 秒后重试 (尝试 {attempt + 1}/{max_retries})...")
-                time.sleep(wait_time)
-                if attempt == max_retries - 1:
-                    raise  # 最后一次尝试失败，抛出异常
-            else:
-                raise  # 其他HTTP错误直接抛出
+            status_code = e.response.status_code
+            if status_code in _AUTH_STATUS:
+                raise CMCAuthError(f"CMC 鉴权失败 (HTTP {status_code})，请检查 API Key 与套餐: {e}") from e
+            if status_code == 429:
+                inc("rate_limited_total", service="cmc")
+            if status_code not in _RETRYABLE_STATUS or attempt == max_retries - 1:
+                raise  # 不可重试的错误或最后一次尝试失败，抛出异常
+            retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+            wait_time = retry_after if retry_after is not None else backoff_delay(
+                attempt, HTTP_CONFIG["backoff_base"], HTTP_CONFIG["backoff_cap"])
+            reason = "API限流" if status_code == 429 else f"服务端错误 {status_code}"
+            print(f"⚠️ {reason}，等待 {wait_time:.1f} 秒后重试 (尝试 {attempt + 1}/{max_retries})...")
+            inc("retries_total", service="cmc", reason=status_code)
+            inc("backoff_seconds_total", wait_time, service="cmc")
+            time.sleep(wait_time)
         except requests.exceptions.RequestException as e:
             if attempt == max_retries - 1:
                 raise  # 最后一次尝试失败，抛出异常
-            wait_time = (attempt + 1) * 5  # 网络错误等待时间较短
-            print(f"⚠️ 网络错误，等待 {wait_time} 秒后重试 (尝试 {attempt + 1}/{max_retries})...")
+            wait_time = backoff_delay(attempt, HTTP_CONFIG["backoff_base"], HTTP_CONFIG["backoff_cap"])
+            print(f"⚠️ 网络错误，等待 {wait_time:.1f} 秒后重试 (尝试 {attempt + 1}/{max_retries}): {e}")
+            inc("retries_total", service="cmc", reason="network")
+            inc("backoff_seconds_total", wait_time, service="cmc")
             time.sleep(wait_time)
 
-def _fetch_in_batches(ucids: List[int], endpoint_key: str, params_extra: Dict = None) -> Dict[str, Any]:
-    """通用批量获取函数"""
-    data_map: Dict[str, Any] = {}
-    total_batches = (len(ucids) + BATCH_SIZE - 1) // BATCH_SIZE
-
-    for batch_idx in range(total_batches):
-        start_idx = batch_idx * BATCH_SIZE
-        end_idx = start_idx + BATCH_SIZE
-        batch_ucids_str = ",".join(map(str, ucids[start_idx:end_idx]))
-
-        params = {"id": batch_ucids_str}
-        if params_extra:
-            params.update(params_extra)
-
+class _BatchError(Exception):
+    """
+    批次级错误。bisectable 为 True 表示错误由批次内容引起（错误信息中列出了无效 ID），
+    可通过剔除或拆分批次定位出问题 ID；未列出 ID 的 400、网络错误、限流重试耗尽、解析失败等其他错误则整批失败。
+    """
+
+    def __init__(self, message: str, bisectable: bool, invalid_ids: Optional[List[int]] = None):
+        super().__init__(message)
+        self.bisectable = bisectable
+        self.invalid_ids = invalid_ids or []
+
+# CMC 对无效 ID 的错误信息，例如：Invalid values for "id": "1,99"
+_INVALID_ID_PATTERN = re.compile(r'Invalid values? for "id": "([\d,\s]+)"')
+
+def _parse_invalid_ids(error_msg: str) -> List[int]:
+    match = _INVALID_ID_PATTERN.search(error_msg or "")
+    if not match:
+        return []
+    return [int(x) for x in match.group(1).split(",") if x.strip().isdigit()]
+
+def _record_credits(status: Dict[str, Any], endpoint_key: str, id_count: int):
+    """按响应中的 credit_count 记录实际消耗，缺失时按计费规则估算"""
+    credit_count = status.get("credit_count")
+    record_credits(credit_count if isinstance(credit_count, int) else request_credits(endpoint_key, id_count))
+
+def _request_batch(endpoint_key: str, batch_ucids: List[int], params_extra: Dict = None) -> Dict[str, Any]:
+    """请求单个批次并校验响应，失败时抛出 _BatchError"""
+    params = {"id": ",".join(map(str, batch_ucids))}
+    if params_extra:
+        params.update(params_extra)
+
+    try:
+        response = _make_request_with_retry(
+            url=f"{CMC_CONFIG['base_url']}{CMC_CONFIG['endpoints'][endpoint_key]}",
+            headers=CMC_CONFIG["headers"],
+            params=params
+        )
+    except requests.exceptions.HTTPError as e:
+        status_code = e.response.status_code if e.response is not None else None
+        error_msg = str(e)
         try:
-            response = _make_request_with_retry(
-                url=f"{CMC_CONFIG['base_url']}{CMC_CONFIG['endpoints'][endpoint_key]}",
-                headers=CMC_CONFIG["headers"],
-                params=params
-            )
-
-            try:
-                data = response.json()
-            except ValueError as e:
-                print(f"❌ {endpoint_key} JSON 解析失败 (批次 {batch_idx+1}): {e}")
-                continue
-
-            # 安全地检查响应结构
-            if not isinstance(data, dict):
-                print(f"❌ {endpoint_key} 响应格式错误 (批次 {batch_idx+1}): 期望字典但得到 {type(data)}")
-                continue
-
-            status = data.get("status", {})
-            if isinstance(status, dict) and status.get("error_code") == 0:
-                response_data = data.get("data")
-                if response_data:
-                    data_map.update(response_data)
-                    print(f"✅ {endpoint_key} 拉取：第 {batch_idx+1}/{total_batches} 批成功")
-                else:
-                    print(f"⚠️ {endpoint_key} 响应无数据 (批次 {batch_idx+1})")
+            error_msg = loads(e.response.content)["status"]["error_message"] or error_msg
+        except (ValueError, KeyError, TypeError, AttributeError):
+            pass
+        # 只有错误信息列出了无效 ID 时才由批次内容引起；参数错误等其他 400 对拆分后的批次同样会出现，整批失败
+        invalid_ids = _parse_invalid_ids(error_msg)
+        raise _BatchError(f"请求失败 (HTTP {status_code}): {error_msg}", bool(invalid_ids), invalid_ids)
+    except requests.exceptions.RequestException as e:
+        raise _BatchError(f"请求失败: {e}", bisectable=False)
+
+    try:
+        # 解析在拉取线程池中进行，单独作为一个阶段，便于区分大体积 info 响应的解析开销
+        with profile_stage("decode"):
+            data = loads(response.content)
+    except ValueError as e:
+        raise _BatchError(f"JSON 解析失败: {e}", bisectable=False)
+
+    # 安全地检查响应结构
+    if not isinstance(data, dict):
+        raise _BatchError(f"响应格式错误: 期望字典但得到 {type(data)}", bisectable=False)
+
+    status = data.get("status", {})
+    if isinstance(status, dict) and status.get("error_code") == 0:
+        _record_credits(status, endpoint_key, len(batch_ucids))
+        return data.get("data") or {}
+    _check_auth_status(status)
+    error_msg = status.get("error_message", "未知错误") if isinstance(status, dict) else "状态格式错误"
+    invalid_ids = _parse_invalid_ids(error_msg)
+    raise _BatchError(f"API 错误: {error_msg}", bisectable=bool(invalid_ids), invalid_ids=invalid_ids)
+
+def _fetch_batch(endpoint_key: str, batch_ucids: List[int], batch_label: str, params_extra: Dict = None,
+                 dead_letters: Optional[Dict[int, str]] = None, parent_error: Optional[str] = None) -> Dict[str, Any]:
+    """
+    拉取单个批次，失败时返回空字典。
+
+    由批次内容引起的失败（错误信息列出了无效 ID）会定位问题 ID：列出的无效 ID 被剔除后重试其余部分；
+    列出的 ID 不在本批次中时把批次对半拆分递归重试，最终无法获取的单个 ID 记入 dead_letters。
+    拆分到单个 ID 时仍报与上层批次相同的错误，说明错误与 ID 无关，不记入死信。
+    """
+    try:
+        response_data = _request_batch(endpoint_key, batch_ucids, params_extra)
+    except _BatchError as e:
+        print(f"❌ {endpoint_key} 批次 {batch_label} 失败 ({len(batch_ucids)} 个 ID): {e}")
+        if not e.bisectable:
+            return {}
+
+        invalid = [ucid for ucid in e.invalid_ids if ucid in batch_ucids]
+        if invalid and len(invalid) < len(batch_ucids):
+            for ucid in invalid:
+                _add_dead_letter(dead_letters, ucid, endpoint_key, str(e))
+            remaining = [ucid for ucid in batch_ucids if ucid not in invalid]
+            print(f"🔁 {endpoint_key} 批次 {batch_label} 剔除 {len(invalid)} 个无效 ID 后重试其余 {len(remaining)} 个")
+            return _fetch_batch(endpoint_key, remaining, f"{batch_label}r", params_extra, dead_letters)
+
+        if len(batch_ucids) == 1:
+            if str(e) == parent_error:
+                print(f"⚠️ {endpoint_key} UCID {batch_ucids[0]} 与上层批次报错相同，不记入死信")
             else:
-                error_msg = status.get("error_message", "未知错误") if isinstance(status, dict) else "状态格式错误"
-                print(f"❌ {endpoint_key} API 错误 (批次 {batch_idx+1}): {error_msg}")
-
-        except requests.exceptions.RequestException as e:
-            print(f"❌ {endpoint_key} 请求失败 (批次 {batch_idx+1}): {e}")
-
-        time.sleep(REQUEST_DELAY)
-
+                _add_dead_letter(dead_letters, batch_ucids[0], endpoint_key, str(e))
+            return {}
+
+        middle = len(batch_ucids) // 2
+        print(f"🔪 {endpoint_key} 批次 {batch_label} 拆分为 {middle} + {len(batch_ucids) - middle} 个 ID 后重试")
+        data = _fetch_batch(endpoint_key, batch_ucids[:middle], f"{batch_label}a", params_extra, dead_letters, str(e))
+        data.update(_fetch_batch(endpoint_key, batch_ucids[middle:], f"{batch_label}b", params_extra, dead_letters,
+                                 str(e)))
+        return data
+
+    if response_data:
+        print(f"✅ {endpoint_key} 拉取：批次 {batch_label} 成功")
+    else:
+        print(f"⚠️ {endpoint_key} 响应无数据 (批次 {batch_label})")
+    return dict(response_data)
+
+def _add_dead_letter(dead_letters: Optional[Dict[int, str]], ucid: int, endpoint_key: str, reason: str):
+    print(f"☠️ {endpoint_key} UCID {ucid} 无法获取，加入死信列表: {reason}")
+    if dead_letters is not None:
+        dead_letters[ucid] = f"{endpoint_key}: {reason}"
+
+def _submit_batches(executor: ThreadPoolExecutor, ucids: List[int], endpoint_key: str,
+                    params_extra: Dict = None, dead_letters: Optional[Dict[int, str]] = None) -> List[Future]:
+    """把某个端点的所有批次提交到线程池，每批的 ID 数由 credit_planner 按计费单位与 URL 长度确定"""
+    batch_size = batch_size_for(endpoint_key)
+    total_batches = (len(ucids) + batch_size - 1) // batch_size
+    return [
+        executor.submit(_fetch_batch, endpoint_key, ucids[batch_idx * batch_size:(batch_idx + 1) * batch_size],
+                        f"{batch_idx + 1}/{total_batches}", params_extra, dead_letters)
+        for batch_idx in range(total_batches)
+    ]
+
+def _split_cached(endpoint_key: str, ucids: List[int]) -> Tuple[Dict[str, Any], List[int]]:
+    """只有 info 端点使用缓存：返回 (TTL 内的缓存数据, 缺失或过期需要请求的 UCID)"""
+    cache = get_info_cache() if endpoint_key == "info" else None
+    if cache is None:
+        return {}, ucids
+    cached = cache.get_many(ucids)
+    missing = [ucid for ucid in ucids if str(ucid) not in cached]
+    credits_saved = plan_calls(endpoint_key, len(ucids))[1] - plan_calls(endpoint_key, len(missing))[1]
+    cache.record_lookup(len(cached), len(missing), credits_saved)
+    if cached:
+        print(f"📦 {endpoint_key} 缓存命中 {len(cached)}/{len(ucids)}，只需请求 {len(missing)} 个代币")
+    return cached, missing
+
+def _cancel(futures: List[Future]):
+    """鉴权错误对所有批次都一样，取消尚未开始的批次"""
+    for future in futures:
+        future.cancel()
+
+def _collect_batches(endpoint_key: str, futures: List[Future], cached: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """合并各批次结果；提供 cached 时把新拉取的数据写入缓存并与缓存数据合并"""
+    data_map: Dict[str, Any] = {}
+    try:
+        for future in futures:
+            data_map.update(future.result())
+    except CMCAuthError:
+        _cancel(futures)
+        raise
+    if cached is not None:
+        cache = get_info_cache()
+        if cache and data_map:
+            cache.put_many(data_map)
+        data_map.update(cached)
     print(f"✅ {endpoint_key} 数据拉取完成，共获取 {len(data_map)} 个代币的数据")
     return data_map
 
+def _fetch_in_batches(ucids: List[int], endpoint_key: str, params_extra: Dict = None,
+                      dead_letters: Optional[Dict[int, str]] = None) -> Dict[str, Any]:
+    """通用批量获取函数：只请求缓存中缺失或过期的 UCID，批次并发拉取，总速率由共享令牌桶限制"""
+    cached, ucids = _split_cached(endpoint_key, ucids)
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix=f"cmc-{endpoint_key}") as executor:
+        futures = _submit_batches(executor, ucids, endpoint_key, params_extra, dead_letters)
+        return _collect_batches(endpoint_key, futures, cached)
 
-def fetch_ucids() -> List[int]:
-    """获取所有代币的 UCID 列表 - 使用分页获取全部数据"""
-    print("ℹ️  正在获取所有代币的 UCID (分页获取全部数据)...")
 
-    all_ucids = []
-    start = 1  # CoinMarketCap API 从1开始计数
-    limit = 5000  # 每页最大数量
-    page = 1
+# map 接口单页最大数量
+MAP_PAGE_LIMIT = 5000
 
-    while True:
-        print(f"📄 正在获取第 {page} 页数据 (从第 {start} 个代币开始)...")
+def _fetch_map_page(start: int, limit: int, label: str) -> Optional[List[int]]:
+    """
+    按 id 升序拉取一页 active 代币的 UCID；请求或响应出错时返回 None，无数据时返回空列表。
 
+    一页最多 5000 个代币，响应边下载边解析，只保留每个代币的 id，整页数据不会在内存中完整出现。
+    流式读取响应体时的网络错误发生在请求重试之外，在这里按同样的退避规则重试整页。
+    """
+    max_retries = HTTP_CONFIG["max_retries"]
+    for attempt in range(max_retries):
         try:
             response = _make_request_with_retry(
                 url=f"{CMC_CONFIG['base_url']}{CMC_CONFIG['endpoints']['map']}",
                 headers=CMC_CONFIG["headers"],
                 params={
                     "start": start,
-                    "limit": limit
-                }
+                    "limit": limit,
+                    "sort": "id",
+                    "listing_status": "active"
+                },
+                stream=True
             )
+        except requests.exceptions.RequestException as e:
+            print(f"❌ {label}请求失败：{e}")
+            return None
 
-            try:
-                data = response.json()
-            except ValueError as e:
-                print(f"❌ 第 {page} 页 JSON 解析失败: {e}")
-                break
-
-            # 安全地检查响应结构
-            if not isinstance(data, dict):
-                print(f"❌ 第 {page} 页响应格式错误: 期望字典但得到 {type(data)}")
-                break
-
-            status = data.get("status", {})
-            if not (isinstance(status, dict) and status.get("error_code") == 0):
-                error_msg = status.get("error_message", "未知错误") if isinstance(status, dict) else "状态格式错误"
-                print(f"❌ 第 {page} 页 API 错误：{error_msg}")
-                break
-
-            page_data = data.get("data")
-            if not page_data or not isinstance(page_data, list):
-                print(f"⚠️ 第 {page} 页无数据或数据格式错误")
-                break
-
-            # 提取当前页的 UCID
-            page_ucids = []
-            for coin in page_data:
+        rest: Dict[str, Any] = {}
+        page_ucids = []
+        count = 0
+        try:
+            for coin in iter_array(response.iter_content(JSON_CONFIG["stream_chunk_size"]), "data", rest):
+                count += 1
                 if isinstance(coin, dict) and "id" in coin:
                     page_ucids.append(coin["id"])
                 else:
                     print(f"⚠️ 跳过无效的代币数据: {coin}")
+            break
+        except requests.exceptions.RequestException as e:
+            if attempt == max_retries - 1:
+                print(f"❌ {label}读取响应失败：{e}")
+                return None
+            wait_time = backoff_delay(attempt, HTTP_CONFIG["backoff_base"], HTTP_CONFIG["backoff_cap"])
+            print(f"⚠️ {label}读取响应中断，等待 {wait_time:.1f} 秒后重试 (尝试 {attempt + 1}/{max_retries}): {e}")
+            inc("retries_total", service="cmc", reason="network")
+            inc("backoff_seconds_total", wait_time, service="cmc")
+            time.sleep(wait_time)
+        except ValueError as e:
+            # 顶层不是对象时也会在这里报错
+            print(f"❌ {label} JSON 解析失败: {e}")
+            return None
+        finally:
+            response.close()
+
+    status = rest.get("status", {})
+    _check_auth_status(status)
+    if not (isinstance(status, dict) and status.get("error_code") == 0):
+        error_msg = status.get("error_message", "未知错误") if isinstance(status, dict) else "状态格式错误"
+        print(f"❌ {label} API 错误：{error_msg}")
+        return None
+    _record_credits(status, "map", limit)
+
+    if not count:
+        print(f"⚠️ {label}无数据或数据格式错误")
+        return []
+    return page_ucids
+
+def full_discovery_calls(ucid_count: int) -> int:
+    """全量拉取 ucid_count 个代币的 UCID 列表所用的 map 请求数：不足一页的一页结束，恰好整页时还要多请求一页"""
+    return ucid_count // MAP_PAGE_LIMIT + 1
 
-            if not page_ucids:
-                print(f"⚠️ 第 {page} 页没有有效的代币数据，停止获取")
-                break
-
-            all_ucids.extend(page_ucids)
-            print(f"✅ 第 {page} 页获取成功，本页 {len(page_ucids)} 个代币，累计 {len(all_ucids)} 个代币")
+def fetch_ucids() -> List[int]:
+    """获取所有代币的 UCID 列表 - 使用分页获取全部数据"""
+    print("ℹ️  正在获取所有代币的 UCID (分页获取全部数据)...")
 
-            # 如果本页数据少于 limit，说明已经是最后一页
-            if len(page_ucids) < limit:
-                print(f"📄 已到达最后一页 (第 {page} 页)")
-                break
+    all_ucids = []
+    start = 1  # CoinMarketCap API 从1开始计数
+    limit = MAP_PAGE_LIMIT
+    page = 1
 
-            # 准备下一页
-            start += limit
-            page += 1
+    while True:
+        print(f"📄 正在获取第 {page} 页数据 (从第 {start} 个代币开始)...")
+        page_ucids = _fetch_map_page(start, limit, f"第 {page} 页")
+        if not page_ucids:
+            if page_ucids == []:
+                print(f"⚠️ 第 {page} 页没有有效的代币数据，停止获取")
+            break
 
-            # 添加请求间隔，避免API限流
-            time.sleep(REQUEST_DELAY)
+        all_ucids.extend(page_ucids)
+        print(f"✅ 第 {page} 页获取成功，本页 {len(page_ucids)} 个代币，累计 {len(all_ucids)} 个代币")
 
-        except requests.exceptions.RequestException as e:
-            print(f"❌ 第 {page} 页请求失败：{e}")
+        # 如果本页数据少于 limit，说明已经是最后一页
+        if len(page_ucids) < limit:
+            print(f"📄 已到达最后一页 (第 {page} 页)")
             break
 
+        # 准备下一页
+        start += limit
+        page += 1
+
     print(f"🎉 UCID 全量获取完成！总共获取 {len(all_ucids)} 个代币")
     return all_ucids
 
-def fetch_coin_details(ucids: List[int]) -> Dict[str, Any]:
-    """批量获取代币详情"""
-    return _fetch_in_batches(ucids, "info")
-
-def fetch_market_data(ucids: List[int]) -> Dict[str, Any]:
-    """批量获取市场数据"""
-    return _fetch_in_batches(ucids, "quotes", CMC_CONFIG["quotes_params"])
+def fetch_new_ucids(known_count: int, max_known_id: int) -> Optional[List[int]]:
+    """
+    增量发现新上架代币：map 按 id 升序排列，新代币的 ID 总是大于已知最大 ID，
+    因此从已知数量附近开始拉取即可，通常只需一次请求。
+
+    若期间有代币下架导致起点之后的第一个 ID 已大于 max_known_id（无法确认与已知列表重叠），
+    则把起点前移一页后重试。请求失败时返回 None，由调用方回退到全量拉取。
+    """
+    print(f"ℹ️  增量发现新代币 (已知 {known_count} 个，最大 ID {max_known_id})...")
+    start = max(1, known_count - UCID_DISCOVERY_OVERLAP + 1)
+    new_ucids: List[int] = []
+    first_page = True
+    while True:
+        page_ucids = _fetch_map_page(start, MAP_PAGE_LIMIT, f"增量发现 (从第 {start} 个代币开始) ")
+        if page_ucids is None:
+            return None
+        if first_page and start > 1 and (not page_ucids or page_ucids[0] > max_known_id):
+            start = max(1, start - MAP_PAGE_LIMIT)
+            print(f"⚠️ 未与已知列表重叠，起点前移到第 {start} 个代币后重试")
+            continue
+        first_page = False
+        new_ucids.extend(ucid for ucid in page_ucids if ucid > max_known_id)
+        if len(page_ucids) < MAP_PAGE_LIMIT:
+            break
+        start += MAP_PAGE_LIMIT
+
+    print(f"🎉 增量发现完成，新增 {len(new_ucids)} 个代币")
+    return new_ucids
+
+def fetch_coin_details(ucids: List[int], dead_letters: Optional[Dict[int, str]] = None) -> Dict[str, Any]:
+    """批量获取代币详情；无法获取的 UCID 及原因写入 dead_letters"""
+    return _fetch_in_batches(ucids, "info", dead_letters=dead_letters)
+
+def fetch_market_data(ucids: List[int], dead_letters: Optional[Dict[int, str]] = None) -> Dict[str, Any]:
+    """批量获取市场数据；无法获取的 UCID 及原因写入 dead_letters"""
+    return _fetch_in_batches(ucids, "quotes", CMC_CONFIG["quotes_params"], dead_letters)
+
+def fetch_details_and_market_data(ucids: List[int], dead_letters: Optional[Dict[int, str]] = None
+                                  ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """在同一线程池中并行拉取代币详情与市场数据，两者共享速率配额；详情只请求缓存中缺失或过期的 UCID"""
+    cached_info, info_ucids = _split_cached("info", ucids)
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="cmc-fetch") as executor:
+        info_futures = _submit_batches(executor, info_ucids, "info", dead_letters=dead_letters)
+        quotes_futures = _submit_batches(executor, ucids, "quotes", CMC_CONFIG["quotes_params"], dead_letters)
+        try:
+            return (_collect_batches("info", info_futures, cached_info),
+                    _collect_batches("quotes", quotes_futures))
+        except CMCAuthError:
+            _cancel(quotes_futures)
+            raise
 
 def extract_social_data(links: Dict[str, Any]) -> Dict[str, Any]:
     """提取社交数据"""
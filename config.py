@@ -6,8 +6,47 @@ from pinecone import PodSpec, ServerlessSpec
 load_dotenv()
 
 # -------------------------- 基础配置 --------------------------
-BATCH_SIZE = 50  # 批量拉取大小（CMC 免费版建议 50-100）
-REQUEST_DELAY = 5  # 请求间隔（秒），避免 API 限流 - 增加到5秒
+# CMC 套餐与计费规则：info / quotes 每返回 100 个代币计 1 个 credit（不足 100 按 100 计），map 每次请求 1 个 credit；
+# 每次请求的 ID 数由 credit_planner 按以下上限与 URL 长度限制计算
+CMC_PLAN_CONFIG = {
+    "daily_credit_budget": int(os.getenv("CMC_DAILY_CREDIT_BUDGET", "333")),  # Basic 套餐每月 10000 credits；设为 0 不限制
+    "ids_per_credit": 100,
+    "max_ids_per_call": {"info": 1000, "quotes": 1000},  # 单次请求允许的最大 ID 数
+    "max_url_length": 4000,  # 请求 URL 的安全长度上限
+    "max_id_digits": 6,  # 估算 URL 长度时按每个 ID 最多 6 位计算
+}
+
+# -------------------------- 限流与并发配置 --------------------------
+# CMC 套餐每分钟允许的调用次数（Basic 免费版为 30），所有拉取线程共享该配额
+CMC_CALLS_PER_MINUTE = int(os.getenv("CMC_CALLS_PER_MINUTE", "30"))
+CMC_RATE_BURST = 3  # 令牌桶容量，即允许的瞬时突发请求数
+FETCH_CONCURRENCY = 4  # 并发拉取线程数，设为 1 即退化为串行拉取
+
+# -------------------------- HTTP 连接配置 --------------------------
+HTTP_CONFIG = {
+    "pool_size": FETCH_CONCURRENCY * 2,  # 连接池大小，需覆盖并发拉取线程数与对冲请求
+    "connect_timeout": 5,  # 建立连接超时（秒）
+    "read_timeout": 30,  # 读取响应超时（秒）
+    "max_retries": 3,  # 429/5xx/网络错误的最大尝试次数
+    "backoff_base": 2,  # 指数退避基数（秒），实际等待带随机抖动
+    "backoff_cap": 60,  # 单次退避上限（秒）
+    # 对冲请求：单次请求耗时超过近期 p95 延迟仍未返回时，再发一个相同请求，取先返回的结果
+    "hedge_enabled": os.getenv("CMC_HEDGE_REQUESTS", "false").lower() == "true",
+    "hedge_percentile": 0.95,
+    "hedge_min_samples": 20,  # 积累到该数量的延迟样本后才启用对冲
+    "hedge_min_delay": 0.5,  # 对冲等待时间下限（秒），避免在延迟很低时成倍增加请求
+}
+
+# -------------------------- 流水线配置 --------------------------
+# 每个流水线块至少包含的代币数；实际块大小向上取整到 CMC 单次请求 ID 数的整数倍（见 credit_planner.pipeline_chunk_size），
+# 否则每块的 /info 与 /quotes 请求都达不到批次上限，请求数与 credits 都会增加
+PIPELINE_CHUNK_SIZE = 192
+PIPELINE_QUEUE_SIZE = 2  # 各阶段之间队列的最大积压块数，用于限制峰值内存
+STATE_STORE_PATH = "sync_state.db"  # 本地同步状态库（SQLite），每个 UCID 一行
+DEAD_LETTER_RETRY_DAYS = 30  # 死信 UCID 在该天数内直接跳过，之后重新尝试一次
+UCID_FULL_RECONCILE_DAYS = 7  # 每日只增量发现新代币，超过该天数后做一次全量 map 对账以识别下架代币
+UCID_DISCOVERY_OVERLAP = 500  # 增量发现时在已知数量之前多取的条数，用于确认与已知列表重叠
+SYNC_JOURNAL_DIR = "sync_journal"  # 全量同步进度日志目录，用于 `python main.py --resume` 断点续传
 
 # -------------------------- CoinMarketCap API 配置 --------------------------
 CMC_CONFIG = {
@@ -29,21 +68,135 @@ CMC_CONFIG = {
 
 # -------------------------- Pinecone 配置 (已更新) --------------------------
 # Llama-2 text embedding v2 支持的维度: 1024, 2048, 768, 512, 384
+EMBEDDING_MODEL = "llama-text-embed-v2"
+EMBEDDING_INPUT_TYPE = "passage"
 EMBEDDING_MODEL_DIMENSION = 1024
 
+# 向量化调度：按 Token 估算打包批次，并在每分钟 Token 配额的滑动窗口内尽快发出
+EMBEDDING_CONFIG = {
+    "max_batch_inputs": 96,  # llama-text-embed-v2 单次请求最多 96 条输入
+    "max_input_tokens": 2048,  # 单条输入的 Token 上限，超出部分会被截断
+    "tokens_per_minute": int(os.getenv("PINECONE_EMBED_TPM", "250000")),  # 项目的每分钟 Token 配额
+    "max_retries": 5,  # 限流时的最大重试次数
+    "backoff_base": 5,  # 没有 Retry-After 时的指数退避基数（秒）
+    "backoff_cap": 60,  # 单次退避的最长等待（秒）
+}
+
+# CMC /info 响应缓存：代币静态信息很少变化，TTL 内直接复用，不再消耗 credits
+# TTL 必须小于每日更新的间隔（24 小时）：上次每日更新写入的缓存到下次运行时已过期，描述、标签与链接的变化
+# 每天都能被识别；缓存只在同一天内的分层刷新、断点续传与分片重跑之间复用
+INFO_CACHE_CONFIG = {
+    "enabled": os.getenv("CMC_INFO_CACHE", "true").lower() == "true",
+    "path": "info_cache.db",
+    "ttl_hours": float(os.getenv("CMC_INFO_CACHE_TTL_HOURS", "20")),
+}
+
+# 本地向量缓存：按 模型 + input_type + 文本哈希 复用已生成的向量
+EMBEDDING_CACHE_CONFIG = {
+    "enabled": True,
+    "path": "embedding_cache.db",
+    "max_entries": 50000,  # 超出后按最近使用时间淘汰
+    "max_age_days": 30,  # 超过该天数的向量视为过期
+}
+
+# 元数据预算：Pinecone 单条向量的元数据上限为 40KB，且元数据越大，upsert 请求、存储与每次带元数据的查询响应都越大。
+# 超出字段预算（序列化后的字节数）的字段在索引中只保留截断的预览，完整值压缩后存入 blob 存储，
+# 字段名记录在元数据的 blob_fields 中，需要时按向量 ID 读取（pinecone_manager.fetch_token_metadata / token_lookup.py）。
+# blob 存储与状态库一样提交回仓库；分片同步时各分片写入各自的文件，由 --merge-shards 合并
+METADATA_BUDGET_CONFIG = {
+    "max_bytes": int(os.getenv("PINECONE_METADATA_MAX_BYTES", "40960")),  # 单条向量元数据的总上限
+    "field_budgets": {
+        "description": 1000,
+        "all_contracts": 1500,
+        "tags": 1000,
+        "website": 512,
+        "whitepaper": 512,
+        "twitter_url": 512,
+    },
+    "default_field_budget": 512,  # 总量超限时被移出的其他字段保留的预览大小
+    "blob_store_path": "metadata_blobs.db",
+    "compress_level": 6,  # zlib 压缩级别
+}
+
 PINECONE_CONFIG = {
     "api_key": os.getenv("PINECONE_API_KEY"),
     "index_name": "coindata",
     "metric": "cosine",
+    # 数据面传输方式：grpc（protobuf 编码 + 持久通道，需要 pinecone[grpc]）或 rest
+    "transport": os.getenv("PINECONE_TRANSPORT", "grpc"),
     # PodSpec 用于指定云和区域。请根据您的 Pinecone 项目环境修改
     # ServerlessSpec 仅在特定 AWS 区域可用
     "spec": ServerlessSpec(cloud="aws", region="us-east-1") 
 }
 
+# 上传引擎：按序列化字节数打包批次并发上传
+UPSERT_CONFIG = {
+    "max_request_bytes": 1_800_000,  # Pinecone 单次请求上限为 2MB，预留余量
+    "max_batch_vectors": 1000,  # Pinecone 单次 upsert 最多 1000 条向量
+    "concurrency": 4,  # 同时在途的 upsert 请求数
+    "max_retries": 3,  # 单个批次失败后的重试次数，耗尽后对半拆分
+}
+
+# -------------------------- 分层刷新配置 --------------------------
+# 按 CMC 排名给每个代币分配刷新间隔，排名越靠前刷新越频繁；没有排名的代币归入最后一档
+REFRESH_TIERS = [
+    {"name": "hot", "max_rank": 200, "interval_hours": 1},
+    {"name": "warm", "max_rank": 1000, "interval_hours": 6},
+    {"name": "mid", "max_rank": 5000, "interval_hours": 24},
+    {"name": "tail", "max_rank": None, "interval_hours": 168},
+]
+REFRESH_MAX_COINS_PER_RUN = int(os.getenv("REFRESH_MAX_COINS_PER_RUN", "2000"))  # 每次分层刷新最多处理的代币数
+
+# -------------------------- 下架同步配置 --------------------------
+DELISTING_CONFIG = {
+    "grace_reconciles": 2,  # 连续多少次全量对账缺失才视为下架，防止 map 偶发缺漏误删
+    "max_delete_fraction": 0.2,  # 单次待删除数量超过 active 代币的该比例时放弃删除，防止列表拉取不完整时误删
+    "delete_batch_size": 1000,  # Pinecone 单次 delete 最多 1000 个 ID
+    "concurrency": 4,  # 同时在途的 delete 请求数
+    "max_retries": 3,
+}
+
+# -------------------------- 蓝绿重建配置 --------------------------
+# 全量重建写入新的命名空间（一代），校验通过后切换读取指针；旧一代保留一段时间以便回滚，之后再删除
+GENERATION_CONFIG = {
+    "meta_namespace": "_meta",  # 保存读取指针的命名空间
+    "pointer_id": "active-generation",  # 读取指针向量的 ID
+    "retain_hours": float(os.getenv("PINECONE_RETAIN_GENERATION_HOURS", "24")),  # 旧一代在切换后保留的小时数
+    "validate_fetch_batch": 200,  # 校验时每次 fetch 的 ID 数
+}
+
+# -------------------------- 运行指标配置 --------------------------
+# 每次运行结束时导出：JSON Lines 日志（追加）与 Prometheus textfile（供 node_exporter 的 textfile collector 采集）
+METRICS_CONFIG = {
+    "enabled": os.getenv("METRICS_ENABLED", "true").lower() == "true",
+    "jsonl_path": os.getenv("METRICS_JSONL_PATH", "metrics/metrics.jsonl"),
+    "textfile_dir": os.getenv("METRICS_TEXTFILE_DIR", "metrics"),  # 每个任务写入 <前缀><任务名>.prom
+    "prefix": "coin_sync_",  # 指标名前缀
+    "latency_buckets": (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),  # 耗时直方图的桶上界（秒）
+}
+
+# -------------------------- 性能剖析配置 --------------------------
+# 仅在命令行传入 --profile 时启用，正常运行不产生任何开销
+PROFILE_CONFIG = {
+    "output_dir": "profiles",  # 每次运行写入 <output_dir>/<任务名>-<时间>/
+    "top_n": 25,  # 报告中列出的函数与内存分配位置数
+    "sample_interval": 0.01,  # 调用栈采样间隔（秒），用于生成火焰图
+}
+
+# -------------------------- JSON 编解码配置 --------------------------
+# 安装 orjson 时用它解析 CMC 响应、读写本地缓存与状态文件，未安装时回退到标准库 json（结果一致）
+JSON_CONFIG = {
+    "backend": os.getenv("JSON_BACKEND", "auto").lower(),  # auto：有 orjson 则用；stdlib：强制使用标准库
+    "stream_chunk_size": 64 * 1024,  # 流式解析 map 响应时每次读取的字节数
+}
+
 # -------------------------- 数据字段配置 --------------------------
 METADATA_FIELDS = [
     "cmc_id", "logo", "name", "symbol", "contracts",
     "circulating_supply", "total_supply", "max_supply",
     "category", "telegram_members", "twitter_followers",
     "urls", "tags", "description", "fdv"
-]
\ No newline at end of file
+]
+
+# 随行情频繁变化、可通过 `--quotes-only` 单独刷新的元数据字段（来自 quotes 接口）
+MARKET_METADATA_FIELDS = ["circulating_supply", "total_supply", "max_supply", "fdv"]
\ No newline at end of file
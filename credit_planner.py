@@ -0,0 +1,147 @@
+import math
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from config import CMC_CONFIG, CMC_PLAN_CONFIG, CMC_CALLS_PER_MINUTE, CMC_RATE_BURST, PIPELINE_CHUNK_SIZE
+from metrics import inc
+
+# meta 表键前缀：按 UTC 日期记录当天已消耗的 credits（CMC 的日配额按 UTC 零点重置）
+CREDIT_META_PREFIX = "cmc_credits:"
+
+_lock = threading.Lock()
+_used = 0  # 本进程已消耗的 credits
+_flushed = 0  # 其中已写入状态库的部分
+
+
+def batch_size_for(endpoint_key: str) -> int:
+    """
+    单次请求的 ID 数：不超过套餐允许的上限与 URL 长度限制，并取计费单位（100 个 ID）的整数倍，
+    使每个 credit 都用满。
+    """
+    base_url = f"{CMC_CONFIG['base_url']}{CMC_CONFIG['endpoints'][endpoint_key]}?id="
+    extra = sum(len(k) + len(str(v)) + 2 for k, v in CMC_CONFIG["quotes_params"].items()) if endpoint_key == "quotes" else 0
+    # 逗号在 URL 中编码为 %2C，每个 ID 最多占 max_id_digits + 3 个字符
+    url_limit = (CMC_PLAN_CONFIG["max_url_length"] - len(base_url) - extra) // (CMC_PLAN_CONFIG["max_id_digits"] + 3)
+    size = min(CMC_PLAN_CONFIG["max_ids_per_call"][endpoint_key], url_limit)
+    unit = CMC_PLAN_CONFIG["ids_per_credit"]
+    return max(1, size // unit * unit if size >= unit else size)
+
+
+def pipeline_chunk_size() -> int:
+    """
+    流水线块大小：把 PIPELINE_CHUNK_SIZE 向上取整到 info 与 quotes 单次请求 ID 数的公倍数，
+    使每块的 CMC 请求都是满批，分块不会额外增加请求数与 credits。
+    """
+    batch_size = math.lcm(batch_size_for("info"), batch_size_for("quotes"))
+    return max(1, math.ceil(PIPELINE_CHUNK_SIZE / batch_size)) * batch_size
+
+
+def request_credits(endpoint_key: str, id_count: int) -> int:
+    """单次请求消耗的 credits：map 每次 1 个；info / quotes 每 100 个 ID 1 个，quotes 每多一种换算货币再加 1 个"""
+    if endpoint_key == "map":
+        return 1
+    credits = math.ceil(id_count / CMC_PLAN_CONFIG["ids_per_credit"])
+    if endpoint_key == "quotes":
+        credits += len(str(CMC_CONFIG["quotes_params"].get("convert", "USD")).split(",")) - 1
+    return credits
+
+
+def plan_calls(endpoint_key: str, id_count: int, chunk_size: Optional[int] = None) -> Tuple[int, int]:
+    """返回拉取 id_count 个代币所需的 (请求数, credits)；提供 chunk_size 时按流水线块切分后再分批"""
+    if id_count <= 0:
+        return 0, 0
+    chunk_size = chunk_size or id_count
+    batch_size = batch_size_for(endpoint_key)
+    calls = credits = 0
+    for chunk_start in range(0, id_count, chunk_size):
+        chunk_count = min(chunk_size, id_count - chunk_start)
+        for batch_start in range(0, chunk_count, batch_size):
+            calls += 1
+            credits += request_credits(endpoint_key, min(batch_size, chunk_count - batch_start))
+    return calls, credits
+
+
+def estimate_run(id_counts: Dict[str, int], chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    估算一次运行的请求数、credits 与耗时。id_counts 为 {端点: 需要拉取的代币数}；
+    耗时按共享令牌桶的速率计算（超出突发容量的请求每分钟最多 CMC_CALLS_PER_MINUTE 个）。
+    """
+    by_endpoint = {}
+    for endpoint_key, id_count in id_counts.items():
+        calls, credits = plan_calls(endpoint_key, id_count, chunk_size)
+        by_endpoint[endpoint_key] = {"ids": id_count, "calls": calls, "credits": credits,
+                                     "batch_size": batch_size_for(endpoint_key)}
+    calls = sum(item["calls"] for item in by_endpoint.values())
+    return {
+        "by_endpoint": by_endpoint,
+        "calls": calls,
+        "credits": sum(item["credits"] for item in by_endpoint.values()),
+        "seconds": max(0, calls - CMC_RATE_BURST) * 60 / CMC_CALLS_PER_MINUTE,
+    }
+
+
+def record_credits(count: int):
+    """记录实际消耗的 credits（线程安全）"""
+    global _used
+    with _lock:
+        _used += count
+    inc("cmc_credits_total", count)
+
+
+def credits_used() -> int:
+    """本进程已消耗的 credits"""
+    with _lock:
+        return _used
+
+
+def _today_key() -> str:
+    return CREDIT_META_PREFIX + time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def credits_used_today(state) -> int:
+    """当天（UTC）已消耗的 credits：状态库中的记录加上本进程尚未写入的部分"""
+    with _lock:
+        pending = _used - _flushed
+    return int(state.get_meta(_today_key()) or 0) + pending
+
+
+def flush_credit_usage(state):
+    """把本进程新消耗的 credits 累加到状态库中当天的记录"""
+    global _flushed
+    with _lock:
+        pending = _used - _flushed
+        _flushed = _used
+    if pending:
+        state.set_meta(_today_key(), str(int(state.get_meta(_today_key()) or 0) + pending))
+
+
+def confirm_credit_budget(state, id_counts: Dict[str, int], chunk_size: Optional[int] = None,
+                          discovery_calls: int = 0) -> bool:
+    """
+    打印本次运行的预计请求数、credits 与耗时；会超出每日 credits 预算时返回 False。
+
+    discovery_calls 为本次运行在此之前拉取 UCID 列表的 map 请求数：这部分 credits 已经消耗并计入当天用量，
+    只在计划中列出，不再重复计入预算检查。
+    """
+    plan = estimate_run(id_counts, chunk_size)
+    print("🧮 CMC 调用计划：")
+    if discovery_calls:
+        print(f"   map: {discovery_calls} 次请求，{discovery_calls * request_credits('map', 0)} credits"
+              f"（UCID 发现已完成，已计入今日消耗）")
+    for endpoint_key, item in plan["by_endpoint"].items():
+        print(f"   {endpoint_key}: {item['ids']} 个代币，每次 {item['batch_size']} 个 ID，"
+              f"{item['calls']} 次请求，约 {item['credits']} credits")
+    print(f"   待执行 {plan['calls']} 次请求，约 {plan['credits']} credits，预计耗时 {plan['seconds']:.0f} 秒")
+    if discovery_calls:
+        print(f"   本次运行合计约 {plan['credits'] + discovery_calls * request_credits('map', 0)} credits")
+
+    budget = CMC_PLAN_CONFIG["daily_credit_budget"]
+    if not budget:
+        return True
+    used = credits_used_today(state)
+    if used + plan["credits"] > budget:
+        print(f"❌ 今日已消耗 {used} credits，本次预计 {plan['credits']}，将超出每日预算 {budget}，流程终止"
+              f"（可通过 CMC_DAILY_CREDIT_BUDGET 调整预算）")
+        return False
+    print(f"✅ 今日已消耗 {used} credits，本次完成后剩余约 {budget - used - plan['credits']}/{budget}")
+    return True
@@ -1,46 +1,168 @@
+import argparse
 import numpy as np
-from typing import List
-from cmc_fetcher import fetch_ucids
-from utils import load_ucids_snapshot, save_ucids_snapshot
+import sys
+import time
+from typing import List, Set, Tuple
+from cmc_fetcher import CMCAuthError, fetch_ucids, fetch_new_ucids, full_discovery_calls
+from config import UCID_FULL_RECONCILE_DAYS, DELISTING_CONFIG
+from pinecone_manager import (init_pinecone_client, get_or_create_index, delete_vectors_from_pinecone,
+                              collect_retired_generation)
+from state_store import StateStore, get_state_store, META_LAST_FULL_DISCOVERY, META_REINDEX_NAMESPACE
+from utils import load_ucids_snapshot, save_ucids_snapshot, load_fingerprints
 # 导入与 main.py 相同的核心处理函数
-from main import run_sync_process
+from main import run_sync_process, confirm_sync_budget, drop_abandoned_generations
+from refresh_scheduler import select_due_ucids
+from credit_planner import flush_credit_usage
+from blob_store import get_blob_store
+from metrics import export_metrics
+from profiler import enable_profiling, profile_stage, write_profile_report
 
-def daily_update():
-    print("=" * 60)
-    print("🔄 开始执行【每日增量更新】流程")
-    print("=" * 60)
+def discover_ucids(state: StateStore, old_ucids_set: Set[int]) -> Tuple[List[int], bool]:
+    """
+    获取当前 UCID 列表，返回 (列表, 是否为全量对账)。
 
-    # 步骤 1：获取最新和旧的 UCID
-    print("\n获取最新 UCID 列表并加载快照...")
-    current_ucids_list = fetch_ucids()
-    if not current_ucids_list:
-        print("❌ 未能获取到当前 UCID，流程终止")
+    距上次全量对账不足 UCID_FULL_RECONCILE_DAYS 天时只增量发现新代币（通常一次请求），
+    与已知 active 代币合并；到期、存在待确认下架的代币或增量发现失败时全量分页拉取 map，以识别下架代币。
+    """
+    last_full = float(state.get_meta(META_LAST_FULL_DISCOVERY) or 0)
+    pending = state.missing_ucids()
+    if pending:
+        print(f"ℹ️  有 {len(pending)} 个代币待确认下架，本次全量拉取 UCID 列表")
+    elif time.time() - last_full < UCID_FULL_RECONCILE_DAYS * 86400:
+        new_ucids = fetch_new_ucids(len(old_ucids_set), state.max_ucid())
+        if new_ucids is not None:
+            return sorted(old_ucids_set.union(new_ucids)), False
+        print("⚠️ 增量发现失败，回退到全量拉取")
+    else:
+        print(f"ℹ️  距上次全量对账已超过 {UCID_FULL_RECONCILE_DAYS} 天，本次全量拉取 UCID 列表")
+    return fetch_ucids(), True
+
+def sync_delistings(state: StateStore):
+    """
+    删除已确认下架代币的向量：连续 grace_reconciles 次全量对账都缺失的代币才会删除，
+    待删除数量异常偏大时（多为 map 拉取不完整）放弃本次删除。
+    有未完成的蓝绿重建时同时从新一代删除，两代都删除成功的代币才记为已删除，其余下次运行时重试。
+    """
+    candidates = state.delisting_candidates(DELISTING_CONFIG["grace_reconciles"])
+    if not candidates:
+        print("✅ 没有需要删除的下架代币")
+        return
+    active_count = len(state.active_ucids())
+    if len(candidates) > active_count * DELISTING_CONFIG["max_delete_fraction"]:
+        print(f"⚠️ 待删除的下架代币 {len(candidates)} 个，超过 active 代币 {active_count} 个的 "
+              f"{DELISTING_CONFIG['max_delete_fraction']:.0%}，疑似 UCID 列表不完整，跳过删除")
+        return
+
+    print(f"🔍 确认下架代币 {len(candidates)} 个，开始从 Pinecone 删除...")
+    pc_client = init_pinecone_client()
+    if not pc_client:
+        return
+    index = get_or_create_index(pc_client)
+    if not index:
+        return
+    deleted_ids = delete_vectors_from_pinecone(index, [f"cmc-{ucid}" for ucid in candidates])
+    pending_namespace = state.get_meta(META_REINDEX_NAMESPACE)
+    if pending_namespace and deleted_ids:
+        print(f"🟩 同时从未完成的蓝绿重建 {pending_namespace} 删除")
+        pending_index = get_or_create_index(pc_client, pending_namespace)
+        pending_deleted = set(delete_vectors_from_pinecone(pending_index, deleted_ids))
+        deleted_ids = [vector_id for vector_id in deleted_ids if vector_id in pending_deleted]
+    state.record_deleted([int(vector_id.split("-", 1)[1]) for vector_id in deleted_ids])
+    blob_store = get_blob_store()
+    if blob_store and deleted_ids:
+        blob_store.delete_many(deleted_ids)
+
+def collect_old_generation():
+    """
+    蓝绿重建切换后，上一代保留期满即删除；同时删除放弃的蓝绿重建留下的命名空间。
+    删除失败不影响本次更新，下次运行时重试
+    """
+    pc_client = init_pinecone_client()
+    if not pc_client:
+        return
+    index = get_or_create_index(pc_client)
+    if not index:
         return
+    try:
+        retired = collect_retired_generation(index)
+    except Exception as e:
+        print(f"⚠️ 清理旧一代索引失败，下次运行时重试：{e}")
+        retired = True
+    if not drop_abandoned_generations(get_state_store(), index) and not retired:
+        print("✅ 没有需要清理的旧一代索引")
+
+def daily_update(scheduled: bool = False):
+    """
+    每日增量更新。scheduled 为 True 时只同步按排名分层到期的代币（新代币总是到期），
+    适合高频运行：头部代币频繁刷新，长尾代币按较长间隔刷新，每次的工作量有上限。
+    """
+    print("=" * 60)
+    print("🔄 开始执行【每日增量更新】流程" + ("（分层刷新）" if scheduled else ""))
+    print("=" * 60)
 
+    # 步骤 1：加载旧的 UCID 快照并获取最新 UCID
+    print("\n加载快照并获取最新 UCID 列表...")
     old_ucids_set = load_ucids_snapshot()
     if not old_ucids_set:
         print("❌ 未找到旧的 UCID 快照，请先运行 main.py 进行首次全量同步。")
         return
 
+    state = get_state_store()
+    with profile_stage("discover"):
+        current_ucids_list, reconciled = discover_ucids(state, old_ucids_set)
+    if not current_ucids_list:
+        print("❌ 未能获取到当前 UCID，流程终止")
+        return
+
+    fingerprints = load_fingerprints()
+    if not fingerprints:
+        print("⚠️ 未找到代币指纹，本次所有代币都将视为已变更并重新向量化，以建立指纹基线。")
+
     # 步骤 2：识别新增的 UCID
     new_ucids = [ucid for ucid in current_ucids_list if ucid not in old_ucids_set]
+    print(f"\n🔍 发现 {len(new_ucids)} 个新增代币，另对 {len(current_ucids_list) - len(new_ucids)} 个已有代币进行变更检测...")
+    if new_ucids:
+        print(f"新增代币ID: {new_ucids}")
 
-    if not new_ucids:
-        print("\n✅ 未发现新增代币，无需更新。")
-        print("=" * 60)
+    # 步骤 3：按指纹分类同步：新增/文本变化 -> 重新向量化，仅元数据变化 -> 更新元数据，未变化 -> 跳过
+    sync_ucids = select_due_ucids(state, current_ucids_list) if scheduled else current_ucids_list
+    # 增量发现通常只需一次 map 请求；全量对账按 UCID 总数计算页数
+    discovery_calls = full_discovery_calls(len(current_ucids_list)) if reconciled else 1
+    if not confirm_sync_budget(state, sync_ucids, discovery_calls):
+        flush_credit_usage(state)
         return
+    run_sync_process(sync_ucids, fingerprints, state=state)
+    flush_credit_usage(state)
 
-    print(f"\n🔍 发现 {len(new_ucids)} 个新增代币，开始处理...")
-    print(f"新增代币ID: {new_ucids}")
+    # 步骤 4：用最新的 UCID 更新状态库（指纹已在同步过程中逐块写入）；仅全量对账时标记下架代币
+    print("\n更新 UCID 快照...")
+    save_ucids_snapshot(current_ucids_list, reconcile=reconciled)
 
-    # 步骤 3：对新增代币执行同步流程
-    run_sync_process(new_ucids)
+    # 步骤 5：删除已确认下架代币的向量
+    print("\n同步下架代币...")
+    sync_delistings(state)
 
-    # 步骤 4：用最新的全量 UCID 更新快照
-    print("\n更新 UCID 快照文件...")
-    save_ucids_snapshot(current_ucids_list)
+    # 步骤 6：清理蓝绿重建留下的旧一代
+    print("\n清理旧一代索引...")
+    collect_old_generation()
 
     print("\n🎉 每日增量更新流程执行完毕！")
 
 if __name__ == "__main__":
-    daily_update()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="CoinMarketCap -> Pinecone 每日增量更新")
+    parser.add_argument("--scheduled", action="store_true",
+                        help="按 CMC 排名分层，只同步到期的代币（适合每小时运行）")
+    parser.add_argument("--profile", action="store_true",
+                        help="按阶段进行 CPU 与内存剖析，结束时写出报告与火焰图调用栈")
+    args = parser.parse_args()
+    job = "scheduled_update" if args.scheduled else "daily_update"
+    if args.profile:
+        enable_profiling()
+    try:
+        daily_update(scheduled=args.scheduled)
+    except CMCAuthError as e:
+        print(f"❌ {e}，本次运行已中止")
+        sys.exit(1)
+    finally:
+        export_metrics(job)
+        write_profile_report(job)
\ No newline at end of file
@@ -1,6 +1,10 @@
-from typing import List, Dict, Any
-from config import METADATA_FIELDS
+import hashlib
+import json
+import sys
+from typing import List, Dict, Any, Optional, Tuple
+from config import METADATA_FIELDS, METADATA_BUDGET_CONFIG
 from cmc_fetcher import extract_social_data, extract_urls
+from fast_json import dumps_bytes
 
 def _safe_get_contract_address(detail: Dict[str, Any]) -> str:
     """安全地获取合约地址，优先使用 contract_address 字段"""
@@ -45,14 +49,105 @@ def _get_all_contract_addresses(detail: Dict[str, Any]) -> List[str]:
 
     return all_addresses
 
-def process_data(ucids: List[int], coin_details: Dict[str, Any], market_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """整合数据，生成待向量化文本和元数据"""
-    processed_list: List[Dict[str, Any]] = []
+# 变更检测分类
+CHANGE_NEW = "new"  # 新增代币
+CHANGE_TEXT = "text_changed"  # 待向量化文本变化，需要重新向量化
+CHANGE_METADATA = "metadata_changed"  # 仅元数据变化，只需更新元数据
+CHANGE_NONE = "unchanged"  # 无变化，跳过
+
+def fingerprint_record(item: Dict[str, Any]) -> Dict[str, str]:
+    """计算单条处理结果的指纹：分别对待向量化文本与元数据取哈希"""
+    text_hash = hashlib.sha256(item["token_info"].encode("utf-8")).hexdigest()
+    # 指纹需与状态库中已保存的保持一致，固定使用标准库的默认格式，不随 fast_json 的后端变化
+    metadata_json = json.dumps(item["metadata"], sort_keys=True, ensure_ascii=False)
+    meta_hash = hashlib.sha256(metadata_json.encode("utf-8")).hexdigest()
+    return {"text": text_hash, "meta": meta_hash}
+
+def classify_change(old: Optional[Dict[str, str]], new: Dict[str, str]) -> str:
+    """对比新旧指纹，判断代币属于哪种变更"""
+    if not old:
+        return CHANGE_NEW
+    if old.get("text") != new["text"]:
+        return CHANGE_TEXT
+    if old.get("meta") != new["meta"]:
+        return CHANGE_METADATA
+    return CHANGE_NONE
+
+def extract_market_metadata(market: Dict[str, Any]) -> Dict[str, Any]:
+    """从 quotes 数据中提取会写入元数据的市场字段，字段名与 process_data 生成的元数据一致"""
+    if not isinstance(market, dict):
+        market = {}
+    quote = market.get("quote", {})
+    usd_quote = quote.get("USD", {}) if isinstance(quote, dict) else {}
+    if not isinstance(usd_quote, dict):
+        usd_quote = {}
+    return {
+        "circulating_supply": market.get("circulating_supply"),
+        "total_supply": market.get("total_supply"),
+        "max_supply": market.get("max_supply"),
+        "fdv": usd_quote.get("fully_diluted_valuation"),
+    }
+
+class TokenRecord:
+    """
+    单个代币的处理结果：向量 ID、待向量化文本与已清理的元数据。
+
+    使用 __slots__ 避免每条记录再包一层字典；同时支持 record["id"] 形式的下标访问和 dict(record)，
+    与从进度日志中读回的字典结构保持兼容。
+    """
+
+    __slots__ = ("id", "token_info", "metadata")
+
+    def __init__(self, id: str, token_info: str, metadata: Dict[str, Any]):
+        self.id = id
+        self.token_info = token_info
+        self.metadata = metadata
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.__slots__
+
+    def __repr__(self) -> str:
+        return f"TokenRecord(id={self.id!r})"
+
+def _intern(value: Any) -> Any:
+    """对取值重复度高的字符串（分类、标签、占位符等）做驻留，所有记录共享同一个对象"""
+    return sys.intern(value) if type(value) is str else value
+
+def _set_metadata(metadata: Dict[str, Any], key: str, value: Any):
+    """按 Pinecone 要求写入一个元数据字段（字符串、数字、布尔值或字符串列表），空值直接跳过"""
+    if value is None or value == '':
+        return
+    if isinstance(value, (str, int, float, bool)):
+        metadata[key] = value
+    elif isinstance(value, list) and all(isinstance(item, str) for item in value):
+        metadata[key] = value
+    else:
+        # 将其他类型转换为字符串
+        metadata[key] = str(value)
+
+def process_data(ucids: List[int], coin_details: Dict[str, Any], market_data: Dict[str, Any],
+                 release_raw: bool = False) -> List[TokenRecord]:
+    """
+    整合数据，生成待向量化文本和元数据。
+
+    每个代币一次遍历直接生成已清理的元数据，不再构建中间字典。release_raw 为 True 时
+    每生成一条记录就从 coin_details / market_data 中移除对应的原始数据，使其尽早释放。
+    """
+    processed_list: List[TokenRecord] = []
 
     for ucid in ucids:
         ucid_str = str(ucid)
-        detail = coin_details.get(ucid_str, {})
-        market = market_data.get(ucid_str, {})
+        if release_raw:
+            detail = coin_details.pop(ucid_str, None) or {}
+            market = market_data.pop(ucid_str, None) or {}
+        else:
+            detail = coin_details.get(ucid_str, {})
+            market = market_data.get(ucid_str, {})
         # 安全地获取 USD 报价数据
         quote = market.get("quote", {})
         usd_quote = quote.get("USD", {}) if isinstance(quote, dict) else {}
@@ -78,6 +173,8 @@ def process_data(ucids: List[int], coin_details: Dict[str, Any], market_data: Di
             tags_text = ', '.join(tags) if tags else '无'
         else:
             tags_text = str(tags)
+        tags_text = _intern(tags_text)
+        category = _intern(detail.get('category'))
 
         # 获取合约地址信息
         primary_contract = _safe_get_contract_address(detail)
@@ -88,55 +185,94 @@ def process_data(ucids: List[int], coin_details: Dict[str, Any], market_data: Di
         if len(all_contracts) > 1:
             contract_info += f" (共{len(all_contracts)}个合约地址)"
 
+        # 待向量化文本只包含相对稳定的信息：供应量、FDV 等随行情变化的字段只写入元数据，
+        # 否则每次价格波动都会改变文本指纹，导致代币被重新向量化而不是只更新元数据
         token_info = (
             f"代币基础信息：名称：{detail.get('name', '未知')} ({detail.get('symbol', '未知')}), "
             f"分类：{detail.get('category', '未知')}, 标签：{tags_text}. "
             f"简介：{description_text}. "
             f"合约地址：{contract_info}. "
-            f"供应量：流通 {market.get('circulating_supply', '未知')}, 总 {market.get('total_supply', '未知')}. "
-            f"市场数据：FDV {usd_quote.get('fully_diluted_valuation', '未知')} 美元. "
             f"官方链接：官网 {url_data['website']}, 白皮书 {url_data['whitepaper']}."
         )
 
-        metadata: Dict[str, Any] = {
-            "cmc_id": ucid,
-            "logo": detail.get("logo"),
-            "name": detail.get("name"),
-            "symbol": detail.get("symbol"),
-            "contract_address": primary_contract,  # 主要合约地址
-            "all_contracts": all_contracts if len(all_contracts) > 1 else None,  # 所有合约地址（多链支持）
-            "circulating_supply": market.get("circulating_supply"),
-            "total_supply": market.get("total_supply"),
-            "max_supply": market.get("max_supply"),
-            "category": detail.get("category"),
-            "telegram_members": social_data.get("telegram_members"),
-            "twitter_followers": social_data.get("twitter_followers"),
-            # 将 URL 字典展开为单独的字段，符合 Pinecone 元数据要求
-            "website": url_data.get("website"),
-            "whitepaper": url_data.get("whitepaper"),
-            "twitter_url": url_data.get("twitter"),
-            "tags": tags_text,
-            "description": detail.get("description"),
-            "fdv": usd_quote.get("fully_diluted_valuation"),
-        }
-        # 清理元数据，确保符合 Pinecone 要求（字符串、数字、布尔值或字符串列表）
-        metadata_cleaned = {}
-        for k, v in metadata.items():
-            if v is not None and v != '':
-                # 确保所有值都是 Pinecone 支持的类型
-                if isinstance(v, (str, int, float, bool)):
-                    metadata_cleaned[k] = v
-                elif isinstance(v, list) and all(isinstance(item, str) for item in v):
-                    metadata_cleaned[k] = v
-                else:
-                    # 将其他类型转换为字符串
-                    metadata_cleaned[k] = str(v)
-
-        processed_list.append({
-            "id": f"cmc-{ucid}",
-            "token_info": token_info,
-            "metadata": metadata_cleaned
-        })
+        # 逐个字段清理后写入，确保符合 Pinecone 要求
+        metadata: Dict[str, Any] = {}
+        _set_metadata(metadata, "cmc_id", ucid)
+        _set_metadata(metadata, "logo", detail.get("logo"))
+        _set_metadata(metadata, "name", detail.get("name"))
+        _set_metadata(metadata, "symbol", detail.get("symbol"))
+        _set_metadata(metadata, "contract_address", _intern(primary_contract))  # 主要合约地址
+        # 所有合约地址（多链支持）
+        _set_metadata(metadata, "all_contracts", all_contracts if len(all_contracts) > 1 else None)
+        _set_metadata(metadata, "circulating_supply", market.get("circulating_supply"))
+        _set_metadata(metadata, "total_supply", market.get("total_supply"))
+        _set_metadata(metadata, "max_supply", market.get("max_supply"))
+        _set_metadata(metadata, "category", category)
+        _set_metadata(metadata, "telegram_members", social_data.get("telegram_members"))
+        _set_metadata(metadata, "twitter_followers", social_data.get("twitter_followers"))
+        # 将 URL 字典展开为单独的字段，符合 Pinecone 元数据要求
+        _set_metadata(metadata, "website", url_data.get("website"))
+        _set_metadata(metadata, "whitepaper", url_data.get("whitepaper"))
+        _set_metadata(metadata, "twitter_url", url_data.get("twitter"))
+        _set_metadata(metadata, "tags", tags_text)
+        _set_metadata(metadata, "description", detail.get("description"))
+        _set_metadata(metadata, "fdv", usd_quote.get("fully_diluted_valuation"))
+
+        processed_list.append(TokenRecord(f"cmc-{ucid}", token_info, metadata))
 
     print(f"✅ 数据处理完成，共生成 {len(processed_list)} 条待处理数据")
-    return processed_list
\ No newline at end of file
+    return processed_list
+
+
+# 记录被移入 blob 存储的字段名，每条向量都写入（可能为空列表），元数据更新时才能覆盖旧值
+BLOB_FIELDS_KEY = "blob_fields"
+
+def metadata_size(value: Any) -> int:
+    """元数据（或单个字段）序列化为 JSON 后的字节数"""
+    return len(dumps_bytes(value))
+
+def _truncate_field(value: Any, budget: int) -> Any:
+    """把字段截断到 budget 字节以内：字符串截断并加省略号，列表只保留开头能放下的元素"""
+    if isinstance(value, str):
+        text = value.encode("utf-8")[:budget].decode("utf-8", "ignore")
+        # 转义字符会使序列化后的长度大于原文，逐步缩短直到放得下
+        while text and metadata_size(text + "…") > budget:
+            text = text[:len(text) * 9 // 10]
+        return text + "…"
+    if isinstance(value, list):
+        kept, size = [], 2
+        for item in value:
+            size += metadata_size(item) + 1
+            if size > budget:
+                break
+            kept.append(item)
+        return kept
+    return value
+
+def govern_metadata(metadata: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    按字段预算与总上限裁剪元数据，返回 (写入索引的元数据, 被移出字段的完整值)。
+
+    先把超出各自预算的字段换成截断的预览；总量仍超过上限时，再从最大的字符串或列表字段开始
+    依次换成 default_field_budget 大小的预览。原元数据不会被修改。
+    """
+    budgets = METADATA_BUDGET_CONFIG["field_budgets"]
+    governed = dict(metadata)
+    offloaded: Dict[str, Any] = {}
+    for field, budget in budgets.items():
+        value = governed.get(field)
+        if value is not None and metadata_size(value) > budget:
+            offloaded[field] = value
+            governed[field] = _truncate_field(value, budget)
+
+    governed[BLOB_FIELDS_KEY] = sorted(offloaded)
+    while metadata_size(governed) > METADATA_BUDGET_CONFIG["max_bytes"]:
+        candidates = [(metadata_size(value), field) for field, value in governed.items()
+                      if field not in offloaded and field != BLOB_FIELDS_KEY and isinstance(value, (str, list))]
+        if not candidates:
+            break
+        _, field = max(candidates)
+        offloaded[field] = governed[field]
+        governed[field] = _truncate_field(governed[field], METADATA_BUDGET_CONFIG["default_field_budget"])
+        governed[BLOB_FIELDS_KEY] = sorted(offloaded)
+    return governed, offloaded
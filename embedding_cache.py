@@ -0,0 +1,117 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional
+from config import EMBEDDING_CACHE_CONFIG
+
+
+def _cache_key(model: str, input_type: str, text: str) -> str:
+    """缓存键：模型名 + input_type + 文本内容的哈希"""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model}:{input_type}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    基于 SQLite 的本地向量缓存，按内容寻址。
+
+    文本内容不变时直接复用已有向量，只有未命中的文本才需要调用向量化接口。
+    支持按存活时间和条目数淘汰旧数据。
+    """
+
+    def __init__(self, path: str, max_entries: int, max_age_days: float):
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def get_many(self, model: str, input_type: str, texts: Iterable[str]) -> Dict[str, List[float]]:
+        """批量查询缓存，返回 {文本: 向量}，只包含命中的文本"""
+        keys = {_cache_key(model, input_type, text): text for text in texts}
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        key_list = list(keys)
+        with self._lock:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for i in range(0, len(key_list), 500):
+                batch = key_list[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders}) AND created_at >= ?",
+                    (*batch, now - self.max_age_seconds)
+                ).fetchall()
+                for key, blob in rows:
+                    found[keys[key]] = array("f", blob).tolist()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key, _ in rows]
+                )
+            self._conn.commit()
+        return found
+
+    def put_many(self, model: str, input_type: str, vectors: Dict[str, List[float]]):
+        """写入新生成的向量"""
+        now = time.time()
+        rows = [
+            (_cache_key(model, input_type, text), array("f", values).tobytes(), now, now)
+            for text, values in vectors.items()
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """删除过期条目，并按最近使用时间淘汰超出容量的条目，返回删除数量"""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            ).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+            self._conn.commit()
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """获取全局向量缓存（首次调用时打开并执行一次淘汰），未启用或打开失败时返回 None"""
+    global _cache
+    if not EMBEDDING_CACHE_CONFIG["enabled"]:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = EmbeddingCache(
+                    EMBEDDING_CACHE_CONFIG["path"],
+                    EMBEDDING_CACHE_CONFIG["max_entries"],
+                    EMBEDDING_CACHE_CONFIG["max_age_days"],
+                )
+                removed = _cache.evict()
+                if removed:
+                    print(f"🧹 向量缓存淘汰了 {removed} 条过期或超量的条目")
+            except sqlite3.Error as e:
+                print(f"⚠️ 打开向量缓存失败，本次不使用缓存: {e}")
+                return None
+        return _cache
@@ -0,0 +1,66 @@
+from typing import Any, List, Optional, Tuple
+from config import EMBEDDING_CONFIG
+from rate_limiter import parse_retry_after
+
+def _is_wide_char(ch: str) -> bool:
+    """中日韩文字与全角符号，分词后通常每个字符至少一个 Token"""
+    return ('\u2e80' <= ch <= '\u9fff') or ('\uac00' <= ch <= '\ud7af') or ('\uff00' <= ch <= '\uffef')
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 Token 数：宽字符按每个 1.2 个、其余字符按每 3.5 个 1 个计算，
+    并按模型单条输入上限截断（请求中使用 truncate=END）。
+    """
+    wide = sum(1 for ch in text if _is_wide_char(ch))
+    other = len(text) - wide
+    estimate = int(wide * 1.2 + other / 3.5) + 1
+    return min(estimate, EMBEDDING_CONFIG["max_input_tokens"])
+
+def plan_embedding_batches(texts: List[str]) -> List[Tuple[int, int, int]]:
+    """
+    按输入条数上限和 Token 数打包批次，返回 [(起始下标, 结束下标, 预计 Token 数)]。
+    单批 Token 数不超过每分钟配额，保证每一批都能在配额内发出。
+    """
+    max_inputs = EMBEDDING_CONFIG["max_batch_inputs"]
+    max_tokens = EMBEDDING_CONFIG["tokens_per_minute"]
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if i > start and (i - start >= max_inputs or batch_tokens + tokens > max_tokens):
+            batches.append((start, i, batch_tokens))
+            start, batch_tokens = i, 0
+        batch_tokens += tokens
+    if start < len(texts):
+        batches.append((start, len(texts), batch_tokens))
+    return batches
+
+def is_rate_limit_error(error: Exception) -> bool:
+    error_str = str(error)
+    return ("429" in error_str or
+            "Too Many Requests" in error_str or
+            "RESOURCE_EXHAUSTED" in error_str or
+            "max embedding Tokens per minute" in error_str)
+
+def retry_after_from_error(error: Exception) -> Optional[float]:
+    """从 SDK 异常携带的响应头中读取 Retry-After（秒）"""
+    headers = getattr(error, "headers", None)
+    if not headers:
+        return None
+    try:
+        items = headers.items()
+    except AttributeError:
+        return None
+    for key, value in items:
+        if str(key).lower() == "retry-after":
+            return parse_retry_after(value)
+    return None
+
+def response_total_tokens(response: Any) -> Optional[int]:
+    """读取向量化响应中的实际 Token 用量，不存在时返回 None"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    total = usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)
+    return total if isinstance(total, int) else None
@@ -0,0 +1,357 @@
+"""
+本地假 CoinMarketCap 与假 Pinecone 服务，用于在没有真实 API Key 的情况下做端到端测试和性能基准。
+
+- FakeCMCServer：本地 HTTP 服务，实现 map / info / quotes 三个接口，支持配置延迟、429 注入和数据集大小
+- FakePinecone：进程内的 Pinecone 客户端替身，实现 inference.embed 与索引的 upsert / update / delete /
+  fetch / describe_index_stats，同样支持延迟与 429 注入
+"""
+
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeCMCDataset:
+    """按 UCID 确定性生成的代币数据集，可模拟描述/行情变化、新上架与下架"""
+
+    def __init__(self, size: int, description_len: int = 800, seed: int = 0):
+        self.description_len = description_len
+        self.seed = seed
+        self.active_ids: List[int] = list(range(1, size + 1))
+        self.revisions: Dict[int, int] = {}  # 描述等静态信息的版本号
+        self.market_ticks: Dict[int, int] = {}  # 行情的版本号
+        self._lock = threading.Lock()
+
+    def _rng(self, ucid: int, salt: str) -> random.Random:
+        return random.Random(f"{self.seed}:{ucid}:{salt}")
+
+    def map_page(self, start: int, limit: int, sort: str = "id") -> List[Dict[str, Any]]:
+        with self._lock:
+            ids = list(self.active_ids)
+        if sort == "cmc_rank":
+            ids.sort(key=self.rank)
+        return [
+            {"id": ucid, "rank": self.rank(ucid), "name": f"Coin {ucid}", "symbol": f"C{ucid}",
+             "slug": f"coin-{ucid}", "is_active": 1, "date_added": f"2020-01-01T00:00:{ucid % 60:02d}.000Z"}
+            for ucid in ids[start - 1:start - 1 + limit]
+        ]
+
+    def rank(self, ucid: int) -> int:
+        return ucid
+
+    def has(self, ucid: int) -> bool:
+        with self._lock:
+            return ucid in self.active_ids
+
+    def info(self, ucid: int) -> Dict[str, Any]:
+        revision = self.revisions.get(ucid, 0)
+        rng = self._rng(ucid, f"info:{revision}")
+        words = ["defi", "layer", "protocol", "yield", "bridge", "oracle", "governance", "staking", "nft", "dao"]
+        description = " ".join(rng.choice(words) for _ in range(self.description_len // 7))[:self.description_len]
+        contract = "0x" + hashlib.sha1(f"{ucid}".encode()).hexdigest()
+        return {
+            "id": ucid,
+            "name": f"Coin {ucid}",
+            "symbol": f"C{ucid}",
+            "category": "token" if ucid % 3 else "coin",
+            "description": f"Coin {ucid} (rev {revision}) {description}",
+            "logo": f"https://s2.coinmarketcap.com/static/img/coins/64x64/{ucid}.png",
+            "tags": rng.sample(words, 3),
+            "platform": {"token_address": contract} if ucid % 3 else None,
+            "contract_address": [{"contract_address": contract}] if ucid % 3 else [],
+            "urls": {
+                "website": [f"https://coin{ucid}.example"],
+                "technical_doc": [f"https://coin{ucid}.example/whitepaper.pdf"],
+                "twitter": [f"https://twitter.com/coin{ucid}"],
+                "whitepaper": [f"https://coin{ucid}.example/whitepaper.pdf"],
+            },
+        }
+
+    def quote(self, ucid: int) -> Dict[str, Any]:
+        tick = self.market_ticks.get(ucid, 0)
+        rng = self._rng(ucid, f"quote:{tick}")
+        supply = rng.randint(1_000_000, 1_000_000_000)
+        return {
+            "id": ucid,
+            "cmc_rank": self.rank(ucid),
+            "circulating_supply": supply,
+            "total_supply": supply * 2,
+            "max_supply": supply * 3,
+            "quote": {"USD": {"price": rng.random() * 100, "fully_diluted_valuation": rng.random() * 1e9}},
+        }
+
+    def mutate(self, description_fraction: float = 0.0, market_fraction: float = 0.0,
+               add: int = 0, remove: int = 0, seed: int = 1) -> Dict[str, List[int]]:
+        """随机修改一部分代币的描述或行情，并新增/下架代币，返回受影响的 UCID"""
+        rng = random.Random(seed)
+        with self._lock:
+            ids = list(self.active_ids)
+            changed_text = rng.sample(ids, int(len(ids) * description_fraction))
+            changed_market = rng.sample(ids, int(len(ids) * market_fraction))
+            removed = rng.sample(ids, min(remove, len(ids)))
+            next_id = max(ids, default=0) + 1
+            added = list(range(next_id, next_id + add))
+            for ucid in changed_text:
+                self.revisions[ucid] = self.revisions.get(ucid, 0) + 1
+            for ucid in changed_market:
+                self.market_ticks[ucid] = self.market_ticks.get(ucid, 0) + 1
+            removed_set = set(removed)
+            self.active_ids = [u for u in ids if u not in removed_set] + added
+        return {"text": changed_text, "market": changed_market, "added": added, "removed": removed}
+
+
+class FakeCMCServer:
+    """
+    本地假 CMC HTTP 服务。
+
+    latency：每个请求的固定延迟（秒）；error_rate：以该概率返回 429；
+    reject_status：设置后所有请求都返回该状态码：401/402/403 模拟 API Key 无效或套餐不支持，
+    400 模拟与 ID 无关的参数错误（如不支持的 convert）；
+    请求中包含未知 UCID 时与真实接口一样整批返回 400 错误。
+    """
+
+    def __init__(self, dataset: FakeCMCDataset, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 reject_status: Optional[int] = None):
+        self.dataset = dataset
+        self.latency = latency
+        self.error_rate = error_rate
+        self.reject_status = reject_status
+        self.request_counts: Dict[str, int] = {}
+        self.throttled = 0
+        self.connections = 0  # 已建立的 TCP 连接数，用于观察连接复用
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeCMCServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-cmc", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _should_throttle(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def _count(self, endpoint: str):
+        with self._lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 支持 keep-alive，与真实接口一致
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                payload = json.dumps(body).encode("utf-8")
+                gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+                if gzipped:
+                    payload = gzip.compress(payload, compresslevel=1)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if gzipped:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+                self._send(status, {"status": {"error_code": status, "error_message": message}}, headers)
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                endpoint = parsed.path
+                server._count(endpoint)
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._should_throttle():
+                    with server._lock:
+                        server.throttled += 1
+                    self._error(429, "You've exceeded your API Key's HTTP request rate limit.", {"Retry-After": "1"})
+                    return
+                if server.reject_status in (401, 402, 403):
+                    # 与真实接口一致：HTTP 状态码之外，status.error_code 为 1001 (API_KEY_INVALID) 等鉴权错误码
+                    self._send(server.reject_status, {"status": {"error_code": 1001, "error_message": "This API Key is invalid."}})
+                    return
+                if server.reject_status:
+                    self._error(server.reject_status, "Invalid value for \"convert\": \"XYZ\"")
+                    return
+
+                ok_status = {"error_code": 0, "error_message": None, "credit_count": 1}
+                dataset = server.dataset
+                if endpoint == "/v1/cryptocurrency/map":
+                    start = int(query.get("start", 1))
+                    limit = int(query.get("limit", 5000))
+                    self._send(200, {"status": ok_status, "data": dataset.map_page(start, limit, query.get("sort", "id"))})
+                elif endpoint in ("/v2/cryptocurrency/info", "/v1/cryptocurrency/quotes/latest"):
+                    try:
+                        ids = [int(x) for x in query.get("id", "").split(",") if x]
+                    except ValueError:
+                        self._error(400, "Invalid value for \"id\"")
+                        return
+                    invalid = [ucid for ucid in ids if not dataset.has(ucid)]
+                    if invalid:
+                        self._error(400, f"Invalid values for \"id\": \"{','.join(map(str, invalid))}\"")
+                        return
+                    build = dataset.info if endpoint.endswith("info") else dataset.quote
+                    # 与真实接口一致：每返回 100 个代币计 1 个 credit
+                    status = dict(ok_status, credit_count=(len(ids) + 99) // 100)
+                    self._send(200, {"status": status, "data": {str(ucid): build(ucid) for ucid in ids}})
+                else:
+                    self._error(404, f"Unknown endpoint {endpoint}")
+
+        return Handler
+
+
+class _Record:
+    """模拟 SDK 响应对象，支持属性访问"""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class _FakeInference:
+    def __init__(self, owner: "FakePinecone"):
+        self._owner = owner
+
+    def embed(self, model: str, inputs: List[str], parameters: Dict[str, Any]):
+        self._owner._simulate("embed")
+        dimension = self._owner.dimension
+        data = []
+        for text in inputs:
+            rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+            data.append(_Record(values=[rng.uniform(-1, 1) for _ in range(dimension)]))
+        with self._owner._lock:
+            self._owner.embedded_texts += len(inputs)
+        return _Record(data=data, usage={"total_tokens": sum(len(t) // 4 for t in inputs)})
+
+
+class FakeIndex:
+    """进程内的索引替身，按命名空间保存向量"""
+
+    def __init__(self, owner: "FakePinecone"):
+        self._owner = owner
+        self.namespaces: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def _ns(self, namespace: Optional[str]) -> Dict[str, Dict[str, Any]]:
+        return self.namespaces.setdefault(namespace or "", {})
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: Optional[str] = None, **kwargs):
+        self._owner._simulate("upsert")
+        with self._owner._lock:
+            store = self._ns(namespace)
+            for vector in vectors:
+                store[vector["id"]] = {"id": vector["id"], "values": list(vector["values"]),
+                                       "metadata": dict(vector.get("metadata") or {})}
+        return {"upserted_count": len(vectors)}
+
+    def update(self, id: str, set_metadata: Optional[Dict[str, Any]] = None, namespace: Optional[str] = None, **kwargs):
+        self._owner._simulate("update")
+        with self._owner._lock:
+            vector = self._ns(namespace).get(id)
+            if vector is not None and set_metadata:
+                vector["metadata"].update(set_metadata)
+        return {}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: Optional[str] = None, **kwargs):
+        self._owner._simulate("delete")
+        with self._owner._lock:
+            if delete_all:
+                self.namespaces.pop(namespace or "", None)
+            else:
+                store = self._ns(namespace)
+                for vector_id in ids or []:
+                    store.pop(vector_id, None)
+        return {}
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None, **kwargs):
+        self._owner._simulate("fetch")
+        with self._owner._lock:
+            store = self._ns(namespace)
+            return _Record(vectors={i: _Record(**store[i]) for i in ids if i in store}, namespace=namespace or "")
+
+    def describe_index_stats(self, **kwargs):
+        self._owner._simulate("describe_index_stats")
+        with self._owner._lock:
+            namespaces = {name: {"vector_count": len(store)} for name, store in self.namespaces.items()}
+        return {"total_vector_count": sum(ns["vector_count"] for ns in namespaces.values()),
+                "dimension": self._owner.dimension, "namespaces": namespaces}
+
+
+class FakePinecone:
+    """
+    进程内的 Pinecone 客户端替身。
+
+    latency：每次数据面/推理调用的固定延迟（秒）；error_rate：以该概率抛出 429 限流异常。
+    """
+
+    def __init__(self, dimension: int = 1024, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.dimension = dimension
+        self.latency = latency
+        self.error_rate = error_rate
+        self.call_counts: Dict[str, int] = {}
+        self.embedded_texts = 0
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.inference = _FakeInference(self)
+        self.indexes: Dict[str, FakeIndex] = {}
+
+    def _simulate(self, operation: str):
+        with self._lock:
+            self.call_counts[operation] = self.call_counts.get(operation, 0) + 1
+            throttle = self._rng.random() < self.error_rate
+            if throttle:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            raise Exception(f"(429) Too Many Requests: {operation} rate limit exceeded, "
+                            f"max embedding Tokens per minute reached")
+
+    def list_indexes(self):
+        names = list(self.indexes)
+        return _Record(names=lambda: names)
+
+    def create_index(self, name: str, **kwargs):
+        self.indexes.setdefault(name, FakeIndex(self))
+
+    def describe_index(self, name: str):
+        return _Record(status={"ready": True}, name=name, dimension=self.dimension)
+
+    def Index(self, name: str) -> FakeIndex:
+        return self.indexes.setdefault(name, FakeIndex(self))
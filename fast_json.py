@@ -0,0 +1,165 @@
+import codecs
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, Optional, Union
+from config import JSON_CONFIG
+
+try:
+    # orjson 为可选依赖，解析与序列化速度是标准库的数倍；未安装时回退到标准库 json
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson 的解析错误是它的子类，调用方统一捕获这一个即可
+JSONDecodeError = json.JSONDecodeError
+
+# orjson 只支持 64 位整数，更大的整数会被解析成 float、序列化时直接报错；
+# 含 19 位以上数字串时改用标准库解析，保证两种后端得到相同的结果（字符串中的长数字只会误判为需要回退）。
+# 查找时先把数字映射为 "0"、其余字节映射为空格，再查找连续的 "0"，比正则逐位置匹配快一个数量级
+_DIGIT_MASK = bytes(0x30 if 0x30 <= b <= 0x39 else 0x20 for b in range(256))
+_LONG_DIGITS = b"0" * 19
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _use_orjson() -> bool:
+    return orjson is not None and JSON_CONFIG["backend"] != "stdlib"
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """解析 JSON 文本或 UTF-8 字节，解析失败时抛出 JSONDecodeError"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if _use_orjson():
+        if _LONG_DIGITS not in data.translate(_DIGIT_MASK):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass  # NaN、超出范围的浮点数等标准库接受的写法交给标准库处理，真正的格式错误由标准库抛出
+    try:
+        return json.loads(data)
+    except UnicodeDecodeError as e:
+        # 标准库解析字节时先整体解码，非法 UTF-8 不会报 JSONDecodeError，统一成同一种错误
+        raise JSONDecodeError(f"Invalid UTF-8: {e.reason}", "", e.start) from e
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """序列化为紧凑的 UTF-8 JSON 字节，非 ASCII 字符不转义；orjson 后端会把 NaN 与无穷大写成 null"""
+    if _use_orjson():
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # 超出 64 位的整数等 orjson 不支持的值
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """序列化为紧凑的 JSON 字符串，非 ASCII 字符不转义"""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def load_file(path: str) -> Any:
+    """读取并解析 JSON 文件"""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+class _StreamReader:
+    """在分块到达的 UTF-8 字节上逐个解析 JSON 值，缓冲区只保留尚未解析的部分"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._raw_decode = json.JSONDecoder().raw_decode
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self) -> bool:
+        """读入下一块；已读完时返回 False"""
+        if self.eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self._decoder.decode(b"", final=True)
+        else:
+            text = self._decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def _grow(self) -> bool:
+        """读入数据直到未解析部分至少翻倍，避免大值被反复从头解析"""
+        target = 2 * (len(self.buffer) - self.pos) + 1
+        grew = False
+        while len(self.buffer) - self.pos < target and self._read():
+            grew = True
+        return grew
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符，到达末尾时返回空串"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._read():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        """消费下一个非空白字符，它必须是 chars 之一"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise JSONDecodeError(f"Expecting one of {chars!r}", self.buffer, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        """解析下一个完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._raw_decode(self.buffer, self.pos)
+            except JSONDecodeError:
+                if self._grow():
+                    continue
+                raise
+            # 数字可能恰好被分块截断，值结束在缓冲区末尾时多读一些再确认
+            if end == len(self.buffer) and self._grow():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_array(chunks: Iterable[bytes], key: str, rest: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    """
+    流式解析顶层为对象的 JSON 响应，逐个产出其中 key 字段数组的元素。
+
+    整个响应不会同时以字节和解析结果两种形式留在内存中：已产出的元素由调用方决定是否保留，
+    其余顶层字段（如 status）解析后写入 rest。key 字段不是数组时同样写入 rest。
+    """
+    reader = _StreamReader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            name = reader.value()
+            if not isinstance(name, str):
+                raise JSONDecodeError("Expecting property name", reader.buffer, reader.pos)
+            reader.expect(":")
+            if name == key and reader.peek() == "[":
+                reader.pos += 1
+                if reader.peek() == "]":
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield reader.value()
+                        if reader.expect(",]") == "]":
+                            break
+            else:
+                value = reader.value()
+                if rest is not None:
+                    rest[name] = value
+            if reader.expect(",}") == "}":
+                break
+    if reader.peek():
+        raise JSONDecodeError("Extra data", reader.buffer, reader.pos)
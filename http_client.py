@@ -0,0 +1,94 @@
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional, Tuple, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import HTTP_CONFIG
+
+T = TypeVar("T")
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# 对冲请求使用的线程池，与会话连接池大小一致
+_hedge_executor = ThreadPoolExecutor(max_workers=HTTP_CONFIG["pool_size"], thread_name_prefix="http-hedge")
+
+
+def get_session() -> requests.Session:
+    """
+    获取共享的 HTTP 会话（线程安全，首次调用时创建）。
+
+    连接池复用 keep-alive 连接，避免每个请求都重新进行 TCP + TLS 握手；
+    并显式声明接受 gzip 压缩响应。重试由调用方自行处理，适配器本身不重试。
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_CONFIG["pool_size"],
+                                  pool_maxsize=HTTP_CONFIG["pool_size"], max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+            _session = session
+        return _session
+
+
+def request_timeout() -> Tuple[float, float]:
+    """返回 (连接超时, 读取超时)"""
+    return HTTP_CONFIG["connect_timeout"], HTTP_CONFIG["read_timeout"]
+
+
+class LatencyTracker:
+    """线程安全地记录最近若干次请求的耗时，用于计算对冲阈值"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """返回第 q 分位（0~1）的耗时，没有样本时返回 None"""
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+
+def hedged_call(call: Callable[[], T], hedge_after: Optional[float],
+                allow_hedge: Callable[[], bool] = lambda: True) -> T:
+    """
+    执行 call 并返回结果；hedge_after 为 None 时直接在当前线程调用。
+
+    否则若 hedge_after 秒后仍未返回且 allow_hedge() 为真，再并行发起一次相同调用，
+    返回先成功完成的结果；两次都失败时抛出最后一个异常。落后的调用无法取消，其结果会被丢弃。
+    """
+    if hedge_after is None:
+        return call()
+    primary = _hedge_executor.submit(call)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done or not allow_hedge():
+        return primary.result()
+
+    print(f"⏱️ 请求超过 {hedge_after * 1000:.0f} ms 未返回，发起对冲请求")
+    pending = {primary, _hedge_executor.submit(call)}
+    last_error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                return future.result()
+            last_error = error
+    raise last_error
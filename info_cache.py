@@ -0,0 +1,125 @@
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+from config import INFO_CACHE_CONFIG
+from fast_json import dumps, loads
+
+
+class InfoCache:
+    """
+    基于 SQLite 的 CMC /info 响应缓存，每个 UCID 一行。
+
+    代币的 logo、描述、链接、合约、标签等静态信息很少变化，TTL 内直接复用缓存，
+    只有缺失或过期的 UCID 才需要重新请求。同时统计命中情况与节省的调用次数。
+    """
+
+    def __init__(self, path: str, ttl_hours: float):
+        self.ttl_seconds = ttl_hours * 3600
+        self.hits = 0
+        self.misses = 0
+        self.credits_saved = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS info ("
+            " ucid INTEGER PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, ucids: Iterable[int]) -> Dict[str, Any]:
+        """批量查询未过期的缓存，返回 {ucid 字符串: 详情}，只包含命中的 UCID"""
+        ucid_list = list(ucids)
+        found: Dict[str, Any] = {}
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for i in range(0, len(ucid_list), 500):
+                batch = ucid_list[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT ucid, payload FROM info WHERE ucid IN ({','.join('?' * len(batch))}) AND fetched_at >= ?",
+                    (*batch, cutoff)
+                ).fetchall()
+                for ucid, payload in rows:
+                    found[str(ucid)] = loads(payload)
+        return found
+
+    def count_fresh(self, ucids: Iterable[int]) -> int:
+        """统计 TTL 内有缓存的 UCID 数量"""
+        ucid_list = list(ucids)
+        cutoff = time.time() - self.ttl_seconds
+        count = 0
+        with self._lock:
+            for i in range(0, len(ucid_list), 500):
+                batch = ucid_list[i:i + 500]
+                count += self._conn.execute(
+                    f"SELECT COUNT(*) FROM info WHERE ucid IN ({','.join('?' * len(batch))}) AND fetched_at >= ?",
+                    (*batch, cutoff)
+                ).fetchone()[0]
+        return count
+
+    def put_many(self, data: Dict[str, Any]):
+        """写入新拉取的详情 {ucid 字符串: 详情}"""
+        now = time.time()
+        rows = [(int(ucid), dumps(item), now) for ucid, item in data.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO info VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def record_lookup(self, hits: int, misses: int, credits_saved: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.credits_saved += credits_saved
+
+    def evict(self) -> int:
+        """删除过期条目，返回删除数量"""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM info WHERE fetched_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            self._conn.commit()
+        return removed
+
+    def report(self):
+        """打印本进程内的累计命中统计"""
+        total = self.hits + self.misses
+        if not total:
+            return
+        print(f"📦 详情缓存：命中 {self.hits}/{total} ({self.hits / total:.0%})，未命中 {self.misses}，"
+              f"节省约 {self.credits_saved} 个 CMC credits")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[InfoCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_info_cache() -> Optional[InfoCache]:
+    """获取全局详情缓存（首次调用时打开并删除过期条目），未启用或打开失败时返回 None"""
+    global _cache
+    if not INFO_CACHE_CONFIG["enabled"]:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = InfoCache(INFO_CACHE_CONFIG["path"], INFO_CACHE_CONFIG["ttl_hours"])
+                removed = _cache.evict()
+                if removed:
+                    print(f"🧹 详情缓存删除了 {removed} 条过期条目")
+            except sqlite3.Error as e:
+                print(f"⚠️ 打开详情缓存失败，本次不使用缓存: {e}")
+                return None
+        return _cache
+
+
+def report_info_cache_stats():
+    """打印详情缓存的累计命中统计；本进程未使用缓存时不输出"""
+    if _cache is not None:
+        _cache.report()
@@ -0,0 +1,136 @@
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+from fast_json import JSONDecodeError, dumps_bytes, load_file, loads
+
+JOURNAL_FILE = "journal.jsonl"
+UCIDS_FILE = "ucids.json"
+
+
+class SyncJournal:
+    """
+    全量同步的持久化进度日志。
+
+    日志目录中保存本次运行的 UCID 列表、按行追加的事件日志（每行写入后立即 fsync），
+    以及已拉取但尚未写入 Pinecone 的块的处理结果。进程中断后可据此从最后提交的位置继续：
+    已写入的代币直接跳过，已拉取的块无需重新请求 CMC，已向量化的文本会命中向量缓存。
+    """
+
+    def __init__(self, directory: str, ucids: List[int], chunk_size: int):
+        self.directory = directory
+        self.ucids = ucids
+        self.chunk_size = chunk_size
+        self.fetched_chunks: Set[int] = set()
+        self.embedded_ids: Set[str] = set()
+        self.committed_fingerprints: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, directory: str, ucids: List[int], chunk_size: int) -> "SyncJournal":
+        """清空旧日志并开始记录新的同步运行"""
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        journal = cls(directory, ucids, chunk_size)
+        journal._write_json(UCIDS_FILE, ucids)
+        journal._append({"event": "start", "total": len(ucids), "chunk_size": chunk_size})
+        return journal
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["SyncJournal"]:
+        """回放已有日志；日志不存在或已损坏时返回 None"""
+        try:
+            ucids = load_file(os.path.join(directory, UCIDS_FILE))
+            with open(os.path.join(directory, JOURNAL_FILE), 'rb') as f:
+                lines = f.readlines()
+        except (IOError, JSONDecodeError) as e:
+            print(f"⚠️ 无法读取同步日志 {directory}: {e}")
+            return None
+
+        journal: Optional[SyncJournal] = None
+        for line in lines:
+            try:
+                event = loads(line)
+            except JSONDecodeError:
+                # 进程中断时最后一行可能只写了一半，忽略即可
+                continue
+            kind = event.get("event")
+            if kind == "start":
+                journal = cls(directory, ucids, event["chunk_size"])
+            elif journal is None:
+                continue
+            elif kind == "fetched" and os.path.exists(journal._spool_path(event["chunk"])):
+                journal.fetched_chunks.add(event["chunk"])
+            elif kind == "embedded":
+                journal.embedded_ids.update(event["ids"])
+            elif kind == "committed":
+                journal.committed_fingerprints.update(event["fingerprints"])
+                journal.fetched_chunks.discard(event["chunk"])
+        return journal
+
+    def is_committed(self, ucid: int) -> bool:
+        return str(ucid) in self.committed_fingerprints
+
+    def record_fetched(self, chunk_idx: int, processed_list: List[Any]):
+        """保存块的处理结果（TokenRecord 或同结构的字典），恢复时无需重新拉取"""
+        self._write_json(self._spool_name(chunk_idx), [dict(item) for item in processed_list])
+        with self._lock:
+            self.fetched_chunks.add(chunk_idx)
+        self._append({"event": "fetched", "chunk": chunk_idx, "count": len(processed_list)})
+
+    def load_fetched(self, chunk_idx: int) -> Optional[List[Dict[str, Any]]]:
+        """读取已拉取块的处理结果，不存在时返回 None"""
+        if chunk_idx not in self.fetched_chunks:
+            return None
+        try:
+            return load_file(self._spool_path(chunk_idx))
+        except (IOError, JSONDecodeError) as e:
+            print(f"⚠️ 读取第 {chunk_idx} 块的拉取结果失败，将重新拉取: {e}")
+            return None
+
+    def record_embedded(self, chunk_idx: int, ids: List[str]):
+        with self._lock:
+            self.embedded_ids.update(ids)
+        self._append({"event": "embedded", "chunk": chunk_idx, "ids": ids})
+
+    def record_committed(self, chunk_idx: int, fingerprints: Dict[str, Dict[str, str]]):
+        """记录已成功写入 Pinecone 的代币，并删除该块的拉取结果"""
+        with self._lock:
+            self.committed_fingerprints.update(fingerprints)
+            self.fetched_chunks.discard(chunk_idx)
+        self._append({"event": "committed", "chunk": chunk_idx, "fingerprints": fingerprints})
+        try:
+            os.remove(self._spool_path(chunk_idx))
+        except FileNotFoundError:
+            pass
+
+    def finish(self):
+        """同步全部完成后删除日志目录"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        print(f"🧹 同步已全部完成，已清理进度日志：{self.directory}")
+
+    def _spool_name(self, chunk_idx: int) -> str:
+        return f"chunk-{chunk_idx}.json"
+
+    def _spool_path(self, chunk_idx: int) -> str:
+        return os.path.join(self.directory, self._spool_name(chunk_idx))
+
+    def _write_json(self, name: str, data: Any):
+        # 先写临时文件再原子替换，避免中断时留下半个文件
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(dumps_bytes(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _append(self, event: Dict[str, Any]):
+        event["ts"] = time.time()
+        line = dumps_bytes(event) + b"\n"
+        with self._lock:
+            with open(os.path.join(self.directory, JOURNAL_FILE), 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
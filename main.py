@@ -1,146 +1,693 @@
 # main.py
-from typing import List
-from cmc_fetcher import fetch_ucids, fetch_coin_details, fetch_market_data
-from data_processor import process_data
-from pinecone_manager import init_pinecone_client, get_or_create_index, upsert_data_to_pinecone
-from utils import save_ucids_snapshot
+import argparse
+import os
+import queue
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import cmc_fetcher
+from cmc_fetcher import CMCAuthError, fetch_ucids, fetch_details_and_market_data, full_discovery_calls
+from data_processor import (process_data, fingerprint_record, classify_change, govern_metadata, metadata_size,
+                            CHANGE_NONE, CHANGE_METADATA)
+from pinecone_manager import (init_pinecone_client, get_or_create_index, upsert_data_to_pinecone,
+                              update_metadata_in_pinecone, report_index_stats, new_generation_namespace,
+                              validate_generation, switch_generation, drop_generation)
+from embedding_cache import get_embedding_cache
+from info_cache import get_info_cache, report_info_cache_stats
+from blob_store import get_blob_store, set_blob_store_path, report_blob_store_stats
+from credit_planner import confirm_credit_budget, flush_credit_usage, pipeline_chunk_size
+from journal import SyncJournal
+from embedding_scheduler import (plan_embedding_batches, is_rate_limit_error, retry_after_from_error,
+                                 response_total_tokens)
+from config import (PIPELINE_QUEUE_SIZE, EMBEDDING_MODEL, EMBEDDING_INPUT_TYPE, EMBEDDING_CONFIG,
+                    SYNC_JOURNAL_DIR, CMC_CALLS_PER_MINUTE, CMC_RATE_BURST, CMC_PLAN_CONFIG)
+from rate_limiter import SlidingWindowBudget, TokenBucket, backoff_delay
+from metrics import inc, observe, export_metrics
+from profiler import enable_profiling, profile_stage, write_profile_report
+from sharding import parse_shard, select_shard, shard_of, shard_state_path, shard_blob_store_path, shard_journal_dir
+from state_store import (StateStore, get_state_store, set_state_store_path, META_LAST_FULL_DISCOVERY,
+                         META_REINDEX_NAMESPACE, META_ABANDONED_NAMESPACES)
+from quotes_refresh import run_quotes_refresh
+from utils import save_ucids_snapshot, load_ucids_snapshot
+import sqlite3
 import time
 
-def embed_texts_with_pinecone(pc_client, texts: List[str]) -> List[List[float]]:
+# 所有向量化请求共享的每分钟 Token 配额
+_embed_budget = SlidingWindowBudget(EMBEDDING_CONFIG["tokens_per_minute"], 60)
+
+def _embed_with_retry(pc_client, batch_texts: List[str]):
+    """调用向量化接口；限流时优先按 Retry-After 等待，否则使用带抖动的指数退避"""
+    max_retries = EMBEDDING_CONFIG["max_retries"]
+    for attempt in range(max_retries):
+        try:
+            return pc_client.inference.embed(
+                model=EMBEDDING_MODEL,
+                inputs=batch_texts,
+                parameters={"input_type": EMBEDDING_INPUT_TYPE, "truncate": "END"}
+            )
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                raise
+            inc("rate_limited_total", service="embed")
+            if attempt == max_retries - 1:
+                raise
+            retry_after = retry_after_from_error(e)
+            wait_time = retry_after if retry_after is not None else backoff_delay(
+                attempt, EMBEDDING_CONFIG["backoff_base"], EMBEDDING_CONFIG["backoff_cap"])
+            print(f"⚠️ Pinecone API限流，等待 {wait_time:.1f} 秒后重试 (尝试 {attempt + 1}/{max_retries})...")
+            inc("retries_total", service="embed", reason=429)
+            inc("backoff_seconds_total", wait_time, service="embed")
+            time.sleep(wait_time)
+
+def _embed_uncached(pc_client, texts: List[str], on_batch=None) -> List[List[float]]:
     """
     使用 Pinecone Inference API 对文本进行向量化。
-    支持批量处理，每批最多96条（API限制）。
+    批次按输入条数上限（96 条）与估算 Token 数打包，每批在每分钟 Token 配额允许时立即发出。
+    每批成功后调用 on_batch(batch_texts, batch_embeddings)，以便及时写入缓存。
     """
     if not texts:
         return []
 
-    # Pinecone llama-text-embed-v2 模型的输入限制是96条
-    BATCH_SIZE = 96
+    batches = plan_embedding_batches(texts)
     all_embeddings = []
+    print(f"🚀 正在调用 Pinecone Inference API 对 {len(texts)} 条文本进行向量化，"
+          f"共 {len(batches)} 批，预计 {sum(tokens for _, _, tokens in batches)} tokens...")
 
-    print(f"🚀 正在调用 Pinecone Inference API 对 {len(texts)} 条文本进行向量化...")
-
-    # 分批处理
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch_texts = texts[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        total_batches = (len(texts) + BATCH_SIZE - 1) // BATCH_SIZE
-
-        print(f"📦 处理第 {batch_num}/{total_batches} 批，包含 {len(batch_texts)} 条文本...")
+    for batch_num, (start, end, estimated_tokens) in enumerate(batches, 1):
+        batch_texts = texts[start:end]
+        waited = _embed_budget.acquire(estimated_tokens)
+        if waited:
+            inc("rate_limit_wait_seconds_total", waited, limiter="embed_tpm")
+        if waited >= 1:
+            print(f"⏳ 等待 {waited:.1f} 秒以满足每分钟 Token 配额...")
+        print(f"📦 处理第 {batch_num}/{len(batches)} 批，包含 {len(batch_texts)} 条文本，约 {estimated_tokens} tokens...")
 
+        start_time = time.perf_counter()
         try:
-            # 调用 API 生成 embedding，添加重试机制
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = pc_client.inference.embed(
-                        model="llama-text-embed-v2",
-                        inputs=batch_texts,
-                        parameters={"input_type": "passage", "truncate": "END"}
-                    )
-                    break  # 成功则跳出重试循环
-                except Exception as e:
-                    error_str = str(e)
-                    is_rate_limit = ("429" in error_str or
-                                   "Too Many Requests" in error_str or
-                                   "RESOURCE_EXHAUSTED" in error_str or
-                                   "max embedding Tokens per minute" in error_str)
-
-                    if is_rate_limit:
-                        if attempt < max_retries - 1:
-                            wait_time = (attempt + 1) * 60  # 递增等待：60s, 120s, 180s
-                            print(f"⚠️ Pinecone API限流，等待 {wait_time} 秒后重试 (尝试 {attempt + 1}/{max_retries})...")
-                            time.sleep(wait_time)
-                        else:
-                            raise  # 最后一次尝试失败
-                    else:
-                        raise  # 其他错误直接抛出
-        
-            # 从响应中提取向量列表
-            if hasattr(response, 'data') and response.data:
-                batch_embeddings = []
-                for item in response.data:
-                    if hasattr(item, 'values'):
-                        batch_embeddings.append(item.values)
-                    else:
-                        print(f"⚠️ 响应项缺少 values 属性: {item}")
-                        return []
-                all_embeddings.extend(batch_embeddings)
-                print(f"✅ 第 {batch_num} 批成功获取 {len(batch_embeddings)} 条向量")
-            else:
-                print(f"❌ 第 {batch_num} 批响应中没有数据")
-                return []
-
+            response = _embed_with_retry(pc_client, batch_texts)
         except Exception as e:
             print(f"❌ 第 {batch_num} 批调用 Pinecone Inference API 失败: {e}")
             return []
+        observe("embed_batch_seconds", time.perf_counter() - start_time)
+
+        # 估算偏低时按实际用量补记，保证滑动窗口反映真实消耗
+        actual_tokens = response_total_tokens(response)
+        if actual_tokens is not None:
+            _embed_budget.consume(actual_tokens - estimated_tokens)
+        inc("embed_tokens_total", actual_tokens if actual_tokens is not None else estimated_tokens)
+        inc("embed_texts_total", len(batch_texts))
 
-        # 在批次之间添加延迟，避免API限流
-        if batch_num < total_batches:  # 不是最后一批
-            print(f"⏳ 等待 10 秒后处理下一批...")
-            time.sleep(10)
+        # 从响应中提取向量列表
+        if hasattr(response, 'data') and response.data:
+            batch_embeddings = []
+            for item in response.data:
+                if hasattr(item, 'values'):
+                    batch_embeddings.append(item.values)
+                else:
+                    print(f"⚠️ 响应项缺少 values 属性: {item}")
+                    return []
+            all_embeddings.extend(batch_embeddings)
+            if on_batch:
+                on_batch(batch_texts, batch_embeddings)
+            print(f"✅ 第 {batch_num} 批成功获取 {len(batch_embeddings)} 条向量")
+        else:
+            print(f"❌ 第 {batch_num} 批响应中没有数据")
+            return []
 
     print(f"🎉 所有批次完成！总共获取 {len(all_embeddings)} 条向量")
     return all_embeddings
 
-def run_sync_process(ucids: List[int]):
-    """执行同步的核心流程"""
-    if not ucids:
-        print("无 UCID 需要处理。")
-        return
+def embed_texts_with_pinecone(pc_client, texts: List[str]) -> List[List[float]]:
+    """
+    对文本进行向量化，优先使用本地向量缓存。
+    同一批中的重复文本只向量化一次，只有缓存未命中的文本才会调用 Pinecone Inference API。
+    """
+    if not texts:
+        return []
+
+    unique_texts = list(dict.fromkeys(texts))
+    cache = get_embedding_cache()
+    vectors_by_text: Dict[str, List[float]] = {}
+    if cache:
+        try:
+            vectors_by_text = cache.get_many(EMBEDDING_MODEL, EMBEDDING_INPUT_TYPE, unique_texts)
+        except sqlite3.Error as e:
+            print(f"⚠️ 读取向量缓存失败，全部重新向量化: {e}")
+
+    misses = [text for text in unique_texts if text not in vectors_by_text]
+    print(f"🗃️ 向量缓存：共 {len(texts)} 条文本，去重后 {len(unique_texts)} 条，"
+          f"命中 {len(vectors_by_text)} 条，需向量化 {len(misses)} 条")
+
+    if misses:
+        def store_batch(batch_texts: List[str], batch_embeddings: List[List[float]]):
+            if not cache:
+                return
+            try:
+                cache.put_many(EMBEDDING_MODEL, EMBEDDING_INPUT_TYPE, dict(zip(batch_texts, batch_embeddings)))
+            except sqlite3.Error as e:
+                print(f"⚠️ 写入向量缓存失败: {e}")
+
+        new_vectors = _embed_uncached(pc_client, misses, on_batch=store_batch)
+        if not new_vectors:
+            return []
+        vectors_by_text.update(zip(misses, new_vectors))
+
+    return [vectors_by_text[text] for text in texts]
 
-    # 1. 拉取数据 (不变)
-    coin_details = fetch_coin_details(ucids)
-    market_data = fetch_market_data(ucids)
-    if not coin_details or not market_data:
-        print("❌ 获取详情或市场数据失败，流程终止")
+_STOP = object()  # 流水线结束标记
+
+
+def _queue_put(q: queue.Queue, item, stop_event: threading.Event) -> bool:
+    """向有界队列放入数据；若流水线已中止则放弃，避免上游线程永久阻塞"""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _queue_iter(q: queue.Queue, stop_event: threading.Event):
+    """逐个取出队列中的数据，直到遇到结束标记或流水线中止"""
+    while True:
+        try:
+            item = q.get(timeout=1)
+        except queue.Empty:
+            if stop_event.is_set():
+                return
+            continue
+        if item is _STOP:
+            return
+        yield item
+
+
+def _run_stage(name: str, target, errors: List[str], stop_event: threading.Event, *args) -> threading.Thread:
+    """在后台线程中运行流水线阶段，出现未捕获异常时中止整条流水线；异常保存在线程的 error 属性上"""
+    def runner():
+        try:
+            target(*args)
+        except Exception as e:
+            print(f"❌ 流水线阶段 {name} 异常终止: {e}")
+            thread.error = e
+            errors.append(name)
+            stop_event.set()
+
+    thread = threading.Thread(target=runner, name=f"sync-{name}", daemon=True)
+    thread.error = None
+    thread.start()
+    return thread
+
+
+def _fetch_stage(chunks: List[List[int]], out_q: queue.Queue, stop_event: threading.Event, stats: Dict[str, int],
+                 journal: Optional[SyncJournal], state: Optional[StateStore]):
+    """
+    阶段 1：逐块拉取代币详情与市场数据并整合为待向量化数据。
+
+    提供 journal 时跳过已写入的代币，已拉取过的块直接读取日志中保存的结果。
+    提供 state 时跳过死信列表中的代币，并把本次新定位出的无效代币写入死信列表。
+    """
+    skipped = state.dead_letter_ucids() if state else set()
+    for chunk_idx, chunk in enumerate(chunks, 1):
+        if stop_event.is_set():
+            break
+        if skipped:
+            remaining = [ucid for ucid in chunk if ucid not in skipped]
+            stats["dead_letters"] += len(chunk) - len(remaining)
+            chunk = remaining
+            if not chunk:
+                continue
+        if journal:
+            remaining = [ucid for ucid in chunk if not journal.is_committed(ucid)]
+            stats["resumed"] += len(chunk) - len(remaining)
+            if not remaining:
+                continue
+            processed_list = journal.load_fetched(chunk_idx)
+            if processed_list is not None:
+                print(f"\n♻️ 第 {chunk_idx}/{len(chunks)} 块已拉取过，直接使用日志中的结果")
+                processed_list = [item for item in processed_list if not journal.is_committed(item["metadata"]["cmc_id"])]
+                stats["fetched"] += len(processed_list)
+                if not _queue_put(out_q, (chunk_idx, processed_list), stop_event):
+                    return
+                continue
+            chunk = remaining
+
+        print(f"\n📥 拉取第 {chunk_idx}/{len(chunks)} 块，包含 {len(chunk)} 个代币...")
+        dead_letters: Dict[int, str] = {}
+        start_time = time.perf_counter()
+        with profile_stage("fetch"):
+            coin_details, market_data = fetch_details_and_market_data(chunk, dead_letters)
+        observe("stage_seconds", time.perf_counter() - start_time, stage="fetch")
+        if dead_letters:
+            stats["dead_letters"] += len(dead_letters)
+            if state:
+                state.record_dead_letters(dead_letters)
+            chunk = [ucid for ucid in chunk if ucid not in dead_letters]
+        if not coin_details or not market_data:
+            print(f"❌ 第 {chunk_idx} 块获取详情或市场数据失败，跳过该块")
+            stats["fetch_failed"] += len(chunk)
+            continue
+        if state:
+            state.record_fetched(chunk, _extract_ranks(market_data))
+        start_time = time.perf_counter()
+        with profile_stage("process"):
+            processed_list = process_data(chunk, coin_details, market_data, release_raw=True)
+        observe("stage_seconds", time.perf_counter() - start_time, stage="process")
+        # 原始数据已在处理时逐条移除，释放剩余的引用，避免与后续阶段同时驻留内存
+        del coin_details, market_data
+        if not processed_list:
+            continue
+        if journal:
+            journal.record_fetched(chunk_idx, processed_list)
+        stats["fetched"] += len(processed_list)
+        if not _queue_put(out_q, (chunk_idx, processed_list), stop_event):
+            return
+    _queue_put(out_q, _STOP, stop_event)
+
+
+def _extract_ranks(market_data: Dict[str, Any]) -> Dict[int, int]:
+    """从报价数据中提取 CMC 排名"""
+    ranks = {}
+    for ucid_str, market in market_data.items():
+        rank = market.get("cmc_rank") if isinstance(market, dict) else None
+        if isinstance(rank, int):
+            ranks[int(ucid_str)] = rank
+    return ranks
+
+
+def _apply_metadata_budget(items: List[Dict[str, Any]]):
+    """
+    把待写入项（含 id 与 metadata）的元数据替换为按预算裁剪后的版本，被移出字段的完整值写入 blob 存储。
+    裁剪只作用于写入索引的副本，指纹与进度日志仍基于完整元数据。
+    """
+    if not items:
         return
+    store = get_blob_store()
+    blobs: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        original_bytes = metadata_size(item["metadata"])
+        item["metadata"], blobs[item["id"]] = govern_metadata(item["metadata"])
+        stored_bytes = metadata_size(item["metadata"])
+        inc("metadata_bytes_saved_total", original_bytes - stored_bytes)
+        for field in blobs[item["id"]]:
+            inc("metadata_fields_offloaded_total", field=field)
+        if store:
+            store.record_governed(original_bytes, stored_bytes, blobs[item["id"]])
+    if store:
+        try:
+            store.put_many(blobs)
+        except sqlite3.Error as e:
+            print(f"⚠️ 写入元数据 blob 存储失败，被移出字段暂时只保留预览: {e}")
+
 
-    # 2. 处理数据 (不变)
-    processed_list = process_data(ucids, coin_details, market_data)
-    if not processed_list: return
+def _embed_stage(pc_client, in_q: queue.Queue, out_q: queue.Queue, stop_event: threading.Event,
+                 stats: Dict[str, int], fingerprints: Optional[Dict[str, Dict[str, str]]],
+                 journal: Optional[SyncJournal], state: Optional[StateStore]):
+    """
+    阶段 2：对待向量化数据进行向量化，产出可直接上传的 Pinecone 数据。
 
-    # 3. 初始化 Pinecone 客户端 (提前)
-    # 因为向量化和存储都需要用到它
+    提供 fingerprints 时按指纹分类：文本变化（或新增）的代币重新向量化，
+    仅元数据变化的代币只更新元数据，未变化的代币直接跳过。
+    """
+    for chunk_idx, processed_list in _queue_iter(in_q, stop_event):
+        to_embed = []
+        metadata_updates = []
+        new_fingerprints: Dict[str, Dict[str, str]] = {}
+        unchanged: List[int] = []
+        for item in processed_list:
+            ucid_key = str(item["metadata"]["cmc_id"])
+            fingerprint = fingerprint_record(item)
+            change = classify_change(fingerprints.get(ucid_key) if fingerprints is not None else None, fingerprint)
+            if change == CHANGE_NONE:
+                stats["unchanged"] += 1
+                unchanged.append(item["metadata"]["cmc_id"])
+                continue
+            new_fingerprints[ucid_key] = fingerprint
+            if change == CHANGE_METADATA:
+                metadata_updates.append({"id": item["id"], "metadata": item["metadata"]})
+            else:
+                to_embed.append(item)
+
+        pinecone_data = []
+        if to_embed:
+            texts_to_embed = [item["token_info"] for item in to_embed]
+            start_time = time.perf_counter()
+            with profile_stage("embed"):
+                vectors = embed_texts_with_pinecone(pc_client, texts_to_embed)
+            observe("stage_seconds", time.perf_counter() - start_time, stage="embed")
+            if not vectors:
+                print(f"❌ 第 {chunk_idx} 块向量化失败，跳过该块的向量写入")
+                stats["embed_failed"] += len(to_embed)
+                for item in to_embed:
+                    new_fingerprints.pop(str(item["metadata"]["cmc_id"]), None)
+            else:
+                with profile_stage("build"):
+                    pinecone_data = [
+                        {"id": item["id"], "values": vectors[i], "metadata": item["metadata"]}
+                        for i, item in enumerate(to_embed)
+                    ]
+                stats["embedded"] += len(pinecone_data)
+                if journal:
+                    journal.record_embedded(chunk_idx, [item["id"] for item in to_embed])
+                if state:
+                    state.record_embedded([item["metadata"]["cmc_id"] for item in to_embed])
+
+        if not pinecone_data and not metadata_updates and not unchanged:
+            continue
+        _apply_metadata_budget(pinecone_data + metadata_updates)
+        # 未变化的代币也交给上传阶段，由它统一记录完成同步的时间
+        if not _queue_put(out_q, (chunk_idx, pinecone_data, metadata_updates, new_fingerprints, unchanged), stop_event):
+            return
+    _queue_put(out_q, _STOP, stop_event)
+
+
+def run_sync_process(ucids: List[int], fingerprints: Optional[Dict[str, Dict[str, str]]] = None,
+                     journal: Optional[SyncJournal] = None, state: Optional[StateStore] = None,
+                     namespace: Optional[str] = None) -> Dict[str, int]:
+    """
+    执行同步的核心流程。
+
+    以流水线方式运行：UCID 按块依次经过 拉取 -> 处理与向量化 -> 上传 三个阶段，
+    各阶段通过有界队列衔接并发执行，因此首批数据很快写入 Pinecone，
+    且内存中最多只驻留少量块的数据。
+
+    传入 fingerprints（{ucid 字符串: 指纹}）时启用变更检测，只处理有变化的代币；
+    成功写入的代币指纹会原地更新到该字典中，供调用方保存。
+
+    传入 journal 时把每块的拉取、向量化与写入进度持久化，并跳过日志中已写入的代币。
+    传入 state 时把每个代币的排名、指纹与各阶段时间戳增量写入状态库。
+    传入 namespace 时写入该命名空间（蓝绿重建的新一代），状态库中的指纹与市场字段记入该代的暂存记录，
+    切换成功后才替换当前一代的记录；否则写入读取指针指向的当前一代。
+    """
+    # 每个计数只由一个阶段写入，避免跨线程竞争
+    stats = {"resumed": 0, "dead_letters": 0, "fetched": 0, "fetch_failed": 0, "unchanged": 0, "embedded": 0, "embed_failed": 0,
+             "upserted": 0, "metadata_updated": 0, "stage_errors": 0}
+    if not ucids:
+        print("无 UCID 需要处理。")
+        return stats
+
+    # 1. 初始化 Pinecone 客户端与索引 (提前)
+    # 向量化和存储都需要用到它，失败时无需浪费 CMC 请求
     print("\n初始化 Pinecone 客户端...")
     pc_client = init_pinecone_client()
-    if not pc_client: return
+    if not pc_client: return stats
+    index = get_or_create_index(pc_client, namespace)
+    if not index: return stats
 
-    # 4. 向量化 (使用新的函数)
-    texts_to_embed = [item["token_info"] for item in processed_list]
-    vectors = embed_texts_with_pinecone(pc_client, texts_to_embed)
-    if not vectors: # 如果向量化失败，则终止流程
-        print("❌ 向量化失败，流程终止。")
-        return
+    # 2. 构建流水线
+    # 恢复运行时必须沿用日志中的分块大小，块编号才能与日志对应
+    chunk_size = journal.chunk_size if journal else pipeline_chunk_size()
+    chunks = [ucids[i:i + chunk_size] for i in range(0, len(ucids), chunk_size)]
+    print(f"🚀 启动同步流水线：{len(ucids)} 个代币，分为 {len(chunks)} 块，每块最多 {chunk_size} 个")
 
-    # 5. 准备最终数据 (不变)
-    pinecone_data = [
-        {"id": item["id"], "values": vectors[i], "metadata": item["metadata"]}
-        for i, item in enumerate(processed_list)
+    stop_event = threading.Event()
+    errors: List[str] = []
+    fetched_q: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    embedded_q: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    threads = [
+        _run_stage("fetch", _fetch_stage, errors, stop_event, chunks, fetched_q, stop_event, stats, journal, state),
+        _run_stage("embed", _embed_stage, errors, stop_event, pc_client, fetched_q, embedded_q, stop_event, stats,
+                   fingerprints, journal, state),
     ]
-    print("✅ 数据已转换为 Pinecone 格式")
 
-    # 6. 存储到 Pinecone
-    print("\n存储到 Pinecone...")
-    index = get_or_create_index(pc_client)
-    if not index: return
-    upsert_data_to_pinecone(index, pinecone_data)
+    # 3. 上传阶段在主线程中运行
+    try:
+        for chunk_idx, pinecone_data, metadata_updates, new_fingerprints, unchanged in _queue_iter(embedded_q, stop_event):
+            upserted = updated = 0
+            if pinecone_data or metadata_updates:
+                print(f"\n📤 上传第 {chunk_idx}/{len(chunks)} 块...")
+                start_time = time.perf_counter()
+                with profile_stage("upsert"):
+                    upserted = upsert_data_to_pinecone(index, pinecone_data, report_stats=False) if pinecone_data else 0
+                    updated = len(update_metadata_in_pinecone(index, metadata_updates))
+                observe("stage_seconds", time.perf_counter() - start_time, stage="upsert")
+            stats["upserted"] += upserted
+            stats["metadata_updated"] += updated
+            # 只有整块写入成功时才记录新指纹与完成同步的时间，失败的代币下次仍会被视为有变化且到期
+            if upserted == len(pinecone_data) and updated == len(metadata_updates):
+                if fingerprints is not None:
+                    fingerprints.update(new_fingerprints)
+                if journal:
+                    journal.record_committed(chunk_idx, new_fingerprints)
+                if state:
+                    # 蓝绿重建的新一代记入暂存，切换成功后才替换当前一代的指纹、市场字段与完成同步时间
+                    state.record_upserted(new_fingerprints, namespace)
+                    state.record_market_values({
+                        item["metadata"]["cmc_id"]: item["metadata"] for item in pinecone_data + metadata_updates
+                    }, namespace)
+                    if not namespace:
+                        state.record_synced([int(ucid) for ucid in new_fingerprints] + unchanged)
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    # 鉴权错误对之后的所有请求都一样，直接中止本次运行，不再继续后续步骤
+    for thread in threads:
+        if isinstance(thread.error, CMCAuthError):
+            raise thread.error
+
+    stats["stage_errors"] = len(errors)
+    for stage, count in stats.items():
+        inc("sync_records_total", count, stage=stage)
+    if errors:
+        print(f"❌ 流水线因阶段异常提前结束: {', '.join(errors)}")
+    report_index_stats(index)
+    print(f"📊 同步统计：已在此前写入 {stats['resumed']}，拉取 {stats['fetched']}，未变化 {stats['unchanged']}，向量化 {stats['embedded']}，"
+          f"上传 {stats['upserted']}，仅更新元数据 {stats['metadata_updated']}，"
+          f"失败 {stats['fetch_failed'] + stats['embed_failed']}，死信 {stats['dead_letters']}")
+    report_info_cache_stats()
+    report_blob_store_stats()
+    return stats
+
+def confirm_sync_budget(state: StateStore, ucids: List[int], discovery_calls: int = 0) -> bool:
+    """
+    按待拉取的代币数（详情扣除缓存中未过期的部分）打印 CMC 调用计划，并检查每日 credits 预算。
+    discovery_calls 为此前拉取 UCID 列表已发出的 map 请求数，一并列入计划。
+    """
+    info_count = len(ucids)
+    info_cache = get_info_cache()
+    if info_cache:
+        info_count -= info_cache.count_fresh(ucids)
+    return confirm_credit_budget(state, {"info": info_count, "quotes": len(ucids)}, pipeline_chunk_size(),
+                                 discovery_calls)
 
-def main():
+def _apply_shard_quotas(shard_count: int):
+    """各分片共享同一套餐配额：按分片数均分 CMC 调用速率、每日 credits 预算与向量化 TPM"""
+    global _embed_budget
+    cmc_fetcher._cmc_limiter = TokenBucket(CMC_CALLS_PER_MINUTE / shard_count, CMC_RATE_BURST)
+    _embed_budget = SlidingWindowBudget(EMBEDDING_CONFIG["tokens_per_minute"] / shard_count, 60)
+    CMC_PLAN_CONFIG["daily_credit_budget"] //= shard_count
+
+def cutover_generation(state: StateStore, namespace: str, ucids: List[int]) -> bool:
+    """校验新一代包含全部期望的代币（死信代币除外）后把读取指针切换过去，返回是否切换成功"""
+    pc_client = init_pinecone_client()
+    if not pc_client:
+        return False
+    index = get_or_create_index(pc_client, namespace)
+    if not index:
+        return False
+    dead_letters = state.dead_letter_ucids()
+    expected_ids = [f"cmc-{ucid}" for ucid in ucids if ucid not in dead_letters]
+    try:
+        if not validate_generation(index, namespace, expected_ids):
+            return False
+        switch_generation(index, namespace)
+    except Exception as e:
+        print(f"❌ 切换到新一代 {namespace} 失败：{e}")
+        return False
+    state.promote_generation(namespace)
+    state.set_meta(META_REINDEX_NAMESPACE, "")
+    return True
+
+def abandon_generation(state: StateStore, namespace: str):
+    """放弃未完成的蓝绿重建：清空暂存记录，并记下其命名空间，由 drop_abandoned_generations 删除已写入的向量"""
+    state.discard_generation(namespace)
+    abandoned = [ns for ns in (state.get_meta(META_ABANDONED_NAMESPACES) or "").split(",") if ns]
+    if namespace not in abandoned:
+        abandoned.append(namespace)
+    state.set_meta(META_ABANDONED_NAMESPACES, ",".join(abandoned))
+    state.set_meta(META_REINDEX_NAMESPACE, "")
+
+def drop_abandoned_generations(state: StateStore, index) -> int:
+    """删除已放弃的蓝绿重建写入的全部向量（按量计费的存储），返回删除的命名空间数；失败的下次运行时重试"""
+    abandoned = [ns for ns in (state.get_meta(META_ABANDONED_NAMESPACES) or "").split(",") if ns]
+    remaining = []
+    dropped = 0
+    for namespace in abandoned:
+        try:
+            dropped += drop_generation(index, namespace)
+        except Exception as e:
+            print(f"⚠️ 删除放弃的蓝绿重建 {namespace} 失败，下次运行时重试：{e}")
+            remaining.append(namespace)
+    if abandoned:
+        state.set_meta(META_ABANDONED_NAMESPACES, ",".join(remaining))
+    return dropped
+
+def main(resume: bool = False, shard: Optional[Tuple[int, int]] = None, reindex: bool = False):
+    """
+    全量同步。shard 为 (i, N) 时只同步按 UCID 哈希分到第 i 个分片的代币，
+    进度日志与状态库都写入该分片专用的文件，所有分片完成后用 --merge-shards N 合并状态库。
+
+    reindex 为 True 时进行蓝绿重建：写入新的命名空间，线上查询在此期间不受影响，
+    全部写入并校验通过后才切换读取指针；中断后用 --resume 继续写入同一个命名空间。
+    """
     print("=" * 60)
-    print("📌 开始执行【首次全量同步】流程")
+    print("📌 开始执行【首次全量同步】流程" + (f"（分片 {shard[0]}/{shard[1]}）" if shard else ""))
     print("=" * 60)
 
-    all_ucids = fetch_ucids()
-    if not all_ucids: return
+    journal_dir = SYNC_JOURNAL_DIR
+    if shard:
+        journal_dir = shard_journal_dir(*shard)
+        set_state_store_path(shard_state_path(*shard))
+        set_blob_store_path(shard_blob_store_path(*shard))
+        _apply_shard_quotas(shard[1])
+
+    journal = SyncJournal.load(journal_dir) if resume else None
+    if resume and journal is None:
+        print("⚠️ 未找到可恢复的同步进度日志，将开始新的全量同步")
+
+    state = get_state_store()
+    pending_namespace = state.get_meta(META_REINDEX_NAMESPACE)
+    namespace = None
+    if reindex or (journal and pending_namespace):
+        # 未完成的重建沿用原命名空间，已写入的向量无需重新上传
+        namespace = pending_namespace or new_generation_namespace()
+        state.set_meta(META_REINDEX_NAMESPACE, namespace)
+        print(f"🟩 蓝绿重建：写入新一代命名空间 {namespace}，完成校验前线上查询仍使用当前一代")
+    elif pending_namespace:
+        print(f"⚠️ 放弃未完成的蓝绿重建 {pending_namespace}，本次直接写入当前一代")
+        abandon_generation(state, pending_namespace)
+        pc_client = init_pinecone_client()
+        # 传入空命名空间直接得到索引本身，删除时显式指定命名空间
+        index = get_or_create_index(pc_client, "") if pc_client else None
+        if index:
+            drop_abandoned_generations(state, index)
+
+    discovery_calls = 0
+    if journal:
+        all_ucids = journal.ucids
+        # 已写入代币的指纹来自日志，保证最终保存的指纹基线完整
+        fingerprints: Dict[str, Dict[str, str]] = dict(journal.committed_fingerprints)
+        print(f"♻️ 从进度日志恢复：共 {len(all_ucids)} 个代币，已写入 {len(fingerprints)} 个，"
+              f"已向量化 {len(journal.embedded_ids)} 个，待上传的已拉取块 {len(journal.fetched_chunks)} 个")
+    else:
+        all_ucids = fetch_ucids()
+        if not all_ucids: return
+        discovery_calls = full_discovery_calls(len(all_ucids))
+        if shard:
+            total = len(all_ucids)
+            all_ucids = select_shard(all_ucids, *shard)
+            print(f"🧩 分片 {shard[0]}/{shard[1]} 负责 {len(all_ucids)}/{total} 个代币")
+        journal = SyncJournal.start(journal_dir, all_ucids, pipeline_chunk_size())
+        # 全量同步从空指纹开始，所有代币都会重新向量化，并为每日增量更新建立指纹基线
+        fingerprints = {}
 
     print(f"🔍 本次处理 {len(all_ucids)} 个代币 (全量同步)")
-    run_sync_process(all_ucids)
+    if not confirm_sync_budget(state, [ucid for ucid in all_ucids if not journal.is_committed(ucid)],
+                               discovery_calls):
+        flush_credit_usage(state)
+        return
+    stats = run_sync_process(all_ucids, fingerprints, journal, state, namespace)
+    flush_credit_usage(state)
 
+    # 指纹已在每块写入成功后记录到状态库，这里只需更新 UCID 列表
     print("\n保存 UCID 快照...")
     save_ucids_snapshot(all_ucids)
 
+    # 死信代币已单独记录，后续运行会跳过，不再阻止本次同步完成
+    unsynced = len(all_ucids) - len(fingerprints) - stats["dead_letters"]
+    if stats["fetch_failed"] or stats["embed_failed"] or stats["stage_errors"] or unsynced > 0:
+        print(f"\n⚠️ 仍有 {unsynced} 个代币未写入，可运行 `python main.py --resume` 继续")
+        return
+
+    if namespace and not cutover_generation(state, namespace, all_ucids):
+        print(f"\n⚠️ 新一代 {namespace} 未通过校验，读取指针保持不变，可运行 `python main.py --resume` 补齐后再切换")
+        return
+
+    journal.finish()
     print("\n🎉 全量同步流程执行完毕！")
 
+def merge_shards(shard_count: int):
+    """把各分片的状态库与元数据 blob 存储分别合并到主状态库与主 blob 存储：每个代币只采用其所属分片的记录"""
+    print("=" * 60)
+    print(f"🧩 开始合并 {shard_count} 个分片的状态库")
+    print("=" * 60)
+
+    state = get_state_store()
+    blob_store = get_blob_store()
+    discovery_times = []
+    for index in range(shard_count):
+        owns = lambda ucid, i=index: shard_of(ucid, shard_count) == i
+        blob_path = shard_blob_store_path(index, shard_count)
+        if blob_store and os.path.exists(blob_path):
+            blob_store.merge_shard(blob_path, owns)
+            print(f"✅ 已合并分片 {index}/{shard_count} 的元数据 blob 存储: {blob_path}")
+
+        path = shard_state_path(index, shard_count)
+        if not os.path.exists(path):
+            print(f"❌ 缺少分片 {index}/{shard_count} 的状态库 {path}，跳过该分片")
+            continue
+        # 先以独立连接打开一次：补齐旧版表结构，并在关闭时把 WAL 合并回数据库文件
+        shard_store = StateStore(path)
+        discovered_at = shard_store.get_meta(META_LAST_FULL_DISCOVERY)
+        shard_store.close()
+        # 未完成全量对账的分片（例如中途超时）只合并已有记录，不据此标记缺失代币
+        state.merge_shard(path, owns, reconciled=discovered_at is not None)
+        if discovered_at:
+            discovery_times.append(float(discovered_at))
+        print(f"✅ 已合并分片 {index}/{shard_count}: {path}")
+
+    # 所有分片都完成全量对账时，合并后的状态库同样视为完成了一次全量对账
+    if len(discovery_times) == shard_count:
+        state.set_meta(META_LAST_FULL_DISCOVERY, str(min(discovery_times)))
+    print(f"\n🎉 分片合并完成，当前 active 代币 {len(state.active_ucids())} 个")
+
+def quotes_only_refresh():
+    print("=" * 60)
+    print("💹 开始执行【行情快速刷新】流程 (仅 quotes，不重新向量化)")
+    print("=" * 60)
+
+    ucids = sorted(load_ucids_snapshot())
+    if not ucids:
+        print("❌ 状态库中没有 UCID，请先运行 main.py 进行首次全量同步。")
+        return
+    state = get_state_store()
+    if not confirm_credit_budget(state, {"quotes": len(ucids)}, pipeline_chunk_size()):
+        return
+    run_quotes_refresh(ucids, state)
+    flush_credit_usage(state)
+    print("\n🎉 行情快速刷新流程执行完毕！")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="CoinMarketCap -> Pinecone 全量同步")
+    parser.add_argument("--resume", action="store_true", help="从上次中断的进度日志继续同步")
+    parser.add_argument("--quotes-only", action="store_true",
+                        help="只拉取 quotes 并更新变化的市场元数据，不重新向量化")
+    parser.add_argument("--shard", metavar="i/N", type=parse_shard,
+                        help="只同步第 i 个分片（i 从 0 开始，共 N 个），用于多个 worker 并行全量同步")
+    parser.add_argument("--merge-shards", metavar="N", type=int,
+                        help="把 N 个分片的状态库合并到主状态库")
+    parser.add_argument("--reindex", action="store_true",
+                        help="蓝绿重建：全量写入新的命名空间，校验通过后再切换读取指针")
+    parser.add_argument("--profile", action="store_true",
+                        help="按阶段进行 CPU 与内存剖析，结束时写出报告与火焰图调用栈")
+    args = parser.parse_args()
+    if args.reindex and args.shard:
+        parser.error("--reindex 需要在单个进程内完成写入、校验与切换，不能与 --shard 同时使用")
+    job = "merge_shards" if args.merge_shards else "quotes_refresh" if args.quotes_only else "full_sync"
+    if args.profile:
+        enable_profiling()
+    try:
+        if args.merge_shards:
+            merge_shards(args.merge_shards)
+        elif args.quotes_only:
+            quotes_only_refresh()
+        else:
+            main(resume=args.resume, shard=args.shard, reindex=args.reindex)
+    except CMCAuthError as e:
+        print(f"❌ {e}，本次运行已中止")
+        sys.exit(1)
+    finally:
+        # 中途失败或提前结束时同样导出，便于定位耗时与限流情况
+        export_metrics(job)
+        write_profile_report(job)
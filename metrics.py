@@ -0,0 +1,156 @@
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+from config import METRICS_CONFIG
+
+# 指标说明，导出 Prometheus textfile 时作为 HELP 行；未登记的指标以指标名代替
+_HELP = {
+    "cmc_requests_total": "CMC HTTP 请求数（按端点与状态码）",
+    "cmc_request_seconds": "CMC 单次 HTTP 请求耗时",
+    "cmc_credits_total": "CMC 消耗的 credits",
+    "rate_limited_total": "收到 429 限流响应的次数",
+    "retries_total": "重试次数",
+    "backoff_seconds_total": "重试退避累计等待秒数",
+    "rate_limit_wait_seconds_total": "客户端限流器累计等待秒数",
+    "embed_batch_seconds": "单批向量化请求耗时",
+    "embed_tokens_total": "向量化消耗的 tokens",
+    "embed_texts_total": "向量化的文本条数",
+    "upsert_batch_seconds": "单批 upsert 请求耗时",
+    "upsert_bytes_total": "upsert 请求体估算字节数",
+    "upsert_vectors_total": "成功 upsert 的向量数",
+    "metadata_bytes_saved_total": "元数据按预算裁剪后减少的字节数",
+    "metadata_fields_offloaded_total": "移入 blob 存储的元数据字段数（按字段）",
+    "stage_seconds": "流水线各阶段处理单块的耗时",
+    "sync_records_total": "流水线各阶段处理的代币数",
+    "run_duration_seconds": "本次运行耗时",
+    "last_run_timestamp_seconds": "本次运行结束时间",
+}
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, _LabelKey], float] = {}
+_gauges: Dict[Tuple[str, _LabelKey], float] = {}
+# 直方图：[各桶计数（不累计）, 总和, 次数]，最后一个桶为 +Inf
+_histograms: Dict[Tuple[str, _LabelKey], List[Any]] = {}
+_started = time.time()
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, _LabelKey]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """计数器累加 value"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, value: float, **labels):
+    """向直方图记录一次观测值（耗时以秒为单位）"""
+    key = _key(name, labels)
+    buckets = METRICS_CONFIG["latency_buckets"]
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """返回当前所有指标序列，每个序列一个字典"""
+    buckets = METRICS_CONFIG["latency_buckets"]
+    series = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            series.append({"metric": name, "type": "counter", "labels": dict(labels), "value": value})
+        for (name, labels), value in sorted(_gauges.items()):
+            series.append({"metric": name, "type": "gauge", "labels": dict(labels), "value": value})
+        for (name, labels), (counts, total, count) in sorted(_histograms.items()):
+            series.append({"metric": name, "type": "histogram", "labels": dict(labels),
+                           "buckets": dict(zip([*map(str, buckets), "+Inf"], counts)), "sum": total, "count": count})
+    return series
+
+
+def reset_metrics():
+    """清空所有指标（用于测试）"""
+    global _started
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _started = time.time()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus(series: List[Dict[str, Any]]) -> str:
+    """按 Prometheus 文本格式渲染指标；直方图的桶计数按格式要求累计"""
+    prefix = METRICS_CONFIG["prefix"]
+    lines = []
+    described = set()
+    for item in series:
+        name = prefix + item["metric"]
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {name} {_HELP.get(item['metric'], item['metric'])}")
+            lines.append(f"# TYPE {name} {item['type']}")
+        labels = item["labels"]
+        if item["type"] != "histogram":
+            lines.append(f"{name}{_format_labels(labels)} {item['value']}")
+            continue
+        cumulative = 0
+        for le, count in item["buckets"].items():
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {item['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {item['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def export_metrics(job: str):
+    """
+    运行结束时导出指标：每个序列追加一行 JSON 到 jsonl_path，并覆盖写入该任务的 Prometheus textfile。
+    textfile 先写临时文件再原子替换，避免采集到写了一半的文件。导出失败只打印警告。
+    """
+    if not METRICS_CONFIG["enabled"]:
+        return
+    now = time.time()
+    set_gauge("run_duration_seconds", now - _started)
+    set_gauge("last_run_timestamp_seconds", now)
+    series = snapshot()
+    try:
+        jsonl_path = METRICS_CONFIG["jsonl_path"]
+        os.makedirs(os.path.dirname(jsonl_path) or ".", exist_ok=True)
+        with open(jsonl_path, "a", encoding="utf-8") as f:
+            for item in series:
+                f.write(json.dumps({"ts": now, "job": job, **item}, ensure_ascii=False) + "\n")
+
+        textfile_dir = METRICS_CONFIG["textfile_dir"]
+        os.makedirs(textfile_dir, exist_ok=True)
+        path = os.path.join(textfile_dir, f"{METRICS_CONFIG['prefix']}{job}.prom")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            # 各任务的 textfile 由同一个 collector 采集，以 task 标签区分（job 标签会与抓取任务的标签冲突）
+            f.write(render_prometheus([{**item, "labels": {"task": job, **item["labels"]}} for item in series]))
+        os.replace(path + ".tmp", path)
+        print(f"📈 已导出 {len(series)} 个指标序列：{jsonl_path}，{path}")
+    except OSError as e:
+        print(f"⚠️ 导出运行指标失败：{e}")
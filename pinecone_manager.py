@@ -1,10 +1,33 @@
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from pinecone import Pinecone
-from config import PINECONE_CONFIG, EMBEDDING_MODEL_DIMENSION
+from config import PINECONE_CONFIG, EMBEDDING_MODEL_DIMENSION, UPSERT_CONFIG, DELISTING_CONFIG, GENERATION_CONFIG
+from blob_store import expand_metadata
+from fast_json import dumps_bytes
+from metrics import inc, observe
+
+try:
+    # gRPC 客户端需要安装 pinecone[grpc]；未安装时数据面操作回退到 REST
+    from pinecone.grpc import PineconeGRPC
+except ImportError:
+    PineconeGRPC = None
 
 def init_pinecone_client():
-    """初始化 Pinecone 客户端"""
+    """
+    初始化 Pinecone 客户端。
+
+    transport 为 grpc 时使用 gRPC 客户端：upsert/delete/update/stats 等数据面操作走 protobuf 编码
+    和持久化的 gRPC 通道，控制面与 Inference API 的用法与 REST 客户端完全相同。
+    """
     try:
+        if PINECONE_CONFIG["transport"] == "grpc":
+            if PineconeGRPC is not None:
+                pc = PineconeGRPC(api_key=PINECONE_CONFIG["api_key"])
+                print("✅ Pinecone 客户端初始化成功 (数据面使用 gRPC)")
+                return pc
+            print("⚠️ 未安装 pinecone[grpc]，数据面操作回退到 REST")
         pc = Pinecone(api_key=PINECONE_CONFIG["api_key"])
         print("✅ Pinecone 客户端初始化成功")
         return pc
@@ -12,7 +35,14 @@ def init_pinecone_client():
         print(f"❌ Pinecone 客户端初始化失败：{e}")
         return None
 
-def get_or_create_index(pc_client):
+def _response_field(response, name: str, default=None):
+    """兼容 REST（类字典）与 gRPC（对象属性）两种响应格式读取字段"""
+    if isinstance(response, dict):
+        return response.get(name, default)
+    value = getattr(response, name, None)
+    return default if value is None else value
+
+def _connect_index(pc_client):
     """检查索引是否存在，不存在则创建"""
     index_name = PINECONE_CONFIG["index_name"]
 
@@ -39,23 +69,367 @@ def get_or_create_index(pc_client):
         return index
     except Exception as e:
         print(f"❌ 连接索引 {index_name} 失败：{e}")
+
+    if PineconeGRPC is not None and isinstance(pc_client, PineconeGRPC):
+        # gRPC 通道建立失败时回退到 REST
+        try:
+            index = Pinecone(api_key=PINECONE_CONFIG["api_key"]).Index(index_name)
+            print(f"✅ 已回退到 REST 连接索引：{index_name}")
+            return index
+        except Exception as e:
+            print(f"❌ REST 连接索引 {index_name} 也失败：{e}")
+    return None
+
+class NamespacedIndex:
+    """
+    把数据面操作绑定到指定命名空间的索引包装。
+
+    调用方显式传入 namespace 时以调用方为准，其余属性与方法直接转发给原索引，
+    因此上传、更新、删除等函数无需关心当前写入的是哪一代。
+    """
+
+    def __init__(self, index, namespace: str):
+        self.index = index
+        self.namespace = namespace
+
+    def _call(self, method: str, **kwargs):
+        kwargs.setdefault("namespace", self.namespace)
+        return getattr(self.index, method)(**kwargs)
+
+    def upsert(self, **kwargs):
+        return self._call("upsert", **kwargs)
+
+    def update(self, **kwargs):
+        return self._call("update", **kwargs)
+
+    def delete(self, **kwargs):
+        return self._call("delete", **kwargs)
+
+    def fetch(self, **kwargs):
+        return self._call("fetch", **kwargs)
+
+    def query(self, **kwargs):
+        return self._call("query", **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+def read_generation_pointer(index) -> Dict[str, Any]:
+    """
+    读取 _meta 命名空间中的读取指针，返回其元数据：
+    namespace 为当前对外提供查询的一代，previous 为等待清理的上一代，switched_at 为切换时间。
+    从未切换过时返回空字典（即仍使用默认命名空间）；读取失败时抛出异常。
+    """
+    pointer_id = GENERATION_CONFIG["pointer_id"]
+    response = index.fetch(ids=[pointer_id], namespace=GENERATION_CONFIG["meta_namespace"])
+    vector = (_response_field(response, "vectors", {}) or {}).get(pointer_id)
+    if vector is None:
+        return {}
+    return dict(_response_field(vector, "metadata", {}) or {})
+
+def resolve_active_namespace(index) -> str:
+    """读者解析当前应查询的命名空间，默认命名空间为空字符串"""
+    return read_generation_pointer(index).get("namespace", "")
+
+def _write_generation_pointer(index, metadata: Dict[str, Any]):
+    # 稠密索引不接受全零向量，指针向量只需一个非零分量
+    values = [1.0] + [0.0] * (EMBEDDING_MODEL_DIMENSION - 1)
+    index.upsert(vectors=[{"id": GENERATION_CONFIG["pointer_id"], "values": values, "metadata": metadata}],
+                 namespace=GENERATION_CONFIG["meta_namespace"])
+
+def get_or_create_index(pc_client, namespace: Optional[str] = None):
+    """
+    连接索引（不存在则创建），返回绑定到命名空间的索引。
+
+    namespace 为 None 时使用读取指针指向的当前一代；指针读取失败时返回 None，
+    避免在不确定当前一代的情况下写入错误的命名空间。
+    """
+    index = _connect_index(pc_client)
+    if index is None:
         return None
+    if namespace is None:
+        try:
+            namespace = resolve_active_namespace(index)
+        except Exception as e:
+            print(f"❌ 读取当前索引代际指针失败：{e}")
+            return None
+    if not namespace:
+        return index
+    print(f"🧭 使用命名空间：{namespace}")
+    return NamespacedIndex(index, namespace)
+
+def new_generation_namespace() -> str:
+    """为新一代生成命名空间名称，例如 gen-20240101120000"""
+    return time.strftime("gen-%Y%m%d%H%M%S", time.gmtime())
+
+def validate_generation(index, namespace: str, expected_ids: List[str]) -> bool:
+    """
+    校验新一代是否完整：逐批 fetch 期望的向量 ID，全部存在才通过；
+    索引统计中多出的向量只提示不拦截（统计数据在 Serverless 索引上有延迟）。
+    """
+    batch_size = GENERATION_CONFIG["validate_fetch_batch"]
+    missing: List[str] = []
+    for i in range(0, len(expected_ids), batch_size):
+        batch = expected_ids[i:i + batch_size]
+        response = index.fetch(ids=batch, namespace=namespace)
+        found = _response_field(response, "vectors", {}) or {}
+        missing.extend(vector_id for vector_id in batch if vector_id not in found)
+
+    if missing:
+        print(f"❌ 新一代 {namespace} 缺少 {len(missing)}/{len(expected_ids)} 条向量，例如 {missing[:10]}")
+        return False
+    try:
+        namespaces = _response_field(index.describe_index_stats(), "namespaces", {}) or {}
+        count = _response_field(namespaces.get(namespace) or {}, "vector_count", 0)
+        if count > len(expected_ids):
+            print(f"⚠️ 新一代 {namespace} 的统计向量数 {count} 多于期望的 {len(expected_ids)}")
+    except Exception as e:
+        print(f"⚠️ 获取索引统计失败，跳过向量数比对：{e}")
+    print(f"✅ 新一代 {namespace} 校验通过，共 {len(expected_ids)} 条向量")
+    return True
 
-def upsert_data_to_pinecone(index, pinecone_data):
-    """将处理后的数据批量存入 Pinecone"""
+def switch_generation(index, namespace: str):
+    """
+    把读取指针切换到 namespace。一次 upsert 完成切换，读者下次解析指针即读到新一代；
+    原来的一代记为 previous，保留 retain_hours 小时后由 collect_retired_generation 删除。
+    """
+    pointer = read_generation_pointer(index)
+    current = pointer.get("namespace", "")
+    # previous 与 namespace 相同表示没有待清理的上一代
+    stale = pointer.get("previous", current)
+    if current == namespace:
+        print(f"ℹ️ 读取指针已指向 {namespace}")
+        return
+    # 上上代已无人读取，直接删除，避免切换后丢失对它的引用
+    if stale != current and stale != namespace:
+        index.delete(delete_all=True, namespace=stale)
+        print(f"🗑️ 已删除更早的一代 {stale or '默认命名空间'}")
+    _write_generation_pointer(index, {"namespace": namespace, "previous": current, "switched_at": time.time()})
+    print(f"🔀 读取指针已从 {current or '默认命名空间'} 切换到 {namespace}")
+
+def collect_retired_generation(index, now: Optional[float] = None) -> bool:
+    """切换超过 retain_hours 小时后删除上一代的全部向量并清除记录，返回是否删除"""
+    pointer = read_generation_pointer(index)
+    previous = pointer.get("previous")
+    if previous is None or previous == pointer.get("namespace"):
+        return False
+    now = time.time() if now is None else now
+    if now - float(pointer.get("switched_at", 0)) < GENERATION_CONFIG["retain_hours"] * 3600:
+        return False
+    index.delete(delete_all=True, namespace=previous)
+    _write_generation_pointer(index, {**pointer, "previous": pointer.get("namespace", "")})
+    print(f"🗑️ 已删除切换前的一代 {previous or '默认命名空间'}")
+    return True
+
+def drop_generation(index, namespace: str) -> bool:
+    """
+    删除未切换过去的一代（放弃的蓝绿重建）的全部向量，返回是否删除。
+    读取指针正指向或仍在保留期内的一代不删除。
+    """
+    pointer = read_generation_pointer(index)
+    if namespace in (pointer.get("namespace", ""), pointer.get("previous")):
+        print(f"ℹ️ {namespace or '默认命名空间'} 仍被读取指针引用，不删除")
+        return False
+    index.delete(delete_all=True, namespace=namespace)
+    print(f"🗑️ 已删除放弃的蓝绿重建 {namespace}")
+    return True
+
+# 单个浮点数序列化为 JSON 后的最大字节数（含分隔符），用于估算请求体大小
+_FLOAT_JSON_BYTES = 25
+# 请求体过大的错误：HTTP 客户端返回 413，gRPC 客户端返回 RESOURCE_EXHAUSTED（消息长度超限），应直接拆分而不是原样重试
+_OVERSIZE_STATUS = 413
+_OVERSIZE_PATTERN = re.compile(r"^\s*\(413\)|RESOURCE_EXHAUSTED|message length", re.IGNORECASE)
+
+def _is_oversize_error(error: Exception) -> bool:
+    """判断写入失败是否因为请求体过大：优先看异常的状态码，没有时按错误信息的状态前缀判断"""
+    if getattr(error, "status", None) == _OVERSIZE_STATUS:
+        return True
+    return bool(_OVERSIZE_PATTERN.search(str(error)))
+
+def _estimate_vector_bytes(vector: Dict[str, Any]) -> int:
+    """估算单条向量序列化后的字节数：向量值按上限估算，元数据精确计算"""
+    metadata_bytes = len(dumps_bytes(vector.get("metadata") or {}))
+    return len(vector["id"]) + len(vector["values"]) * _FLOAT_JSON_BYTES + metadata_bytes + 64
+
+def _pack_batches(pinecone_data: List[Dict[str, Any]]) -> List[Tuple[List[Dict[str, Any]], int]]:
+    """按序列化字节数与条数上限打包批次，返回 [(批次, 估算字节数)]"""
+    max_bytes = UPSERT_CONFIG["max_request_bytes"]
+    max_vectors = UPSERT_CONFIG["max_batch_vectors"]
+    batches = []
+    batch: List[Dict[str, Any]] = []
+    batch_bytes = 0
+    for vector in pinecone_data:
+        vector_bytes = _estimate_vector_bytes(vector)
+        if batch and (batch_bytes + vector_bytes > max_bytes or len(batch) >= max_vectors):
+            batches.append((batch, batch_bytes))
+            batch, batch_bytes = [], 0
+        batch.append(vector)
+        batch_bytes += vector_bytes
+    if batch:
+        batches.append((batch, batch_bytes))
+    return batches
+
+def _upsert_batch(index, batch: List[Dict[str, Any]], batch_label: str, latencies: List[float]) -> int:
+    """
+    上传单个批次，失败时带退避重试；请求体过大或重试耗尽时对半拆分后递归上传，
+    从而隔离出无法写入的单条向量。返回成功上传的条数。
+    """
+    max_retries = UPSERT_CONFIG["max_retries"]
+    for attempt in range(max_retries):
+        start = time.perf_counter()
+        try:
+            response = index.upsert(vectors=batch)
+            latency = time.perf_counter() - start
+            latencies.append(latency)
+            observe("upsert_batch_seconds", latency)
+            count = _response_field(response, 'upserted_count', len(batch))
+            inc("upsert_vectors_total", count)
+            print(f"✅ 成功上传批次 {batch_label}，共 {count} 条向量，耗时 {latency * 1000:.0f} ms")
+            return count
+        except Exception as e:
+            error_str = str(e)
+            if _is_oversize_error(e):
+                print(f"⚠️ 批次 {batch_label} 请求体过大，拆分后重试: {error_str[:200]}")
+                break
+            if attempt < max_retries - 1:
+                wait_time = 2 ** attempt
+                print(f"⚠️ 批次 {batch_label} 上传失败，等待 {wait_time} 秒后重试 (尝试 {attempt + 1}/{max_retries}): {error_str[:200]}")
+                inc("retries_total", service="upsert", reason="error")
+                inc("backoff_seconds_total", wait_time, service="upsert")
+                time.sleep(wait_time)
+            else:
+                print(f"❌ 批次 {batch_label} 重试 {max_retries} 次后仍失败: {error_str[:200]}")
+
+    if len(batch) == 1:
+        print(f"❌ 向量 {batch[0]['id']} 无法写入 Pinecone，已跳过")
+        return 0
+    middle = len(batch) // 2
+    return (_upsert_batch(index, batch[:middle], f"{batch_label}a", latencies) +
+            _upsert_batch(index, batch[middle:], f"{batch_label}b", latencies))
+
+def upsert_data_to_pinecone(index, pinecone_data, report_stats: bool = True) -> int:
+    """
+    将处理后的数据批量存入 Pinecone，返回成功上传的向量数。
+
+    批次按序列化字节数打包以满足单次请求大小限制，并以多个并发请求同时上传。
+    """
     if not pinecone_data:
         print("⚠️ 无待存储的数据，跳过 Pinecone 存储步骤")
-        return
+        return 0
 
-    batch_size = 100
+    batches = _pack_batches(pinecone_data)
+    total_bytes = sum(batch_bytes for _, batch_bytes in batches)
+    inc("upsert_bytes_total", total_bytes)
+    concurrency = UPSERT_CONFIG["concurrency"]
+    print(f"🚀 开始上传 {len(pinecone_data)} 条向量：{len(batches)} 个批次，"
+          f"约 {total_bytes / 1024 / 1024:.1f} MB，并发 {concurrency}...")
+
+    latencies: List[float] = []
+    upserted = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="pinecone-upsert") as executor:
+        futures = [
+            executor.submit(_upsert_batch, index, batch, f"{batch_idx + 1}/{len(batches)}", latencies)
+            for batch_idx, (batch, _) in enumerate(batches)
+        ]
+        for future in futures:
+            try:
+                upserted += future.result()
+            except Exception as e:
+                print(f"❌ 数据存入 Pinecone 失败：{e}")
+    elapsed = time.perf_counter() - start
+
+    if latencies:
+        ordered = sorted(latencies)
+        p50 = ordered[len(ordered) // 2]
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        print(f"📈 上传完成：{upserted}/{len(pinecone_data)} 条，总耗时 {elapsed:.1f} 秒，"
+              f"{upserted / elapsed if elapsed else 0:.0f} 条/秒；单批延迟 p50 {p50 * 1000:.0f} ms，"
+              f"p95 {p95 * 1000:.0f} ms，最大 {ordered[-1] * 1000:.0f} ms")
+
+    if report_stats:
+        report_index_stats(index)
+    return upserted
+
+def fetch_token_metadata(index, ucids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    读取代币在索引中的元数据，返回 {ucid: 元数据}，索引中不存在的代币不包含在结果中。
+    超出预算被移入 blob 存储的字段按需还原为完整值，读取方拿到的与写入前的元数据一致。
+    """
+    vector_ids = [f"cmc-{ucid}" for ucid in ucids]
+    batch_size = GENERATION_CONFIG["validate_fetch_batch"]
+    results: Dict[int, Dict[str, Any]] = {}
+    for i in range(0, len(vector_ids), batch_size):
+        response = index.fetch(ids=vector_ids[i:i + batch_size])
+        for vector_id, vector in (_response_field(response, "vectors", {}) or {}).items():
+            metadata = dict(_response_field(vector, "metadata", {}) or {})
+            results[int(vector_id.split("-", 1)[1])] = expand_metadata(vector_id, metadata)
+    return results
+
+def _update_metadata(index, item: Dict[str, Any]) -> bool:
     try:
-        print(f"🚀 开始分批次上传数据，每批 {batch_size} 条...")
-        for i in range(0, len(pinecone_data), batch_size):
-            batch = pinecone_data[i:i + batch_size]
-            response = index.upsert(vectors=batch)
-            print(f"✅ 成功上传批次 {i // batch_size + 1}，共 {response.get('upserted_count', 0)} 条向量")
+        index.update(id=item["id"], set_metadata=item["metadata"])
+        return True
+    except Exception as e:
+        print(f"❌ 更新 {item['id']} 元数据失败：{e}")
+        return False
 
+def update_metadata_in_pinecone(index, updates) -> List[str]:
+    """
+    只更新已有向量的元数据（不重新上传向量），返回成功更新的 ID 列表。
+    Pinecone 的 update 每次只能更新一条，这里以多个并发请求批量执行。
+    """
+    if not updates:
+        return []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=UPSERT_CONFIG["concurrency"], thread_name_prefix="pinecone-update") as executor:
+        results = list(executor.map(lambda item: _update_metadata(index, item), updates))
+    updated_ids = [item["id"] for item, ok in zip(updates, results) if ok]
+    print(f"✅ 元数据更新完成，共 {len(updated_ids)}/{len(updates)} 条，耗时 {time.perf_counter() - start:.1f} 秒")
+    return updated_ids
+
+def _delete_batch(index, ids: List[str], batch_label: str) -> bool:
+    """删除单个批次，失败时带退避重试"""
+    max_retries = DELISTING_CONFIG["max_retries"]
+    for attempt in range(max_retries):
+        try:
+            index.delete(ids=ids)
+            return True
+        except Exception as e:
+            if attempt < max_retries - 1:
+                wait_time = 2 ** attempt
+                print(f"⚠️ 删除批次 {batch_label} 失败，等待 {wait_time} 秒后重试 (尝试 {attempt + 1}/{max_retries}): {str(e)[:200]}")
+                time.sleep(wait_time)
+            else:
+                print(f"❌ 删除批次 {batch_label} 重试 {max_retries} 次后仍失败: {str(e)[:200]}")
+    return False
+
+def delete_vectors_from_pinecone(index, ids: List[str]) -> List[str]:
+    """
+    按 ID 批量删除向量，返回成功删除的 ID 列表。
+    每批最多 delete_batch_size 个 ID，以多个并发请求同时执行。
+    """
+    if not ids:
+        return []
+    batch_size = DELISTING_CONFIG["delete_batch_size"]
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    print(f"🗑️ 开始删除 {len(ids)} 条向量：{len(batches)} 个批次，并发 {DELISTING_CONFIG['concurrency']}...")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=DELISTING_CONFIG["concurrency"], thread_name_prefix="pinecone-delete") as executor:
+        results = list(executor.map(
+            lambda args: _delete_batch(index, args[1], f"{args[0] + 1}/{len(batches)}"), enumerate(batches)
+        ))
+    elapsed = time.perf_counter() - start
+    deleted_ids = [vector_id for batch, ok in zip(batches, results) if ok for vector_id in batch]
+    print(f"✅ 删除完成：{len(deleted_ids)}/{len(ids)} 条，耗时 {elapsed:.1f} 秒，"
+          f"{len(deleted_ids) / elapsed if elapsed else 0:.0f} 条/秒")
+    return deleted_ids
+
+def report_index_stats(index):
+    """打印索引当前统计信息"""
+    try:
         index_stats = index.describe_index_stats()
-        print(f"📊 数据上传完成！索引当前统计：总向量数 = {index_stats.get('total_vector_count', 0)}")
+        print(f"📊 数据上传完成！索引当前统计：总向量数 = {_response_field(index_stats, 'total_vector_count', 0)}")
     except Exception as e:
-        print(f"❌ 数据存入 Pinecone 失败：{e}")
\ No newline at end of file
+        print(f"❌ 获取索引统计失败：{e}")
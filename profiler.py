@@ -0,0 +1,183 @@
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from config import PROFILE_CONFIG
+
+# 未启用剖析时所有 profile_stage 共用的空上下文，正常运行只多一次函数调用
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class StageProfiler:
+    """
+    按流水线阶段汇总 CPU 与内存剖析结果。
+
+    - CPU：每次进入阶段时在当前线程启用一个 cProfile，同名阶段的结果合并；
+    - 内存：每次记录阶段结束时仍被持有的新增字节数；每个阶段第一次运行时另在前后各取一次
+      tracemalloc 快照，按代码行列出分配位置（快照比对较慢，同一阶段的各块结构相同，取一次即可代表）；
+    - 调用栈：后台线程定期采样处于阶段内的线程，生成火焰图工具可直接读取的 folded 格式。
+
+    tracemalloc 是进程级的，并发运行的阶段会计入彼此的分配；同一线程内的阶段不应嵌套。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cpu: Dict[str, pstats.Stats] = {}
+        self._memory: Dict[str, Counter] = defaultdict(Counter)
+        self._retained: Counter = Counter()
+        self._calls: Counter = Counter()
+        self._seconds: Counter = Counter()
+        self._active: Dict[int, str] = {}  # 线程 ID -> 当前所在阶段
+        self._stacks: Counter = Counter()
+        self._cpu_unavailable = 0
+        self._stop = threading.Event()
+        self._started = time.time()
+        # 只按代码行统计，保存一层调用栈即可，快照与比对的开销最小
+        tracemalloc.start(1)
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        ident = threading.get_ident()
+        with self._lock:
+            detailed = name not in self._calls and name not in self._memory
+            if detailed:
+                self._memory[name] = Counter()
+        # 快照在计时、CPU 剖析与调用栈采样的范围之外进行，不计入阶段本身的开销
+        before = tracemalloc.take_snapshot() if detailed else None
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        with self._lock:
+            self._active[ident] = name
+        profile: Optional[cProfile.Profile] = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ 同一时刻只允许一个 profiler，与其他线程的阶段重叠时放弃本次 CPU 剖析
+            profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._active.pop(ident, None)
+            retained = tracemalloc.get_traced_memory()[0] - start_bytes
+            diffs = tracemalloc.take_snapshot().compare_to(before, "lineno") if before is not None else []
+            with self._lock:
+                self._calls[name] += 1
+                self._seconds[name] += elapsed
+                self._retained[name] += retained
+                if profile is None:
+                    self._cpu_unavailable += 1
+                elif name in self._cpu:
+                    self._cpu[name].add(profile)
+                else:
+                    self._cpu[name] = pstats.Stats(profile)
+                for diff in diffs:
+                    frame = diff.traceback[0]
+                    if diff.size_diff and frame.filename not in (tracemalloc.__file__, __file__):
+                        self._memory[name][(frame.filename, frame.lineno)] += diff.size_diff
+
+    def _sample(self):
+        while not self._stop.wait(PROFILE_CONFIG["sample_interval"]):
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, stage in active.items():
+                frame = frames.get(ident)
+                stack: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join([stage, *reversed(stack)])
+                    with self._lock:
+                        self._stacks[key] += 1
+
+    def write_report(self, job: str) -> str:
+        """停止采样并写出报告目录，返回目录路径"""
+        self._stop.set()
+        self._sampler.join()
+        tracemalloc.stop()
+        top_n = PROFILE_CONFIG["top_n"]
+        directory = os.path.join(PROFILE_CONFIG["output_dir"],
+                                 f"{job}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self._started))}")
+        os.makedirs(directory, exist_ok=True)
+
+        summary = [f"{'阶段':<12}{'次数':>8}{'耗时(s)':>12}{'保留内存(KB)':>16}"]
+        for stage in sorted(self._calls, key=lambda s: -self._seconds[s]):
+            retained = self._retained[stage]
+            summary.append(f"{stage:<12}{self._calls[stage]:>8}{self._seconds[stage]:>12.2f}{retained / 1024:>16.1f}")
+
+            stats = self._cpu.get(stage)
+            if stats is not None:
+                stats.dump_stats(os.path.join(directory, f"{stage}.prof"))
+                buffer = io.StringIO()
+                stats.stream = buffer
+                stats.sort_stats("cumulative").print_stats(top_n)
+                stats.sort_stats("tottime").print_stats(top_n)
+                _write(os.path.join(directory, f"{stage}.cpu.txt"), buffer.getvalue())
+
+            sites: List[Tuple[Tuple[str, int], int]] = self._memory[stage].most_common(top_n)
+            lines = [f"阶段 {stage} 第一次运行结束时仍被持有的新增分配（按代码行，"
+                     f"共 {sum(self._memory[stage].values()) / 1024:.1f} KB）"]
+            lines += [f"{size / 1024:>12.1f} KB  {filename}:{lineno}" for (filename, lineno), size in sites if size > 0]
+            _write(os.path.join(directory, f"{stage}.mem.txt"), "\n".join(lines) + "\n")
+
+        if self._cpu_unavailable:
+            summary.append(f"注：{self._cpu_unavailable} 次阶段因与其他线程的 profiler 重叠未做 CPU 剖析")
+        _write(os.path.join(directory, "summary.txt"), "\n".join(summary) + "\n")
+        _write(os.path.join(directory, "stacks.folded"),
+               "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common()))
+        print("🔬 各阶段剖析汇总：\n" + "\n".join(f"   {line}" for line in summary))
+        print(f"🔬 剖析报告已写入 {directory}（*.prof 可用 snakeviz 查看，stacks.folded 可用 flamegraph.pl 或 speedscope 生成火焰图）")
+        return directory
+
+
+def _write(path: str, content: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+_profiler: Optional[StageProfiler] = None
+
+
+def enable_profiling():
+    """开启剖析（由 --profile 调用），之后进入的阶段都会被记录"""
+    global _profiler
+    if _profiler is None:
+        _profiler = StageProfiler()
+        print("🔬 已启用性能剖析：cProfile + tracemalloc + 调用栈采样")
+
+
+def profile_stage(name: str):
+    """返回包裹一个阶段的上下文管理器；未启用剖析时返回空上下文"""
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name)
+
+
+def write_profile_report(job: str) -> Optional[str]:
+    """写出剖析报告；未启用剖析时什么也不做"""
+    global _profiler
+    if _profiler is None:
+        return None
+    profiler, _profiler = _profiler, None
+    try:
+        return profiler.write_report(job)
+    except OSError as e:
+        print(f"⚠️ 写入剖析报告失败：{e}")
+        return None
@@ -0,0 +1,70 @@
+from typing import Any, Dict, List
+from cmc_fetcher import fetch_market_data
+from config import MARKET_METADATA_FIELDS
+from credit_planner import pipeline_chunk_size
+from data_processor import extract_market_metadata
+from pinecone_manager import init_pinecone_client, get_or_create_index, update_metadata_in_pinecone
+from state_store import StateStore
+
+def _diff_market_values(current: Dict[str, Any], previous: Dict[str, Any]) -> Dict[str, Any]:
+    """返回与上次写入值不同的市场字段（缺失值不会写入，Pinecone 的 set_metadata 无法删除字段）"""
+    return {
+        field: current[field]
+        for field in MARKET_METADATA_FIELDS
+        if isinstance(current.get(field), (int, float)) and current[field] != previous.get(field)
+    }
+
+def run_quotes_refresh(ucids: List[int], state: StateStore) -> Dict[str, int]:
+    """
+    只刷新市场数据：仅调用 quotes 接口，与状态库中上次写入的值对比，
+    对发生变化的字段通过元数据 update 写入 Pinecone，不重新拉取详情也不重新向量化。
+    """
+    stats = {"fetched": 0, "changed": 0, "updated": 0, "unchanged": 0}
+    if not ucids:
+        print("无 UCID 需要刷新。")
+        return stats
+
+    print("\n初始化 Pinecone 客户端...")
+    pc_client = init_pinecone_client()
+    if not pc_client: return stats
+    index = get_or_create_index(pc_client)
+    if not index: return stats
+
+    skipped = state.dead_letter_ucids()
+    ucids = [ucid for ucid in ucids if ucid not in skipped]
+    chunk_size = pipeline_chunk_size()
+    for i in range(0, len(ucids), chunk_size):
+        chunk = ucids[i:i + chunk_size]
+        dead_letters: Dict[int, str] = {}
+        market_data = fetch_market_data(chunk, dead_letters)
+        if dead_letters:
+            state.record_dead_letters(dead_letters)
+        previous_values = state.market_values(chunk)
+
+        updates = []
+        current_values: Dict[int, Dict[str, Any]] = {}
+        for ucid in chunk:
+            market = market_data.get(str(ucid))
+            if not market:
+                continue
+            stats["fetched"] += 1
+            current = extract_market_metadata(market)
+            changed = _diff_market_values(current, previous_values.get(ucid, {}))
+            if not changed:
+                stats["unchanged"] += 1
+                continue
+            updates.append({"id": f"cmc-{ucid}", "metadata": changed})
+            current_values[ucid] = current
+
+        stats["changed"] += len(updates)
+        updated_ids = update_metadata_in_pinecone(index, updates)
+        stats["updated"] += len(updated_ids)
+        # 只记录成功写入的值，失败的代币下次仍会被视为有变化
+        updated_set = set(updated_ids)
+        state.record_market_values({
+            ucid: values for ucid, values in current_values.items() if f"cmc-{ucid}" in updated_set
+        })
+
+    print(f"📊 行情刷新统计：拉取 {stats['fetched']}，有变化 {stats['changed']}，"
+          f"已更新 {stats['updated']}，未变化 {stats['unchanged']}")
+    return stats
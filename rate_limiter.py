@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限流器。
+
+    令牌按固定速率补充，桶容量决定允许的瞬时突发请求数；
+    多个线程共享同一个实例即可把总请求速率限制在套餐配额之内。
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: int = 1):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute 必须大于 0")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """尝试立即获取令牌，不阻塞"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1) -> float:
+        """阻塞直到获得令牌，返回实际等待的秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+            waited += wait_time
+
+
+class SlidingWindowBudget:
+    """
+    线程安全的滑动窗口配额（例如每分钟 Token 数）。
+
+    记录窗口内每次消耗的数量和时间，新请求只有在窗口内的总消耗加上本次消耗不超过上限时才放行，
+    否则精确等待到最早的消耗移出窗口为止。
+    """
+
+    def __init__(self, limit: float, window_seconds: float = 60.0):
+        if limit <= 0:
+            raise ValueError("limit 必须大于 0")
+        self.limit = limit
+        self.window = window_seconds
+        self._events = deque()  # (时间, 数量)
+        self._used = 0.0
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._events and self._events[0][0] <= now - self.window:
+            _, amount = self._events.popleft()
+            self._used -= amount
+
+    def used(self) -> float:
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._used
+
+    def acquire(self, amount: float) -> float:
+        """阻塞直到窗口内有足够配额并记录本次消耗，返回实际等待的秒数；超过上限的请求按上限计"""
+        amount = min(amount, self.limit)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                if self._used + amount <= self.limit:
+                    self._events.append((now, amount))
+                    self._used += amount
+                    return waited
+                # 计算需要移出窗口的最早事件，使剩余配额足以容纳本次请求
+                excess = self._used + amount - self.limit
+                freed = 0.0
+                wait_until = now
+                for timestamp, event_amount in self._events:
+                    freed += event_amount
+                    wait_until = timestamp + self.window
+                    if freed >= excess:
+                        break
+                wait_time = max(wait_until - now, 0.001)
+            time.sleep(wait_time)
+            waited += wait_time
+
+    def consume(self, amount: float):
+        """不等待，直接记录一笔额外消耗（例如按实际用量修正估算值）"""
+        if amount <= 0:
+            return
+        with self._lock:
+            self._events.append((time.monotonic(), amount))
+            self._used += amount
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """解析 Retry-After 头：支持秒数或 HTTP 日期，无法解析时返回 None"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """带抖动的指数退避时间：在 [0.5, 1] 倍的 min(cap, base * 2^attempt) 之间随机"""
+    delay = min(cap, base * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
@@ -0,0 +1,50 @@
+import math
+import time
+from typing import Any, Dict, List, Optional
+from config import REFRESH_TIERS, REFRESH_MAX_COINS_PER_RUN
+from state_store import StateStore
+
+# 距上次拉取达到刷新间隔的该比例即视为到期，避免按固定周期运行时因几秒误差整整推迟一个周期
+_DUE_FRACTION = 0.9
+
+
+def tier_for(rank: Optional[int]) -> Dict[str, Any]:
+    """按排名返回所属的刷新档位，没有排名的代币归入最后一档"""
+    for tier in REFRESH_TIERS:
+        if tier["max_rank"] is not None and rank is not None and rank <= tier["max_rank"]:
+            return tier
+    return REFRESH_TIERS[-1]
+
+
+def select_due_ucids(state: StateStore, ucids: List[int], now: Optional[float] = None,
+                     limit: Optional[int] = REFRESH_MAX_COINS_PER_RUN) -> List[int]:
+    """
+    从 ucids 中选出本次需要刷新的代币。
+
+    从未完成过同步的代币总是到期；其余代币距上次完成同步（确认写入或判定未变化）超过所在档位的刷新间隔即到期。
+    只拉取成功、向量化或写入失败的代币不计入，下次运行时仍会重试。
+    到期代币按逾期程度（已过时间 / 刷新间隔）从高到低排序，同等逾期时排名靠前的优先，
+    最多取 limit 个，使每次运行的工作量有上限。
+    """
+    now = time.time() if now is None else now
+    status = state.refresh_status()
+    due = []
+    tier_counts: Dict[str, List[int]] = {tier["name"]: [0, 0] for tier in REFRESH_TIERS}
+    for ucid in ucids:
+        rank, synced_at = status.get(ucid, (None, None))
+        tier = tier_for(rank)
+        tier_counts[tier["name"]][1] += 1
+        if synced_at is None:
+            overdue = math.inf
+        else:
+            overdue = (now - synced_at) / (tier["interval_hours"] * 3600)
+            if overdue < _DUE_FRACTION:
+                continue
+        tier_counts[tier["name"]][0] += 1
+        due.append((-overdue, rank if rank is not None else math.inf, ucid))
+
+    due.sort()
+    selected = [ucid for _, _, ucid in (due[:limit] if limit else due)]
+    summary = "，".join(f"{name} {counts[0]}/{counts[1]}" for name, counts in tier_counts.items())
+    print(f"🗓️ 分层刷新：到期代币 {len(due)} 个（{summary}），本次处理 {len(selected)} 个")
+    return selected
@@ -0,0 +1,44 @@
+import hashlib
+import os
+from typing import List, Tuple
+from config import STATE_STORE_PATH, SYNC_JOURNAL_DIR, METADATA_BUDGET_CONFIG
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """解析 `i/N` 形式的分片参数（i 从 0 开始），返回 (i, N)"""
+    try:
+        index_str, count_str = spec.split("/")
+        index, count = int(index_str), int(count_str)
+    except ValueError:
+        raise ValueError(f"分片参数格式应为 i/N，例如 0/4，实际为 {spec!r}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"分片编号应满足 0 <= i < N，实际为 {spec!r}")
+    return index, count
+
+
+def shard_of(ucid: int, count: int) -> int:
+    """按 UCID 的哈希确定所属分片；与 Python 内置 hash 不同，结果在不同进程和机器间保持一致"""
+    digest = hashlib.sha256(str(ucid).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def select_shard(ucids: List[int], index: int, count: int) -> List[int]:
+    """返回属于第 index 个分片的 UCID，保持原有顺序"""
+    return [ucid for ucid in ucids if shard_of(ucid, count) == index]
+
+
+def shard_state_path(index: int, count: int) -> str:
+    """分片各自写入的状态库文件，例如 sync_state.shard-0-of-4.db"""
+    base, ext = os.path.splitext(STATE_STORE_PATH)
+    return f"{base}.shard-{index}-of-{count}{ext}"
+
+
+def shard_blob_store_path(index: int, count: int) -> str:
+    """分片各自写入的元数据 blob 存储，例如 metadata_blobs.shard-0-of-4.db"""
+    base, ext = os.path.splitext(METADATA_BUDGET_CONFIG["blob_store_path"])
+    return f"{base}.shard-{index}-of-{count}{ext}"
+
+
+def shard_journal_dir(index: int, count: int) -> str:
+    """分片各自的进度日志目录，例如 sync_journal-shard-0-of-4"""
+    return f"{SYNC_JOURNAL_DIR}-shard-{index}-of-{count}"
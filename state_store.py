@@ -0,0 +1,465 @@
+import atexit
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from config import STATE_STORE_PATH, MARKET_METADATA_FIELDS, DEAD_LETTER_RETRY_DAYS
+from fast_json import JSONDecodeError, load_file
+
+# 旧版 JSON 快照文件，首次打开状态库时一次性导入
+LEGACY_SNAPSHOT_FILE = "ucids_snapshot.json"
+
+# 代币状态
+STATUS_ACTIVE = "active"  # 当前仍在 CMC 列表中
+STATUS_MISSING = "missing"  # 最近一次获取的 UCID 列表中未出现
+STATUS_DELETED = "deleted"  # 已确认下架，向量已从 Pinecone 删除
+
+# meta 表键：最近一次全量 UCID 对账的时间戳
+META_LAST_FULL_DISCOVERY = "last_full_discovery_at"
+# meta 表键：进行中的蓝绿重建所写入的命名空间，完成切换后清空
+META_REINDEX_NAMESPACE = "reindex_namespace"
+# meta 表键：已放弃、向量尚未删除的蓝绿重建命名空间（逗号分隔），删除成功后移除
+META_ABANDONED_NAMESPACES = "abandoned_namespaces"
+# meta 表键前缀：各分片已合并的当天 credits，键为 前缀 + 分片库路径 + ":" + 分片中的 credits 键
+META_MERGED_CREDITS_PREFIX = "merged_credits:"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS coins (
+    ucid INTEGER PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'active',
+    rank INTEGER,
+    content_hash TEXT,
+    embedding_hash TEXT,
+    last_seen_at REAL,
+    last_fetched_at REAL,
+    last_embedded_at REAL,
+    last_upserted_at REAL,
+    last_synced_at REAL,
+    missing_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_coins_status ON coins(status);
+CREATE TABLE IF NOT EXISTS market_values (
+    ucid INTEGER PRIMARY KEY,
+    circulating_supply REAL,
+    total_supply REAL,
+    max_supply REAL,
+    fdv REAL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS generation_fingerprints (
+    namespace TEXT NOT NULL,
+    ucid INTEGER NOT NULL,
+    content_hash TEXT,
+    embedding_hash TEXT,
+    upserted_at REAL,
+    PRIMARY KEY (namespace, ucid)
+);
+CREATE TABLE IF NOT EXISTS generation_market_values (
+    namespace TEXT NOT NULL,
+    ucid INTEGER NOT NULL,
+    circulating_supply REAL,
+    total_supply REAL,
+    max_supply REAL,
+    fdv REAL,
+    updated_at REAL,
+    PRIMARY KEY (namespace, ucid)
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    ucid INTEGER PRIMARY KEY,
+    reason TEXT,
+    failures INTEGER NOT NULL DEFAULT 1,
+    failed_at REAL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class StateStore:
+    """
+    基于 SQLite（WAL 模式）的本地同步状态库，每个 UCID 一行。
+
+    记录代币的内容哈希（元数据）、向量化哈希（待向量化文本）、排名、状态，
+    以及最近一次拉取/向量化/写入/完成同步的时间。所有更新都按行增量写入。
+
+    coins 与 market_values 中的指纹和市场字段始终对应读取指针指向的当前一代；
+    蓝绿重建写入新一代时记入 generation_* 表，切换成功后才整体替换当前一代的记录。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(coins)")}
+        if "missing_count" not in columns:  # 旧版状态库缺少该列
+            self._conn.execute("ALTER TABLE coins ADD COLUMN missing_count INTEGER NOT NULL DEFAULT 0")
+        if "last_synced_at" not in columns:  # 旧版状态库按拉取时间调度，改用最近一次确认写入的时间
+            self._conn.execute("ALTER TABLE coins ADD COLUMN last_synced_at REAL")
+            self._conn.execute("UPDATE coins SET last_synced_at = last_upserted_at")
+        self._conn.commit()
+
+    # -------------------------- 元信息 --------------------------
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    # -------------------------- UCID 列表 --------------------------
+    def active_ucids(self) -> Set[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT ucid FROM coins WHERE status = ?", (STATUS_ACTIVE,)).fetchall()
+        return {row[0] for row in rows}
+
+    def max_ucid(self) -> int:
+        """返回状态库中出现过的最大 UCID，没有记录时返回 0"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(ucid) FROM coins").fetchone()
+        return row[0] or 0
+
+    def mark_seen(self, ucids: Iterable[int], reconcile: bool = True) -> int:
+        """
+        把本次获取到的 UCID 标记为 active，返回新增数量。
+
+        reconcile 为 True 表示传入的是全量列表：其余未删除的代币标记为 missing 并累加连续缺失次数，
+        同时记录对账时间；增量发现只传入新代币，此时应设为 False。
+        """
+        now = time.time()
+        ucid_list = list(ucids)
+        with self._lock:
+            before = self._conn.execute("SELECT COUNT(*) FROM coins").fetchone()[0]
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (ucid INTEGER PRIMARY KEY)")
+            self._conn.execute("DELETE FROM seen")
+            self._conn.executemany("INSERT OR IGNORE INTO seen VALUES (?)", [(u,) for u in ucid_list])
+            self._conn.execute(
+                "INSERT INTO coins (ucid, status, last_seen_at) SELECT ucid, ?, ? FROM seen WHERE true"
+                " ON CONFLICT(ucid) DO UPDATE SET status = excluded.status, last_seen_at = excluded.last_seen_at,"
+                " missing_count = 0",
+                (STATUS_ACTIVE, now)
+            )
+            if reconcile:
+                self._conn.execute(
+                    "UPDATE coins SET status = ?, missing_count = missing_count + 1"
+                    " WHERE status IN (?, ?) AND ucid NOT IN (SELECT ucid FROM seen)",
+                    (STATUS_MISSING, STATUS_ACTIVE, STATUS_MISSING)
+                )
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                   (META_LAST_FULL_DISCOVERY, str(now)))
+            added = self._conn.execute("SELECT COUNT(*) FROM coins").fetchone()[0] - before
+            self._conn.commit()
+        return added
+
+    # -------------------------- 下架处理 --------------------------
+    def missing_ucids(self) -> Set[int]:
+        """返回最近一次全量对账中缺失、尚未删除的 UCID"""
+        with self._lock:
+            rows = self._conn.execute("SELECT ucid FROM coins WHERE status = ?", (STATUS_MISSING,)).fetchall()
+        return {row[0] for row in rows}
+
+    def delisting_candidates(self, grace_reconciles: int) -> List[int]:
+        """返回连续 grace_reconciles 次全量对账都缺失的 UCID，可确认下架"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ucid FROM coins WHERE status = ? AND missing_count >= ? ORDER BY ucid",
+                (STATUS_MISSING, grace_reconciles)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def record_deleted(self, ucids: List[int]):
+        """
+        记录已从 Pinecone 删除的代币：清空指纹与市场数据，重新上架时会按新代币处理。
+        蓝绿重建暂存的记录一并清空，切换时不会把已删除代币的指纹带回来。
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE coins SET status = ?, embedding_hash = NULL, content_hash = NULL WHERE ucid = ?",
+                [(STATUS_DELETED, ucid) for ucid in ucids]
+            )
+            for table in ("market_values", "generation_fingerprints", "generation_market_values"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE ucid = ?", [(ucid,) for ucid in ucids])
+            self._conn.commit()
+
+    # -------------------------- 同步进度 --------------------------
+    def refresh_status(self) -> Dict[int, Tuple[Optional[int], Optional[float]]]:
+        """返回每个代币的 {ucid: (排名, 最近一次完成同步的时间)}，供分层刷新调度使用"""
+        with self._lock:
+            rows = self._conn.execute("SELECT ucid, rank, last_synced_at FROM coins").fetchall()
+        return {ucid: (rank, synced_at) for ucid, rank, synced_at in rows}
+
+    def fingerprints(self) -> Dict[str, Dict[str, str]]:
+        """返回已写入代币的指纹 {ucid 字符串: {"text": 向量化哈希, "meta": 内容哈希}}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ucid, embedding_hash, content_hash FROM coins WHERE embedding_hash IS NOT NULL"
+            ).fetchall()
+        return {str(ucid): {"text": text_hash, "meta": meta_hash} for ucid, text_hash, meta_hash in rows}
+
+    def record_fetched(self, ucids: List[int], ranks: Optional[Dict[int, int]] = None):
+        """记录成功拉取的代币；成功拉取的代币同时移出死信列表"""
+        ranks = ranks or {}
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO coins (ucid, rank, last_fetched_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(ucid) DO UPDATE SET rank = COALESCE(excluded.rank, coins.rank),"
+                " last_fetched_at = excluded.last_fetched_at",
+                [(ucid, ranks.get(ucid), now) for ucid in ucids]
+            )
+            self._conn.executemany("DELETE FROM dead_letters WHERE ucid = ?", [(ucid,) for ucid in ucids])
+            self._conn.commit()
+
+    def record_embedded(self, ucids: List[int]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE coins SET last_embedded_at = ? WHERE ucid = ?", [(now, ucid) for ucid in ucids]
+            )
+            self._conn.commit()
+
+    def record_upserted(self, fingerprints: Dict[str, Dict[str, str]], namespace: Optional[str] = None):
+        """记录已成功写入 Pinecone 的代币及其指纹；namespace 为进行中的蓝绿重建时记入该代的暂存记录"""
+        now = time.time()
+        with self._lock:
+            if namespace:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO generation_fingerprints VALUES (?, ?, ?, ?, ?)",
+                    [(namespace, int(ucid), fp["meta"], fp["text"], now) for ucid, fp in fingerprints.items()]
+                )
+                self._conn.commit()
+                return
+            self._conn.executemany(
+                "INSERT INTO coins (ucid, embedding_hash, content_hash, last_upserted_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(ucid) DO UPDATE SET embedding_hash = excluded.embedding_hash,"
+                " content_hash = excluded.content_hash, last_upserted_at = excluded.last_upserted_at",
+                [(int(ucid), fp["text"], fp["meta"], now) for ucid, fp in fingerprints.items()]
+            )
+            self._conn.commit()
+
+    def record_synced(self, ucids: List[int]):
+        """
+        记录完成同步的代币：所在块已确认写入 Pinecone，或拉取后判定为未变化。
+        拉取成功但向量化或写入失败的代币不记录，分层刷新时仍视为到期。
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE coins SET last_synced_at = ? WHERE ucid = ?", [(now, int(ucid)) for ucid in ucids]
+            )
+            self._conn.commit()
+
+    # -------------------------- 死信列表 --------------------------
+    def dead_letter_ucids(self) -> Set[int]:
+        """返回仍在冷却期内的死信 UCID；超过 DEAD_LETTER_RETRY_DAYS 的会被重新尝试"""
+        cutoff = time.time() - DEAD_LETTER_RETRY_DAYS * 86400
+        with self._lock:
+            rows = self._conn.execute("SELECT ucid FROM dead_letters WHERE failed_at >= ?", (cutoff,)).fetchall()
+        return {row[0] for row in rows}
+
+    def record_dead_letters(self, dead_letters: Dict[int, str]):
+        """记录无法从 CMC 获取的 UCID 及原因，重复失败时累加次数"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO dead_letters (ucid, reason, failures, failed_at) VALUES (?, ?, 1, ?)"
+                " ON CONFLICT(ucid) DO UPDATE SET reason = excluded.reason,"
+                " failures = dead_letters.failures + 1, failed_at = excluded.failed_at",
+                [(ucid, reason, now) for ucid, reason in dead_letters.items()]
+            )
+            self._conn.commit()
+
+    # -------------------------- 市场数据 --------------------------
+    def market_values(self, ucids: List[int]) -> Dict[int, Dict[str, Optional[float]]]:
+        """返回最近一次写入 Pinecone 的市场字段 {ucid: {字段: 值}}"""
+        columns = ", ".join(MARKET_METADATA_FIELDS)
+        values: Dict[int, Dict[str, Optional[float]]] = {}
+        with self._lock:
+            for i in range(0, len(ucids), 500):
+                batch = ucids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT ucid, {columns} FROM market_values WHERE ucid IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for row in rows:
+                    values[row[0]] = dict(zip(MARKET_METADATA_FIELDS, row[1:]))
+        return values
+
+    def record_market_values(self, values: Dict[int, Dict[str, object]], namespace: Optional[str] = None):
+        """
+        记录已写入 Pinecone 的市场字段，只取 MARKET_METADATA_FIELDS 中的数值字段；
+        namespace 为进行中的蓝绿重建时记入该代的暂存记录
+        """
+        now = time.time()
+        rows = []
+        for ucid, fields in values.items():
+            row = [int(ucid)]
+            for field in MARKET_METADATA_FIELDS:
+                value = fields.get(field)
+                row.append(value if isinstance(value, (int, float)) and not isinstance(value, bool) else None)
+            rows.append((*row, now))
+        columns = ", ".join(MARKET_METADATA_FIELDS)
+        placeholders = ", ".join("?" * (len(MARKET_METADATA_FIELDS) + 2))
+        with self._lock:
+            if namespace:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO generation_market_values (namespace, ucid, {columns}, updated_at)"
+                    f" VALUES (?, {placeholders})", [(namespace, *row) for row in rows]
+                )
+            else:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO market_values (ucid, {columns}, updated_at) VALUES ({placeholders})", rows
+                )
+            self._conn.commit()
+
+    # -------------------------- 蓝绿重建 --------------------------
+    def promote_generation(self, namespace: str):
+        """
+        新一代切换成功后，用其暂存的指纹与市场字段替换当前记录，并清空暂存。
+        重建期间每日更新写入旧一代的记录一并被替换，之后的变更检测以新一代实际写入的内容为基线。
+        """
+        columns = ", ".join(MARKET_METADATA_FIELDS)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO coins (ucid, embedding_hash, content_hash, last_upserted_at, last_synced_at)"
+                " SELECT ucid, embedding_hash, content_hash, upserted_at, upserted_at FROM generation_fingerprints"
+                " WHERE namespace = ? AND true"
+                " ON CONFLICT(ucid) DO UPDATE SET embedding_hash = excluded.embedding_hash,"
+                " content_hash = excluded.content_hash, last_upserted_at = excluded.last_upserted_at,"
+                " last_synced_at = excluded.last_synced_at",
+                (namespace,)
+            )
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO market_values (ucid, {columns}, updated_at)"
+                f" SELECT ucid, {columns}, updated_at FROM generation_market_values WHERE namespace = ?",
+                (namespace,)
+            )
+            self._discard_generation(namespace)
+            self._conn.commit()
+
+    def discard_generation(self, namespace: str):
+        """放弃未完成的蓝绿重建时清空该代的暂存记录"""
+        with self._lock:
+            self._discard_generation(namespace)
+            self._conn.commit()
+
+    def _discard_generation(self, namespace: str):
+        self._conn.execute("DELETE FROM generation_fingerprints WHERE namespace = ?", (namespace,))
+        self._conn.execute("DELETE FROM generation_market_values WHERE namespace = ?", (namespace,))
+
+    # -------------------------- 分片合并 --------------------------
+    def merge_shard(self, path: str, owns: Callable[[int], bool], reconciled: bool = True):
+        """
+        合并一个分片的状态库：只采用该分片负责的代币（owns(ucid) 为真）的行。
+        按列合并：分片中为空的列（如只做过 mark_seen 的代币的指纹与时间戳）保留本库原值；
+        分片已删除的代币按分片清空指纹。
+
+        reconciled 表示分片已完成全量对账：此时分片库中没有出现、但在本库中仍为 active 的所属代币，
+        说明分片本次全量获取的列表中已没有它，按一次对账缺失处理。
+
+        各分片当天消耗的 credits 累加到本库：每个分片已合并的值单独记录，重复合并同一分片
+        （如 --resume 后同一天再次合并）只累加分片计数新增的部分，不会重复计入。
+        """
+        nullable_columns = ("rank", "last_seen_at", "last_fetched_at", "last_embedded_at", "last_upserted_at",
+                            "last_synced_at")
+        coin_columns = ", ".join(["ucid", "status", "missing_count", "content_hash", "embedding_hash",
+                                  *nullable_columns])
+        coin_updates = ", ".join(
+            ["status = excluded.status", "missing_count = excluded.missing_count"]
+            + [f"{column} = CASE WHEN excluded.status = '{STATUS_DELETED}' THEN excluded.{column}"
+               f" ELSE COALESCE(excluded.{column}, coins.{column}) END" for column in ("content_hash", "embedding_hash")]
+            + [f"{column} = COALESCE(excluded.{column}, coins.{column})" for column in nullable_columns]
+        )
+        market_columns = ", ".join(["ucid", *MARKET_METADATA_FIELDS, "updated_at"])
+        with self._lock:
+            self._conn.create_function("owns", 1, lambda ucid: bool(owns(ucid)), deterministic=True)
+            self._conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                if reconciled:
+                    self._conn.execute(
+                        "UPDATE coins SET status = ?, missing_count = missing_count + 1"
+                        " WHERE owns(ucid) AND status = ? AND ucid NOT IN (SELECT ucid FROM shard.coins)",
+                        (STATUS_MISSING, STATUS_ACTIVE)
+                    )
+                self._conn.execute(
+                    f"INSERT INTO coins ({coin_columns})"
+                    f" SELECT {coin_columns} FROM shard.coins WHERE owns(ucid)"
+                    f" ON CONFLICT(ucid) DO UPDATE SET {coin_updates}"
+                )
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO market_values ({market_columns})"
+                    f" SELECT {market_columns} FROM shard.market_values WHERE owns(ucid)"
+                )
+                self._conn.execute("DELETE FROM dead_letters WHERE owns(ucid)")
+                self._conn.execute(
+                    "INSERT INTO dead_letters SELECT ucid, reason, failures, failed_at FROM shard.dead_letters"
+                    " WHERE owns(ucid)"
+                )
+                for key, value in self._conn.execute(
+                    "SELECT key, value FROM shard.meta WHERE key LIKE 'cmc_credits:%'"
+                ).fetchall():
+                    merged_key = f"{META_MERGED_CREDITS_PREFIX}{path}:{key}"
+                    row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (merged_key,)).fetchone()
+                    merged = int(row[0]) if row else 0
+                    if int(value) <= merged:
+                        continue
+                    row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+                    total = int(row[0] if row else 0) + int(value) - merged
+                    self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                           [(key, str(total)), (merged_key, value)])
+                self._conn.commit()
+            finally:
+                self._conn.execute("DETACH DATABASE shard")
+
+    # -------------------------- 迁移与关闭 --------------------------
+    def import_legacy_snapshot(self, snapshot_path: str):
+        """一次性导入旧版 ucids_snapshot.json"""
+        if self.get_meta("legacy_imported"):
+            return
+        try:
+            ucids = load_file(snapshot_path)
+            self.mark_seen(ucids)
+            print(f"✅ 已从 {snapshot_path} 导入 {len(ucids)} 个 UCID 到状态库")
+        except FileNotFoundError:
+            pass
+        except (IOError, JSONDecodeError) as e:
+            print(f"❌ 导入旧 UCID 快照失败，稍后重试: {e}")
+            return
+        self.set_meta("legacy_imported", str(time.time()))
+
+    def close(self):
+        """关闭前把 WAL 合并回主库文件，便于直接提交数据库文件"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+
+
+_store: Optional[StateStore] = None
+_store_path = STATE_STORE_PATH
+_store_lock = threading.Lock()
+
+
+def set_state_store_path(path: str):
+    """在首次打开全局状态库之前切换其路径（分片同步时每个分片写入各自的状态库）"""
+    global _store_path
+    with _store_lock:
+        if _store is not None and _store.path != path:
+            raise RuntimeError(f"状态库 {_store.path} 已打开，无法切换到 {path}")
+        _store_path = path
+
+
+def get_state_store() -> StateStore:
+    """获取全局状态库（首次打开时导入旧版 JSON 快照，并在进程退出时关闭）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore(_store_path)
+            _store.import_legacy_snapshot(LEGACY_SNAPSHOT_FILE)
+            atexit.register(_store.close)
+        return _store
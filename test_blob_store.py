@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+测试元数据预算：超出字段预算或总上限的字段只保留预览，完整值存入 blob 存储并可按需还原
+"""
+
+import os
+import tempfile
+
+import blob_store
+import main
+from config import METADATA_BUDGET_CONFIG
+from data_processor import BLOB_FIELDS_KEY, govern_metadata, metadata_size
+from fake_services import FakePinecone
+from pinecone_manager import fetch_token_metadata, upsert_data_to_pinecone
+from sharding import shard_of
+
+
+def _metadata(description_len=3000, contracts=5):
+    return {
+        "cmc_id": 1,
+        "name": "比特币",
+        "description": "简介\"引号\"" * (description_len // 8),
+        "all_contracts": [f"0x{i:040x}" for i in range(contracts)],
+        "tags": "pow, store-of-value",
+        "fdv": 1.5e12,
+    }
+
+
+def test_field_budgets():
+    """测试超出预算的字段被截断到预算以内，未超出的字段保持不变"""
+    print("🧪 测试字段预算...")
+    metadata = _metadata(contracts=60)
+    governed, offloaded = govern_metadata(metadata)
+    budgets = METADATA_BUDGET_CONFIG["field_budgets"]
+    assert governed[BLOB_FIELDS_KEY] == ["all_contracts", "description"]
+    assert offloaded == {"description": metadata["description"], "all_contracts": metadata["all_contracts"]}
+    assert metadata_size(governed["description"]) <= budgets["description"]
+    assert governed["description"].endswith("…")
+    assert metadata_size(governed["all_contracts"]) <= budgets["all_contracts"]
+    assert governed["all_contracts"] == metadata["all_contracts"][:len(governed["all_contracts"])]
+    assert governed["tags"] == metadata["tags"] and governed["fdv"] == metadata["fdv"]
+    assert BLOB_FIELDS_KEY not in metadata  # 原元数据不被修改
+
+    governed, offloaded = govern_metadata(_metadata(description_len=100, contracts=2))
+    assert governed[BLOB_FIELDS_KEY] == [] and offloaded == {}
+    print("✅ 字段预算测试通过")
+
+
+def test_total_limit():
+    """测试总量超过上限时，从最大的字段开始移出，直到满足上限"""
+    print("🧪 测试总上限...")
+    original = dict(METADATA_BUDGET_CONFIG)
+    METADATA_BUDGET_CONFIG.update(max_bytes=2000, field_budgets={})
+    try:
+        metadata = _metadata(description_len=1500)
+        metadata["website"] = "https://example.com/" + "a" * 1200
+        governed, offloaded = govern_metadata(metadata)
+    finally:
+        METADATA_BUDGET_CONFIG.clear()
+        METADATA_BUDGET_CONFIG.update(original)
+    assert metadata_size(governed) <= 2000
+    assert set(offloaded) == {"description", "website"}
+    assert governed[BLOB_FIELDS_KEY] == ["description", "website"]
+    print("✅ 总上限测试通过")
+
+
+def test_pipeline_offloads_and_expands():
+    """测试写入前裁剪元数据并存入 blob 存储，按需还原；字段回到预算内时删除旧 blob"""
+    print("🧪 测试 blob 存储...")
+    original_path = blob_store._store_path
+    original_store = blob_store._store
+    with tempfile.TemporaryDirectory() as tmp:
+        blob_store._store = None
+        blob_store.set_blob_store_path(os.path.join(tmp, "blobs.db"))
+        try:
+            metadata = _metadata()
+            items = [{"id": "cmc-1", "values": [0.1], "metadata": metadata},
+                     {"id": "cmc-2", "metadata": _metadata(description_len=100)}]
+            main._apply_metadata_budget(items)
+            store = blob_store.get_blob_store()
+            assert items[0]["metadata"][BLOB_FIELDS_KEY] == ["description"]
+            assert len(items[0]["metadata"]["description"]) < len(metadata["description"])
+            assert blob_store.expand_metadata("cmc-1", items[0]["metadata"]) == {**metadata, BLOB_FIELDS_KEY: ["description"]}
+            assert blob_store.expand_metadata("cmc-2", items[1]["metadata"]) is items[1]["metadata"]
+            assert store.records == 2 and store.offloaded_fields["description"] == 1
+            assert store.original_bytes - store.stored_bytes > 2000
+            store.report()
+            assert store.records == 0 and not store.offloaded_fields  # 报告后清零，下次同步单独统计
+
+            # 描述缩短后不再超出预算，旧 blob 被删除
+            main._apply_metadata_budget([{"id": "cmc-1", "metadata": _metadata(description_len=100)}])
+            assert store.get("cmc-1") == {}
+            main._apply_metadata_budget([{"id": "cmc-3", "metadata": _metadata()}])
+            store.delete_many(["cmc-3"])
+            assert store.get("cmc-3") == {}
+            store.close()
+        finally:
+            blob_store._store = original_store
+            blob_store._store_path = original_path
+    print("✅ blob 存储测试通过")
+
+
+def test_shard_merge_and_read_path():
+    """测试分片 blob 存储合并到主存储（只取所属代币、较新的优先、可重复合并），并通过索引读取还原完整元数据"""
+    print("🧪 测试 blob 存储分片合并与读取...")
+    original_store = blob_store._store
+    with tempfile.TemporaryDirectory() as tmp:
+        main_store = blob_store.BlobStore(os.path.join(tmp, "blobs.db"), 6)
+        main_store.put_many({"cmc-1": {"description": "旧简介"}})
+        for index in range(2):
+            shard = blob_store.BlobStore(os.path.join(tmp, f"blobs-{index}.db"), 6)
+            # 每个分片都写入了全部代币，合并时只采用所属分片的行
+            shard.put_many({f"cmc-{u}": {"description": f"分片 {index} 的简介 {u}"} for u in range(1, 9)})
+            shard.close()
+        for _ in range(2):
+            for index in range(2):
+                main_store.merge_shard(os.path.join(tmp, f"blobs-{index}.db"), lambda u, i=index: shard_of(u, 2) == i)
+        for u in range(1, 9):
+            assert main_store.get(f"cmc-{u}") == {"description": f"分片 {shard_of(u, 2)} 的简介 {u}"}
+
+        # 读取路径：查询索引得到预览，按 blob_fields 从主存储还原完整值
+        blob_store._store = main_store
+        try:
+            metadata = _metadata()
+            items = [{"id": "cmc-1", "values": [0.1], "metadata": metadata}]
+            main._apply_metadata_budget(items)
+            index = FakePinecone().Index("coindata")
+            upsert_data_to_pinecone(index, items, report_stats=False)
+            assert index.fetch(ids=["cmc-1"]).vectors["cmc-1"].metadata["description"] != metadata["description"]
+            found = fetch_token_metadata(index, [1, 2])
+            assert list(found) == [1] and found[1]["description"] == metadata["description"]
+        finally:
+            blob_store._store = original_store
+            main_store.close()
+    print("✅ blob 存储分片合并与读取测试通过")
+
+
+if __name__ == "__main__":
+    print("🚀 开始元数据预算测试")
+    print("=" * 50)
+    test_field_budgets()
+    test_total_limit()
+    test_pipeline_offloads_and_expands()
+    test_shard_merge_and_read_path()
+    print("=" * 50)
+    print("🎉 所有测试通过！")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+测试 CMC credits 规划：按计费单位与 URL 长度确定批次大小、估算消耗并检查每日预算
+"""
+
+import os
+import tempfile
+
+import credit_planner
+from config import CMC_PLAN_CONFIG
+from state_store import StateStore
+
+
+def test_batch_size_and_credits():
+    """测试批次大小取计费单位的整数倍且受 URL 长度限制，credits 按每 100 个 ID 向上取整"""
+    print("🧪 测试批次大小与 credits 估算...")
+    for endpoint_key in ("info", "quotes"):
+        size = credit_planner.batch_size_for(endpoint_key)
+        assert size % CMC_PLAN_CONFIG["ids_per_credit"] == 0
+        assert size * (CMC_PLAN_CONFIG["max_id_digits"] + 3) < CMC_PLAN_CONFIG["max_url_length"]
+    assert credit_planner.request_credits("info", 1) == 1
+    assert credit_planner.request_credits("info", 101) == 2
+    assert credit_planner.request_credits("map", 5000) == 1
+
+    calls, credits = credit_planner.plan_calls("info", 1000, chunk_size=192)
+    assert calls == 6 and credits == 11  # 5 个 192 的块各 2 credits，剩余 40 个 1 credit
+    assert credit_planner.plan_calls("info", 0) == (0, 0)  # 全部命中详情缓存时无需请求
+    plan = credit_planner.estimate_run({"info": 1000, "quotes": 1000})
+    assert plan["credits"] == 2 * credit_planner.plan_calls("quotes", 1000)[1]
+
+    # 流水线块是两个端点批次大小的整数倍，分块后的请求数与不分块相同
+    chunk_size = credit_planner.pipeline_chunk_size()
+    for endpoint_key in ("info", "quotes"):
+        assert chunk_size % credit_planner.batch_size_for(endpoint_key) == 0
+        assert credit_planner.plan_calls(endpoint_key, 5000, chunk_size) == credit_planner.plan_calls(endpoint_key, 5000)
+    print("✅ 批次大小与 credits 估算测试通过")
+
+
+def test_budget_stops_run():
+    """测试当天已消耗加本次预计超出预算时返回 False，消耗按日期累加写入状态库"""
+    print("🧪 测试每日 credits 预算...")
+    original_budget = CMC_PLAN_CONFIG["daily_credit_budget"]
+    CMC_PLAN_CONFIG["daily_credit_budget"] = 30
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StateStore(os.path.join(tmp, "state.db"))
+        credit_planner._flushed = credit_planner._used  # 忽略同一进程中其他测试产生的消耗
+        try:
+            assert credit_planner.confirm_credit_budget(store, {"info": 1000, "quotes": 1000})
+            # 发现阶段的 map credits 已计入当天用量，列入计划但不重复计入预算检查
+            credit_planner.record_credits(5)
+            assert credit_planner.confirm_credit_budget(store, {"info": 1000, "quotes": 1000}, discovery_calls=5)
+            credit_planner.record_credits(10)
+            credit_planner.flush_credit_usage(store)
+            assert credit_planner.credits_used_today(store) == 15
+            assert int(store.get_meta(credit_planner._today_key())) == 15
+            assert not credit_planner.confirm_credit_budget(store, {"info": 1000, "quotes": 1000})
+        finally:
+            CMC_PLAN_CONFIG["daily_credit_budget"] = original_budget
+            store.close()
+    print("✅ 每日 credits 预算测试通过")
+
+
+if __name__ == "__main__":
+    test_batch_size_and_credits()
+    test_budget_stops_run()
+    print("\n🎉 credits 规划测试全部通过！")
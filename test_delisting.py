@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+测试下架同步：宽限期内不删除，确认下架后批量删除向量并更新状态库
+"""
+
+import os
+import tempfile
+
+import daily_update
+from config import DELISTING_CONFIG
+from fake_services import FakePinecone
+from pinecone_manager import NamespacedIndex
+from state_store import META_REINDEX_NAMESPACE, StateStore
+
+
+def _run_delisting(store, index, client=object()):
+    originals = (daily_update.init_pinecone_client, daily_update.get_or_create_index, daily_update.get_blob_store)
+    daily_update.init_pinecone_client = lambda: client
+    # 与真实实现一样，客户端为 None 时连接索引会报错
+    daily_update.get_or_create_index = lambda pc, namespace=None: (
+        pc.Index("coindata") if pc is None else NamespacedIndex(index, namespace) if namespace else index
+    )
+    daily_update.get_blob_store = lambda: None
+    try:
+        daily_update.sync_delistings(store)
+    finally:
+        daily_update.init_pinecone_client, daily_update.get_or_create_index, daily_update.get_blob_store = originals
+
+
+def test_delisting_respects_grace_period():
+    """测试连续多次全量对账缺失后才删除，且删除后重新上架会按新代币处理"""
+    print("🧪 测试下架代币批量删除...")
+    original_batch_size = DELISTING_CONFIG["delete_batch_size"]
+    DELISTING_CONFIG["delete_batch_size"] = 2
+    index = FakePinecone().Index("coindata")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = StateStore(os.path.join(tmp, "state.db"))
+            ucids = list(range(1, 21))
+            store.mark_seen(ucids)
+            store.record_upserted({str(u): {"text": f"t{u}", "meta": f"m{u}"} for u in ucids})
+            index.upsert(vectors=[{"id": f"cmc-{u}", "values": [0.1], "metadata": {}} for u in ucids])
+
+            # 第一次缺失：仍在宽限期内
+            store.mark_seen(ucids[3:])
+            _run_delisting(store, index)
+            assert store.missing_ucids() == {1, 2, 3}
+            assert index.describe_index_stats()["total_vector_count"] == 20
+
+            # 代币 3 重新出现，1、2 连续缺失后被删除
+            store.mark_seen(ucids[2:])
+            _run_delisting(store, index)
+            assert index.describe_index_stats()["total_vector_count"] == 18
+            assert store.missing_ucids() == set()
+            assert "1" not in store.fingerprints() and "3" in store.fingerprints()
+
+            store.mark_seen(ucids)
+            assert store.active_ucids() == set(ucids)
+            store.close()
+    finally:
+        DELISTING_CONFIG["delete_batch_size"] = original_batch_size
+    print("✅ 下架代币批量删除测试通过")
+
+
+def test_delisting_skips_suspicious_mass_delete():
+    """测试待删除数量异常偏大时放弃删除"""
+    print("🧪 测试异常批量下架保护...")
+    index = FakePinecone().Index("coindata")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StateStore(os.path.join(tmp, "state.db"))
+        ucids = list(range(1, 11))
+        store.mark_seen(ucids)
+        index.upsert(vectors=[{"id": f"cmc-{u}", "values": [0.1], "metadata": {}} for u in ucids])
+        for _ in range(DELISTING_CONFIG["grace_reconciles"]):
+            store.mark_seen(ucids[:5])
+        _run_delisting(store, index)
+        assert index.describe_index_stats()["total_vector_count"] == 10
+        assert store.missing_ucids() == {6, 7, 8, 9, 10}
+        store.close()
+    print("✅ 异常批量下架保护测试通过")
+
+
+def test_delisting_during_reindex():
+    """测试有未完成的蓝绿重建时同时从新一代删除，切换后已删除代币不会恢复指纹"""
+    print("🧪 测试蓝绿重建期间的下架删除...")
+    index = FakePinecone().Index("coindata")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StateStore(os.path.join(tmp, "state.db"))
+        ucids = list(range(1, 11))
+        store.mark_seen(ucids)
+        vectors = [{"id": f"cmc-{u}", "values": [0.1], "metadata": {}} for u in ucids]
+        index.upsert(vectors=vectors)
+        index.upsert(vectors=vectors, namespace="gen-a")
+        store.record_upserted({str(u): {"text": f"t{u}", "meta": f"m{u}"} for u in ucids}, "gen-a")
+        store.set_meta(META_REINDEX_NAMESPACE, "gen-a")
+        for _ in range(DELISTING_CONFIG["grace_reconciles"]):
+            store.mark_seen(ucids[1:])
+        _run_delisting(store, index)
+        assert index.describe_index_stats()["total_vector_count"] == 18
+        assert index.describe_index_stats()["namespaces"]["gen-a"]["vector_count"] == 9
+        assert "cmc-1" not in index.fetch(ids=["cmc-1"], namespace="gen-a").vectors
+        store.promote_generation("gen-a")
+        assert "1" not in store.fingerprints() and "2" in store.fingerprints()
+        store.close()
+    print("✅ 蓝绿重建期间的下架删除测试通过")
+
+
+def test_delisting_without_pinecone_client():
+    """测试 Pinecone 客户端初始化失败时跳过删除，待删除代币保留到下次运行"""
+    print("🧪 测试客户端初始化失败时跳过下架删除...")
+    index = FakePinecone().Index("coindata")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StateStore(os.path.join(tmp, "state.db"))
+        ucids = list(range(1, 11))
+        store.mark_seen(ucids)
+        index.upsert(vectors=[{"id": f"cmc-{u}", "values": [0.1], "metadata": {}} for u in ucids])
+        for _ in range(DELISTING_CONFIG["grace_reconciles"]):
+            store.mark_seen(ucids[1:])
+        _run_delisting(store, index, client=None)
+        assert index.describe_index_stats()["total_vector_count"] == 10
+        assert store.missing_ucids() == {1}
+        store.close()
+    print("✅ 客户端初始化失败时跳过下架删除测试通过")
+
+
+if __name__ == "__main__":
+    test_delisting_respects_grace_period()
+    test_delisting_skips_suspicious_mass_delete()
+    test_delisting_during_reindex()
+    test_delisting_without_pinecone_client()
+    print("\n🎉 下架同步测试全部通过！")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+测试本地向量缓存：命中、去重与淘汰
+"""
+
+import os
+import tempfile
+import time
+
+import embedding_cache
+import main
+from embedding_cache import EmbeddingCache
+
+
+def test_cache_roundtrip_and_eviction():
+    """测试写入、读取与按容量淘汰"""
+    print("🧪 测试向量缓存读写与淘汰...")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = EmbeddingCache(os.path.join(tmp, "cache.db"), max_entries=2, max_age_days=1)
+        cache.put_many("m", "passage", {"a": [0.5, 1.0], "b": [0.25, 2.0]})
+        assert cache.get_many("m", "passage", ["a", "c"]) == {"a": [0.5, 1.0]}
+        # 不同 input_type 不应命中
+        assert cache.get_many("m", "query", ["a"]) == {}
+        print("✅ 缓存读写测试通过")
+
+        time.sleep(0.01)
+        cache.get_many("m", "passage", ["a"])
+        cache.put_many("m", "passage", {"c": [3.0]})
+        assert cache.evict() == 1
+        assert set(cache.get_many("m", "passage", ["a", "b", "c"])) == {"a", "c"}
+        cache.close()
+        print("✅ 缓存淘汰测试通过")
+
+
+def test_embed_only_misses():
+    """测试重复文本去重，且只有未命中的文本会调用向量化接口"""
+    print("🧪 测试向量化仅处理缓存未命中...")
+    calls = []
+
+    class _FakeInference:
+        def embed(self, model, inputs, parameters):
+            calls.append(list(inputs))
+            return type("R", (), {"data": [type("E", (), {"values": [float(len(t))]})() for t in inputs]})()
+
+    pc_client = type("PC", (), {"inference": _FakeInference()})()
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = EmbeddingCache(os.path.join(tmp, "cache.db"), max_entries=100, max_age_days=1)
+        original = embedding_cache._cache
+        embedding_cache._cache = cache
+        try:
+            first = main.embed_texts_with_pinecone(pc_client, ["aa", "bbb", "aa"])
+            second = main.embed_texts_with_pinecone(pc_client, ["bbb", "cccc"])
+        finally:
+            embedding_cache._cache = original
+            cache.close()
+
+    assert first == [[2.0], [3.0], [2.0]]
+    assert second == [[3.0], [4.0]]
+    assert calls == [["aa", "bbb"], ["cccc"]]
+    print("✅ 向量化缓存命中测试通过")
+
+
+if __name__ == "__main__":
+    test_cache_roundtrip_and_eviction()
+    test_embed_only_misses()
+    print("\n🎉 向量缓存测试全部通过！")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+测试向量化调度：Token 估算、批次打包、滑动窗口配额与 Retry-After 解析
+"""
+
+import time
+
+from config import EMBEDDING_CONFIG
+from embedding_scheduler import estimate_tokens, plan_embedding_batches, retry_after_from_error
+from rate_limiter import SlidingWindowBudget, parse_retry_after
+
+
+def test_plan_batches_respects_limits():
+    """测试批次同时受输入条数与 Token 配额限制"""
+    print("🧪 测试向量化批次打包...")
+    assert estimate_tokens("代币" * 10) > estimate_tokens("ab" * 10)
+
+    original = dict(EMBEDDING_CONFIG)
+    EMBEDDING_CONFIG.update(max_batch_inputs=4, tokens_per_minute=100)
+    try:
+        texts = ["x" * 70] * 10  # 每条约 21 tokens
+        batches = plan_embedding_batches(texts)
+    finally:
+        EMBEDDING_CONFIG.update(original)
+    assert batches[0][:2] == (0, 4)
+    assert all(end - start <= 4 and tokens <= 100 for start, end, tokens in batches)
+    assert batches[-1][1] == 10
+    print("✅ 向量化批次打包测试通过")
+
+
+def test_sliding_window_budget():
+    """测试配额耗尽后等待最早的消耗移出窗口"""
+    print("🧪 测试滑动窗口配额...")
+    budget = SlidingWindowBudget(limit=100, window_seconds=0.2)
+    assert budget.acquire(60) == 0
+    assert budget.acquire(40) == 0
+    start = time.monotonic()
+    budget.acquire(50)
+    assert 0.15 <= time.monotonic() - start < 0.5
+    budget.consume(30)
+    assert budget.used() == 80
+    print("✅ 滑动窗口配额测试通过")
+
+
+def test_retry_after():
+    """测试 Retry-After 的解析"""
+    print("🧪 测试 Retry-After 解析...")
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+
+    error = Exception("(429) Too Many Requests")
+    error.headers = {"Retry-After": "3"}
+    assert retry_after_from_error(error) == 3.0
+    assert retry_after_from_error(Exception("429")) is None
+    print("✅ Retry-After 解析测试通过")
+
+
+if __name__ == "__main__":
+    test_plan_batches_respects_limits()
+    test_sliding_window_budget()
+    test_retry_after()
+    print("\n🎉 向量化调度测试全部通过！")
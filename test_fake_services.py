@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+测试 CMC 拉取函数在本地假 CMC 服务上的端到端行为
+"""
+
+import os
+import tempfile
+
+import cmc_fetcher
+import info_cache
+from config import CMC_CONFIG, INFO_CACHE_CONFIG
+from fake_services import FakeCMCDataset, FakeCMCServer, FakePinecone
+from rate_limiter import TokenBucket
+
+
+def _with_fake_cmc(dataset, test, info_cache_enabled=False):
+    original_url, original_limiter = CMC_CONFIG["base_url"], cmc_fetcher._cmc_limiter
+    original_cache_enabled = INFO_CACHE_CONFIG["enabled"]
+    with FakeCMCServer(dataset) as server:
+        CMC_CONFIG["base_url"] = server.url
+        cmc_fetcher._cmc_limiter = TokenBucket(60000, 100)
+        INFO_CACHE_CONFIG["enabled"] = info_cache_enabled
+        try:
+            return test(server)
+        finally:
+            CMC_CONFIG["base_url"], cmc_fetcher._cmc_limiter = original_url, original_limiter
+            INFO_CACHE_CONFIG["enabled"] = original_cache_enabled
+
+
+def test_fetch_against_fake_cmc():
+    """测试 UCID 列表、详情与行情都能从假服务完整拉取"""
+    print("🧪 测试假 CMC 服务端到端拉取...")
+
+    def run(server):
+        ucids = cmc_fetcher.fetch_ucids()
+        details, market = cmc_fetcher.fetch_details_and_market_data(ucids)
+        return ucids, details, market, dict(server.request_counts)
+
+    ucids, details, market, counts = _with_fake_cmc(FakeCMCDataset(120), run)
+    assert ucids == list(range(1, 121))
+    assert len(details) == 120 and len(market) == 120
+    assert counts["/v2/cryptocurrency/info"] == 1  # 120 个 ID 在单次请求上限内
+    print("✅ 假 CMC 服务端到端拉取测试通过")
+
+
+def test_invalid_ucids_are_dead_lettered():
+    """测试批次中的无效 UCID 被单独剔除，其余代币照常拉取"""
+    print("🧪 测试无效 UCID 死信处理...")
+    dataset = FakeCMCDataset(60)
+    removed = dataset.mutate(remove=2)["removed"]
+
+    def run(server):
+        dead_letters = {}
+        details, market = cmc_fetcher.fetch_details_and_market_data(list(range(1, 61)), dead_letters)
+        return details, market, dead_letters
+
+    details, market, dead_letters = _with_fake_cmc(dataset, run)
+    assert set(dead_letters) == set(removed)
+    assert len(details) == 58 and len(market) == 58
+    assert not any(str(u) in details for u in removed)
+    print("✅ 无效 UCID 死信处理测试通过")
+
+
+def test_auth_error_aborts_without_dead_letters():
+    """测试 401 等鉴权错误不拆分批次、不记入死信，而是中止本次拉取"""
+    print("🧪 测试鉴权错误中止拉取...")
+
+    def run(server):
+        server.reject_status = 401
+        dead_letters = {}
+        try:
+            cmc_fetcher.fetch_details_and_market_data(list(range(1, 401)), dead_letters)
+        except cmc_fetcher.CMCAuthError:
+            return dead_letters, dict(server.request_counts)
+        raise AssertionError("鉴权错误应中止拉取")
+
+    dead_letters, counts = _with_fake_cmc(FakeCMCDataset(400), run)
+    assert dead_letters == {}
+    # 每个批次最多请求一次：不重试也不对半拆分
+    assert sum(counts.values()) <= 2 * ((400 + cmc_fetcher.batch_size_for("info") - 1) // cmc_fetcher.batch_size_for("info"))
+    print("✅ 鉴权错误中止拉取测试通过")
+
+
+def test_request_level_400_is_not_bisected():
+    """测试未列出无效 ID 的 400（如参数错误）整批失败：不拆分批次，也不把健康代币记入死信"""
+    print("🧪 测试与 ID 无关的 400 错误...")
+
+    def run(server):
+        server.reject_status = 400
+        dead_letters = {}
+        details, market = cmc_fetcher.fetch_details_and_market_data(list(range(1, 401)), dead_letters)
+        return details, market, dead_letters, dict(server.request_counts)
+
+    details, market, dead_letters, counts = _with_fake_cmc(FakeCMCDataset(400), run)
+    assert details == {} and market == {} and dead_letters == {}
+    # info 与 quotes 各一个批次，每批只请求一次
+    assert sum(counts.values()) == 2
+    print("✅ 与 ID 无关的 400 错误测试通过")
+
+
+def test_bisection_leaves_with_parent_error_not_dead_lettered():
+    """测试列出的无效 ID 不在批次中时拆分定位，单个 ID 仍报与上层相同的错误则不记入死信"""
+    print("🧪 测试拆分到底仍为同一错误...")
+    original = cmc_fetcher._request_batch
+
+    def reject(endpoint_key, batch_ucids, params_extra=None):
+        raise cmc_fetcher._BatchError('API 错误: Invalid values for "id": "999999"', True, [999999])
+
+    cmc_fetcher._request_batch = reject
+    try:
+        dead_letters = {}
+        assert cmc_fetcher._fetch_batch("info", [1, 2, 3, 4], "1/1", dead_letters=dead_letters) == {}
+    finally:
+        cmc_fetcher._request_batch = original
+    assert dead_letters == {}
+    print("✅ 拆分到底仍为同一错误测试通过")
+
+
+def test_incremental_ucid_discovery():
+    """测试增量发现只用一次请求拿到新代币，下架导致起点越界时前移重试"""
+    print("🧪 测试增量 UCID 发现...")
+    dataset = FakeCMCDataset(1200)
+    mutation = dataset.mutate(add=3, remove=10)
+
+    def run(server):
+        new_ucids = cmc_fetcher.fetch_new_ucids(1200, 1200)
+        requests_used = server.request_counts["/v1/cryptocurrency/map"]
+        # 已知数量远大于当前列表长度时，第一页为空，需要前移起点
+        shifted = cmc_fetcher.fetch_new_ucids(6000, 1200)
+        return new_ucids, requests_used, shifted
+
+    new_ucids, requests_used, shifted = _with_fake_cmc(dataset, run)
+    assert new_ucids == mutation["added"]
+    assert requests_used == 1
+    assert shifted == mutation["added"]
+    print("✅ 增量 UCID 发现测试通过")
+
+
+def test_info_cache_skips_fresh_ucids():
+    """测试详情缓存命中的 UCID 不再请求 /info，只请求新增的 UCID"""
+    print("🧪 测试详情缓存...")
+
+    def run(server):
+        cmc_fetcher.fetch_details_and_market_data(list(range(1, 101)))
+        first = server.request_counts["/v2/cryptocurrency/info"]
+        details, market = cmc_fetcher.fetch_details_and_market_data(list(range(1, 121)))
+        return details, market, first, server.request_counts["/v2/cryptocurrency/info"] - first
+
+    with tempfile.TemporaryDirectory() as tmp:
+        original_cache = info_cache._cache
+        info_cache._cache = info_cache.InfoCache(os.path.join(tmp, "info.db"), ttl_hours=1)
+        try:
+            details, market, first, second = _with_fake_cmc(FakeCMCDataset(120), run, info_cache_enabled=True)
+            assert first == 1 and second == 1
+            assert len(details) == 120 and len(market) == 120
+            assert info_cache._cache.hits == 100 and info_cache._cache.credits_saved == 1
+        finally:
+            info_cache._cache.close()
+            info_cache._cache = original_cache
+    print("✅ 详情缓存测试通过")
+
+
+def test_fake_pinecone_roundtrip():
+    """测试假 Pinecone 的向量化与索引操作"""
+    print("🧪 测试假 Pinecone...")
+    pc = FakePinecone(dimension=4)
+    embedded = pc.inference.embed(model="m", inputs=["a", "b"], parameters={})
+    assert [len(item.values) for item in embedded.data] == [4, 4]
+    index = pc.Index("coindata")
+    index.upsert(vectors=[{"id": "cmc-1", "values": embedded.data[0].values, "metadata": {"name": "A"}}])
+    index.update(id="cmc-1", set_metadata={"fdv": 1.0})
+    assert index.fetch(ids=["cmc-1"]).vectors["cmc-1"].metadata == {"name": "A", "fdv": 1.0}
+    assert index.describe_index_stats()["total_vector_count"] == 1
+    print("✅ 假 Pinecone 测试通过")
+
+
+if __name__ == "__main__":
+    test_fetch_against_fake_cmc()
+    test_invalid_ucids_are_dead_lettered()
+    test_auth_error_aborts_without_dead_letters()
+    test_request_level_400_is_not_bisected()
+    test_bisection_leaves_with_parent_error_not_dead_lettered()
+    test_incremental_ucid_discovery()
+    test_info_cache_skips_fresh_ucids()
+    test_fake_pinecone_roundtrip()
+    print("\n🎉 假服务测试全部通过！")
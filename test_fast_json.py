@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+测试 JSON 编解码：orjson 与标准库后端结果一致，以及 map 响应的流式解析
+"""
+
+import json
+
+import cmc_fetcher
+import fast_json
+from config import CMC_CONFIG, JSON_CONFIG
+from fake_services import FakeCMCDataset, FakeCMCServer
+from rate_limiter import TokenBucket
+
+SAMPLES = [
+    {"name": "比特币", "supply": 21000000, "price": 0.1 + 0.2, "tags": ["pow", None, True]},
+    {"total_supply": 420690000000000000000000000, "id": 1},  # 超出 64 位的整数
+    [1, 2.5, "é\U0001f600"],
+]
+
+
+def _with_backend(backend, func):
+    original = JSON_CONFIG["backend"]
+    JSON_CONFIG["backend"] = backend
+    try:
+        return func()
+    finally:
+        JSON_CONFIG["backend"] = original
+
+
+def test_backends_agree():
+    """测试两种后端的解析与序列化结果相同，大整数不会变成浮点数"""
+    print("🧪 测试后端一致性...")
+    for sample in SAMPLES:
+        text = json.dumps(sample, ensure_ascii=False)
+        for backend in ("auto", "stdlib"):
+            decoded = _with_backend(backend, lambda: fast_json.loads(text.encode("utf-8")))
+            assert decoded == sample and json.dumps(decoded) == json.dumps(sample)
+            assert fast_json.loads(_with_backend(backend, lambda: fast_json.dumps(sample))) == sample
+    assert fast_json.loads(b'{"n": 123456789012345678901234567890}')["n"] == 123456789012345678901234567890
+    assert fast_json.dumps({1: "a"}) == '{"1":"a"}'
+    # 标准库接受的 Infinity / NaN 写法在 orjson 后端下同样能解析
+    assert fast_json.loads(b'{"v": Infinity}')["v"] == float("inf")
+
+    for bad in (b'{"a": ', b'\xff\xfe{"a": 1}', "[1,]"):
+        for backend in ("auto", "stdlib"):
+            try:
+                _with_backend(backend, lambda: fast_json.loads(bad))
+            except fast_json.JSONDecodeError:
+                continue
+            raise AssertionError(f"{bad!r} 应解析失败")
+    print("✅ 后端一致性测试通过")
+
+
+def _chunks(data: bytes, size: int):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def test_iter_array():
+    """测试任意分块（包括截断多字节字符与数字）都能得到与一次性解析相同的结果"""
+    print("🧪 测试流式解析...")
+    body = {
+        "status": {"error_code": 0, "credit_count": 1, "note": "状态 ✓"},
+        "data": [{"id": i, "name": f"代币-{i}", "rank": i * 1234567, "x": [1.5, None]} for i in range(200)],
+        "extra": 98765432109876,
+    }
+    payload = json.dumps(body, ensure_ascii=False, indent=1).encode("utf-8")
+    for size in (1, 3, 7, 64, len(payload)):
+        rest = {}
+        items = list(fast_json.iter_array(_chunks(payload, size), "data", rest))
+        assert items == body["data"]
+        assert rest == {"status": body["status"], "extra": body["extra"]}
+
+    rest = {}
+    assert list(fast_json.iter_array([b'{"data": null, "status": {}}'], "data", rest)) == []
+    assert rest == {"data": None, "status": {}}
+    assert list(fast_json.iter_array([b' {"data": [] } '], "data")) == []
+
+    for bad in (b'{"data": [1, 2', b'[1, 2]', b'{"data": [1]} x', b'{"data": [1 2]}'):
+        try:
+            list(fast_json.iter_array(_chunks(bad, 2), "data"))
+        except fast_json.JSONDecodeError:
+            continue
+        raise AssertionError(f"{bad!r} 应解析失败")
+    print("✅ 流式解析测试通过")
+
+
+def test_map_pages_streamed():
+    """测试 map 分页通过流式解析拿到全部 UCID"""
+    print("🧪 测试 map 分页流式解析...")
+    original_url, original_limiter = CMC_CONFIG["base_url"], cmc_fetcher._cmc_limiter
+    original_chunk = JSON_CONFIG["stream_chunk_size"]
+    with FakeCMCServer(FakeCMCDataset(7000)) as server:
+        CMC_CONFIG["base_url"] = server.url
+        cmc_fetcher._cmc_limiter = TokenBucket(60000, 100)
+        JSON_CONFIG["stream_chunk_size"] = 1000
+        try:
+            ucids = cmc_fetcher.fetch_ucids()
+        finally:
+            CMC_CONFIG["base_url"], cmc_fetcher._cmc_limiter = original_url, original_limiter
+            JSON_CONFIG["stream_chunk_size"] = original_chunk
+    assert len(ucids) == 7000 and ucids == sorted(ucids)
+    print("✅ map 分页流式解析测试通过")
+
+
+if __name__ == "__main__":
+    print("🚀 开始 JSON 编解码测试")
+    print("=" * 50)
+    test_backends_agree()
+    test_iter_array()
+    test_map_pages_streamed()
+    print("=" * 50)
+    print("🎉 所有测试通过！")
@@ -80,6 +80,30 @@ def test_data_processor():
     assert '无简介' in result[0]['token_info']
     print("✅ 数据处理器测试通过")
 
+def test_token_record_release_raw():
+    """测试处理结果为紧凑记录，兼容下标访问与 dict()，并可在处理时释放原始数据"""
+    print("🧪 测试紧凑记录与原始数据释放...")
+    coin_details = {str(u): {'name': f'Coin{u}', 'symbol': f'C{u}', 'category': 'token', 'tags': ['defi']}
+                    for u in (1, 2)}
+    market_data = {str(u): {'circulating_supply': u * 10} for u in (1, 2)}
+
+    result = process_data([1, 2], coin_details, market_data, release_raw=True)
+    assert not coin_details and not market_data
+    record = result[0]
+    assert record.id == record['id'] == 'cmc-1'
+    assert record['metadata'] == {'cmc_id': 1, 'name': 'Coin1', 'symbol': 'C1', 'contract_address': '未知',
+                                  'circulating_supply': 10, 'category': 'token', 'tags': 'defi'}
+    assert dict(record) == {'id': 'cmc-1', 'token_info': record.token_info, 'metadata': record.metadata}
+    assert not hasattr(record, '__dict__')
+    # 重复出现的字符串在各记录间共享
+    assert result[0].metadata['category'] is result[1].metadata['category']
+    try:
+        record['missing']
+        raise AssertionError("未知字段应抛出 KeyError")
+    except KeyError:
+        pass
+    print("✅ 紧凑记录测试通过")
+
 if __name__ == "__main__":
     print("=" * 50)
     print("🚀 开始测试修复后的代码")
@@ -88,6 +112,7 @@ if __name__ == "__main__":
     try:
         test_extract_functions()
         test_data_processor()
+        test_token_record_release_raw()
         print("\n🎉 所有测试通过！修复成功！")
     except Exception as e:
         print(f"\n❌ 测试失败：{e}")
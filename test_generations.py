@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+测试蓝绿重建：写入新一代、校验、切换读取指针与延迟清理旧一代
+"""
+
+import os
+import tempfile
+import time
+
+import daily_update
+import main
+import pinecone_manager
+from config import GENERATION_CONFIG
+from fake_services import FakePinecone
+from pinecone_manager import (NamespacedIndex, collect_retired_generation, resolve_active_namespace,
+                              switch_generation, upsert_data_to_pinecone, validate_generation)
+from state_store import META_ABANDONED_NAMESPACES, META_REINDEX_NAMESPACE, StateStore
+
+
+def _vectors(ucids):
+    return [{"id": f"cmc-{u}", "values": [0.1, 0.2], "metadata": {"cmc_id": u}} for u in ucids]
+
+
+def _resolve_index(index):
+    """通过 get_or_create_index 解析当前一代，跳过连接索引的控制面调用"""
+    original = pinecone_manager._connect_index
+    pinecone_manager._connect_index = lambda pc: index
+    try:
+        return pinecone_manager.get_or_create_index(object())
+    finally:
+        pinecone_manager._connect_index = original
+
+
+def test_generation_cutover_and_cleanup():
+    """测试新一代校验通过后切换指针，读者随即解析到新一代，旧一代保留期满后才删除"""
+    print("🧪 测试蓝绿重建切换...")
+    index = FakePinecone().Index("coindata")
+    upsert_data_to_pinecone(index, _vectors(range(1, 6)), report_stats=False)
+    assert resolve_active_namespace(index) == ""
+    assert _resolve_index(index) is index
+
+    # 新一代写入期间，读者仍解析到默认命名空间
+    upsert_data_to_pinecone(NamespacedIndex(index, "gen-a"), _vectors(range(1, 5)), report_stats=False)
+    expected = [f"cmc-{u}" for u in range(1, 6)]
+    assert not validate_generation(index, "gen-a", expected)
+    assert resolve_active_namespace(index) == ""
+
+    upsert_data_to_pinecone(NamespacedIndex(index, "gen-a"), _vectors([5]), report_stats=False)
+    assert validate_generation(index, "gen-a", expected)
+    switch_generation(index, "gen-a")
+    resolved = _resolve_index(index)
+    assert isinstance(resolved, NamespacedIndex) and resolved.namespace == "gen-a"
+
+    # 写入操作跟随指针进入新一代
+    upsert_data_to_pinecone(resolved, _vectors([6]), report_stats=False)
+    assert "cmc-6" in index.namespaces["gen-a"] and "cmc-6" not in index.namespaces[""]
+
+    # 保留期内不删除旧一代，期满后删除且只删除一次
+    assert not collect_retired_generation(index)
+    assert "" in index.namespaces
+    later = time.time() + GENERATION_CONFIG["retain_hours"] * 3600 + 1
+    assert collect_retired_generation(index, now=later)
+    assert "" not in index.namespaces
+    assert not collect_retired_generation(index, now=later)
+    assert resolve_active_namespace(index) == "gen-a"
+    print("✅ 蓝绿重建切换测试通过")
+
+
+def test_consecutive_switches_drop_stale_generation():
+    """测试上一代尚未清理时再次切换，会先删除已无人读取的上上代"""
+    print("🧪 测试连续切换...")
+    index = FakePinecone().Index("coindata")
+    for namespace in ("gen-a", "gen-b"):
+        upsert_data_to_pinecone(NamespacedIndex(index, namespace), _vectors([1]), report_stats=False)
+    switch_generation(index, "gen-a")
+    switch_generation(index, "gen-b")
+    assert "gen-a" in index.namespaces  # 作为上一代保留
+
+    upsert_data_to_pinecone(NamespacedIndex(index, "gen-c"), _vectors([1]), report_stats=False)
+    switch_generation(index, "gen-c")
+    assert "gen-a" not in index.namespaces
+    assert "gen-b" in index.namespaces
+    assert resolve_active_namespace(index) == "gen-c"
+    print("✅ 连续切换测试通过")
+
+
+def test_reindex_state_promoted_only_after_cutover():
+    """测试重建写入的指纹与市场字段先暂存，切换失败时不影响当前一代的变更检测，切换成功后整体替换"""
+    print("🧪 测试重建状态的暂存与切换...")
+    index = FakePinecone().Index("coindata")
+    originals = (main.init_pinecone_client, pinecone_manager._connect_index)
+    main.init_pinecone_client = lambda: object()
+    pinecone_manager._connect_index = lambda pc: index
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            state = StateStore(os.path.join(tmp, "state.db"))
+            state.record_upserted({"1": {"text": "t-old", "meta": "m-old"}})
+            state.record_market_values({1: {"fdv": 1.0}})
+
+            # 重建写入新一代，同时每日更新继续写入当前一代
+            new_fingerprints = {str(u): {"text": f"t-new{u}", "meta": f"m-new{u}"} for u in (1, 2)}
+            state.record_upserted(new_fingerprints, "gen-a")
+            state.record_market_values({1: {"fdv": 2.0}, 2: {"fdv": 3.0}}, "gen-a")
+            state.record_upserted({"1": {"text": "t-daily", "meta": "m-daily"}})
+            assert state.fingerprints() == {"1": {"text": "t-daily", "meta": "m-daily"}}
+            assert state.market_values([1, 2]) == {1: {"circulating_supply": None, "total_supply": None,
+                                                        "max_supply": None, "fdv": 1.0}}
+
+            # 新一代不完整，切换失败：当前一代的记录保持不变
+            upsert_data_to_pinecone(NamespacedIndex(index, "gen-a"), _vectors([1]), report_stats=False)
+            assert not main.cutover_generation(state, "gen-a", [1, 2])
+            assert state.fingerprints() == {"1": {"text": "t-daily", "meta": "m-daily"}}
+
+            upsert_data_to_pinecone(NamespacedIndex(index, "gen-a"), _vectors([2]), report_stats=False)
+            assert main.cutover_generation(state, "gen-a", [1, 2])
+            assert state.fingerprints() == new_fingerprints
+            assert state.market_values([1, 2])[1]["fdv"] == 2.0 and state.market_values([1, 2])[2]["fdv"] == 3.0
+            assert all(synced_at for _, synced_at in state.refresh_status().values())
+            assert state.get_meta(META_REINDEX_NAMESPACE) == ""
+
+            # 放弃的重建只清空暂存
+            state.record_upserted({"3": {"text": "t3", "meta": "m3"}}, "gen-b")
+            state.discard_generation("gen-b")
+            assert state._conn.execute("SELECT COUNT(*) FROM generation_fingerprints").fetchone()[0] == 0
+            assert "3" not in state.fingerprints()
+            state.close()
+    finally:
+        main.init_pinecone_client, pinecone_manager._connect_index = originals
+    print("✅ 重建状态的暂存与切换测试通过")
+
+
+def test_abandoned_generation_namespace_deleted():
+    """测试放弃的重建会删除其命名空间的向量；删除失败时保留记录，由每日更新的清理步骤重试"""
+    print("🧪 测试删除放弃的重建命名空间...")
+    index = FakePinecone().Index("coindata")
+    upsert_data_to_pinecone(NamespacedIndex(index, "gen-a"), _vectors([1, 2]), report_stats=False)
+    switch_generation(index, "gen-a")
+    upsert_data_to_pinecone(NamespacedIndex(index, "gen-b"), _vectors([1]), report_stats=False)
+    upsert_data_to_pinecone(NamespacedIndex(index, "gen-c"), _vectors([1]), report_stats=False)
+    originals = (daily_update.init_pinecone_client, daily_update.get_state_store, pinecone_manager._connect_index)
+    with tempfile.TemporaryDirectory() as tmp:
+        state = StateStore(os.path.join(tmp, "state.db"))
+        daily_update.init_pinecone_client = lambda: object()
+        daily_update.get_state_store = lambda: state
+        pinecone_manager._connect_index = lambda pc: index
+        try:
+            state.set_meta(META_REINDEX_NAMESPACE, "gen-b")
+            state.record_upserted({"1": {"text": "t", "meta": "m"}}, "gen-b")
+            main.abandon_generation(state, "gen-b")
+            assert state.get_meta(META_REINDEX_NAMESPACE) == ""
+            assert state._conn.execute("SELECT COUNT(*) FROM generation_fingerprints").fetchone()[0] == 0
+            assert main.drop_abandoned_generations(state, index) == 1
+            assert "gen-b" not in index.namespaces and "gen-a" in index.namespaces
+            assert state.get_meta(META_ABANDONED_NAMESPACES) == ""
+
+            # 删除失败时保留记录；当前一代即使被误记也不删除
+            main.abandon_generation(state, "gen-c")
+            main.abandon_generation(state, "gen-a")
+            original_delete = index.delete
+            index.delete = lambda **kwargs: (_ for _ in ()).throw(RuntimeError("unavailable"))
+            assert main.drop_abandoned_generations(state, index) == 0
+            assert state.get_meta(META_ABANDONED_NAMESPACES) == "gen-c"
+            index.delete = original_delete
+            daily_update.collect_old_generation()
+            assert "gen-c" not in index.namespaces and "gen-a" in index.namespaces
+            assert state.get_meta(META_ABANDONED_NAMESPACES) == ""
+        finally:
+            daily_update.init_pinecone_client, daily_update.get_state_store, pinecone_manager._connect_index = originals
+            state.close()
+    print("✅ 删除放弃的重建命名空间测试通过")
+
+
+def test_generation_steps_without_client():
+    """测试 Pinecone 客户端初始化失败时切换与清理都直接放弃，不抛出异常"""
+    print("🧪 测试客户端初始化失败时的切换与清理...")
+    originals = (main.init_pinecone_client, daily_update.init_pinecone_client)
+    main.init_pinecone_client = daily_update.init_pinecone_client = lambda: None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            state = StateStore(os.path.join(tmp, "state.db"))
+            state.set_meta(META_REINDEX_NAMESPACE, "gen-a")
+            assert not main.cutover_generation(state, "gen-a", [1, 2])
+            assert state.get_meta(META_REINDEX_NAMESPACE) == "gen-a"  # 保留待切换的命名空间，便于 --resume
+            state.close()
+        daily_update.collect_old_generation()
+    finally:
+        main.init_pinecone_client, daily_update.init_pinecone_client = originals
+    print("✅ 客户端初始化失败时的切换与清理测试通过")
+
+
+if __name__ == "__main__":
+    print("🚀 开始蓝绿重建测试")
+    print("=" * 50)
+    test_generation_cutover_and_cleanup()
+    test_consecutive_switches_drop_stale_generation()
+    test_reindex_state_promoted_only_after_cutover()
+    test_abandoned_generation_namespace_deleted()
+    test_generation_steps_without_client()
+    print("=" * 50)
+    print("🎉 所有测试通过！")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+测试 HTTP 连接层：对冲请求、延迟分位统计，以及假 CMC 服务上的连接复用与限流重试
+"""
+
+import threading
+import time
+import types
+
+import cmc_fetcher
+from config import CMC_CONFIG, CMC_PLAN_CONFIG, INFO_CACHE_CONFIG
+from fake_services import FakeCMCDataset, FakeCMCServer
+from http_client import LatencyTracker, hedged_call
+from rate_limiter import TokenBucket
+
+
+def test_hedged_call_returns_faster_attempt():
+    """测试主请求超过阈值时发起对冲请求，并返回先完成的结果"""
+    print("🧪 测试对冲请求...")
+    calls = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            calls.append(len(calls))
+            attempt = calls[-1]
+        if attempt == 0:
+            time.sleep(1.0)
+            return "slow"
+        return "fast"
+
+    start = time.perf_counter()
+    assert hedged_call(call, hedge_after=0.05) == "fast"
+    assert time.perf_counter() - start < 0.5
+    assert len(calls) == 2
+
+    calls.clear()
+    assert hedged_call(call, hedge_after=0.05, allow_hedge=lambda: False) == "slow"
+    assert len(calls) == 1
+    print("✅ 对冲请求测试通过")
+
+
+def test_latency_tracker_percentile():
+    """测试延迟分位数计算"""
+    tracker = LatencyTracker(window=100)
+    assert tracker.percentile(0.95) is None
+    for i in range(1, 101):
+        tracker.record(i / 1000)
+    assert len(tracker) == 100
+    assert tracker.percentile(0.95) == 0.096
+
+
+def test_connection_reuse_and_retry_after():
+    """测试多次请求复用连接，429 按 Retry-After 重试后成功"""
+    print("🧪 测试连接复用与限流重试...")
+    original_url, original_limiter = CMC_CONFIG["base_url"], cmc_fetcher._cmc_limiter
+    with FakeCMCServer(FakeCMCDataset(200, description_len=50), error_rate=0.3, seed=1) as server:
+        CMC_CONFIG["base_url"] = server.url
+        cmc_fetcher._cmc_limiter = TokenBucket(60000, 100)
+        original_cache_enabled, INFO_CACHE_CONFIG["enabled"] = INFO_CACHE_CONFIG["enabled"], False
+        # 缩小单次请求的 ID 数，制造足够多的请求
+        original_max_ids, CMC_PLAN_CONFIG["max_ids_per_call"]["info"] = CMC_PLAN_CONFIG["max_ids_per_call"]["info"], 50
+        try:
+            # 只记录重试等待时间，不真正休眠
+            waits = []
+            cmc_fetcher.time = types.SimpleNamespace(sleep=waits.append, perf_counter=time.perf_counter)
+            try:
+                details = cmc_fetcher.fetch_coin_details(list(range(1, 201)))
+            finally:
+                cmc_fetcher.time = time
+        finally:
+            CMC_CONFIG["base_url"], cmc_fetcher._cmc_limiter = original_url, original_limiter
+            INFO_CACHE_CONFIG["enabled"] = original_cache_enabled
+            CMC_PLAN_CONFIG["max_ids_per_call"]["info"] = original_max_ids
+    assert len(details) == 200
+    assert server.throttled > 0 and all(wait == 1.0 for wait in waits)
+    assert server.connections < sum(server.request_counts.values())
+    print("✅ 连接复用与限流重试测试通过")
+
+
+if __name__ == "__main__":
+    test_hedged_call_returns_faster_attempt()
+    test_latency_tracker_percentile()
+    test_connection_reuse_and_retry_after()
+    print("\n🎉 HTTP 连接层测试全部通过！")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+测试运行指标的记录、Prometheus 文本渲染与导出
+"""
+
+import json
+import os
+import tempfile
+
+import cmc_fetcher
+import metrics
+from config import CMC_CONFIG, INFO_CACHE_CONFIG, METRICS_CONFIG
+from fake_services import FakeCMCDataset, FakeCMCServer
+from rate_limiter import TokenBucket
+
+
+def _series(name, **labels):
+    return [item for item in metrics.snapshot()
+            if item["metric"] == name and all(item["labels"].get(k) == str(v) for k, v in labels.items())]
+
+
+def test_render_and_export():
+    """测试计数器、直方图的渲染格式，以及 JSON Lines 与 textfile 的导出"""
+    print("🧪 测试指标渲染与导出...")
+    metrics.reset_metrics()
+    metrics.inc("retries_total", service="cmc", reason=429)
+    metrics.inc("retries_total", 2, service="cmc", reason=429)
+    metrics.observe("cmc_request_seconds", 0.07, endpoint="info")
+    metrics.observe("cmc_request_seconds", 100, endpoint="info")
+
+    text = metrics.render_prometheus(metrics.snapshot())
+    assert 'coin_sync_retries_total{reason="429",service="cmc"} 3' in text
+    assert "# TYPE coin_sync_cmc_request_seconds histogram" in text
+    assert 'coin_sync_cmc_request_seconds_bucket{endpoint="info",le="0.05"} 0' in text
+    assert 'coin_sync_cmc_request_seconds_bucket{endpoint="info",le="0.1"} 1' in text
+    assert 'coin_sync_cmc_request_seconds_bucket{endpoint="info",le="+Inf"} 2' in text
+    assert 'coin_sync_cmc_request_seconds_count{endpoint="info"} 2' in text
+
+    original = dict(METRICS_CONFIG)
+    with tempfile.TemporaryDirectory() as tmp:
+        METRICS_CONFIG["jsonl_path"] = os.path.join(tmp, "metrics.jsonl")
+        METRICS_CONFIG["textfile_dir"] = tmp
+        try:
+            metrics.export_metrics("daily_update")
+            metrics.export_metrics("daily_update")
+        finally:
+            METRICS_CONFIG.update(original)
+        with open(os.path.join(tmp, "metrics.jsonl"), encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        with open(os.path.join(tmp, "coin_sync_daily_update.prom"), encoding="utf-8") as f:
+            prom = f.read()
+    # 每次导出追加全部序列，textfile 只保留最近一次
+    assert len(records) == 2 * len(metrics.snapshot())
+    assert {r["job"] for r in records} == {"daily_update"}
+    assert prom.count("# TYPE coin_sync_retries_total counter") == 1
+    assert 'coin_sync_retries_total{task="daily_update",reason="429",service="cmc"} 3' in prom
+    assert "coin_sync_run_duration_seconds" in prom
+    print("✅ 指标渲染与导出测试通过")
+
+
+def test_cmc_requests_are_instrumented():
+    """测试 CMC 请求按端点记录耗时、状态码与 credits"""
+    print("🧪 测试 CMC 请求指标...")
+    metrics.reset_metrics()
+    original_url, original_limiter = CMC_CONFIG["base_url"], cmc_fetcher._cmc_limiter
+    original_cache_enabled = INFO_CACHE_CONFIG["enabled"]
+    with FakeCMCServer(FakeCMCDataset(50)) as server:
+        CMC_CONFIG["base_url"] = server.url
+        cmc_fetcher._cmc_limiter = TokenBucket(60000, 100)
+        INFO_CACHE_CONFIG["enabled"] = False
+        try:
+            cmc_fetcher.fetch_details_and_market_data(list(range(1, 51)))
+        finally:
+            CMC_CONFIG["base_url"], cmc_fetcher._cmc_limiter = original_url, original_limiter
+            INFO_CACHE_CONFIG["enabled"] = original_cache_enabled
+
+    assert _series("cmc_requests_total", endpoint="info", status=200)[0]["value"] == 1
+    assert _series("cmc_requests_total", endpoint="quotes", status=200)[0]["value"] == 1
+    assert _series("cmc_request_seconds", endpoint="info")[0]["count"] == 1
+    assert _series("cmc_credits_total")[0]["value"] == 2
+    print("✅ CMC 请求指标测试通过")
+
+
+if __name__ == "__main__":
+    print("🚀 开始运行指标测试")
+    print("=" * 50)
+    test_render_and_export()
+    test_cmc_requests_are_instrumented()
+    print("=" * 50)
+    print("🎉 所有测试通过！")
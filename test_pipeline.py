@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+测试流水线同步流程：各阶段按块衔接，单块失败不影响其他块
+"""
+
+import os
+import tempfile
+
+import main
+from journal import SyncJournal
+from state_store import StateStore
+
+
+class _FakeIndex:
+    def __init__(self):
+        self.vectors = {}
+        self.updated = []
+        self.fetch_calls = []
+
+    def upsert(self, vectors):
+        for v in vectors:
+            self.vectors[v["id"]] = v
+        return {"upserted_count": len(vectors)}
+
+    def update(self, id, set_metadata):
+        self.vectors[id]["metadata"].update(set_metadata)
+        self.updated.append(id)
+
+    def describe_index_stats(self):
+        return {"total_vector_count": len(self.vectors)}
+
+
+def _patch(fake_index, fail_ucid=None, market_overrides=None, detail_overrides=None):
+    """替换外部依赖为本地桩函数，返回恢复函数"""
+    originals = {name: getattr(main, name) for name in (
+        "fetch_details_and_market_data", "init_pinecone_client",
+        "get_or_create_index", "embed_texts_with_pinecone", "get_blob_store", "pipeline_chunk_size")}
+
+    def fake_fetch(ucids, dead_letters=None):
+        fake_index.fetch_calls.append(list(ucids))
+        market = {str(u): {"circulating_supply": u} for u in ucids}
+        market.update(market_overrides or {})
+        if fail_ucid in ucids:
+            return {}, market
+        details = {str(u): {"name": f"Coin{u}", "symbol": f"C{u}"} for u in ucids}
+        details.update(detail_overrides or {})
+        return details, market
+
+    main.fetch_details_and_market_data = fake_fetch
+    main.init_pinecone_client = lambda: object()
+    main.get_or_create_index = lambda pc, namespace=None: fake_index
+    main.embed_texts_with_pinecone = lambda pc, texts: [[0.1, 0.2] for _ in texts]
+    main.get_blob_store = lambda: None
+    main.pipeline_chunk_size = lambda: 3
+
+    def restore():
+        for name, value in originals.items():
+            setattr(main, name, value)
+    return restore
+
+
+def test_pipeline_upserts_all_chunks():
+    """测试所有块都经过流水线写入索引"""
+    print("🧪 测试流水线全量写入...")
+    index = _FakeIndex()
+    restore = _patch(index)
+    try:
+        stats = main.run_sync_process(list(range(1, 11)))
+    finally:
+        restore()
+    assert stats["upserted"] == 10
+    assert sorted(index.vectors) == sorted(f"cmc-{u}" for u in range(1, 11))
+    print("✅ 流水线全量写入测试通过")
+
+
+def test_pipeline_skips_failed_chunk():
+    """测试单块拉取失败时仅跳过该块"""
+    print("🧪 测试流水线失败块跳过...")
+    index = _FakeIndex()
+    restore = _patch(index, fail_ucid=5)
+    try:
+        stats = main.run_sync_process(list(range(1, 11)))
+    finally:
+        restore()
+    assert stats["fetch_failed"] == 3
+    assert stats["upserted"] == 7
+    assert "cmc-5" not in index.vectors
+    print("✅ 流水线失败块跳过测试通过")
+
+
+def test_pipeline_aborts_on_auth_error():
+    """测试拉取阶段遇到鉴权错误时中止整条流水线并向调用方抛出"""
+    print("🧪 测试流水线鉴权错误中止...")
+    index = _FakeIndex()
+    restore = _patch(index)
+
+    def reject(ucids, dead_letters=None):
+        index.fetch_calls.append(list(ucids))
+        raise main.CMCAuthError("CMC 鉴权失败 (HTTP 401)")
+
+    main.fetch_details_and_market_data = reject
+    try:
+        main.run_sync_process(list(range(1, 11)))
+    except main.CMCAuthError:
+        pass
+    else:
+        raise AssertionError("鉴权错误应中止同步")
+    finally:
+        restore()
+    assert index.fetch_calls == [[1, 2, 3]] and not index.vectors
+    print("✅ 流水线鉴权错误中止测试通过")
+
+
+def test_pipeline_change_detection():
+    """测试按指纹分类：未变化跳过、仅元数据变化只更新元数据、文本变化重新上传"""
+    print("🧪 测试流水线变更检测...")
+    index = _FakeIndex()
+    fingerprints = {}
+    restore = _patch(index)
+    try:
+        main.run_sync_process([1, 2, 3, 4], fingerprints)
+    finally:
+        restore()
+    assert len(fingerprints) == 4
+
+    index = _FakeIndex()
+    index.vectors["cmc-3"] = {"id": "cmc-3", "metadata": {}}
+    restore = _patch(
+        index,
+        market_overrides={"2": {"circulating_supply": 999}},
+        detail_overrides={"3": {"name": "Coin3", "symbol": "C3", "logo": "https://logo/3.png"},
+                          "4": {"name": "Coin4", "symbol": "C4", "description": "新的简介"}},
+    )
+    index.vectors["cmc-2"] = {"id": "cmc-2", "metadata": {}}
+    try:
+        stats = main.run_sync_process([1, 2, 3, 4, 5], fingerprints)
+    finally:
+        restore()
+    assert stats["unchanged"] == 1
+    # 2 号只有流通量变化、3 号只有 logo 变化，都只更新元数据
+    assert stats["metadata_updated"] == 2 and sorted(index.updated) == ["cmc-2", "cmc-3"]
+    # 4 号的简介进入了待向量化文本，需要重新上传；5 号为新增
+    assert stats["upserted"] == 2 and {"cmc-4", "cmc-5"} <= set(index.vectors)
+    assert len(fingerprints) == 5
+    print("✅ 流水线变更检测测试通过")
+
+
+def test_pipeline_records_synced_after_commit():
+    """测试只有确认写入或判定未变化的代币记录完成同步时间，向量化失败的代币在分层刷新时仍到期"""
+    print("🧪 测试流水线完成同步时间...")
+    with tempfile.TemporaryDirectory() as tmp:
+        state = StateStore(os.path.join(tmp, "state.db"))
+        fingerprints = {}
+        index = _FakeIndex()
+        restore = _patch(index)
+        main.embed_texts_with_pinecone = lambda pc, texts: [] if any("Coin5" in t for t in texts) else [[0.1] for _ in texts]
+        try:
+            main.run_sync_process(list(range(1, 7)), fingerprints, state=state)
+        finally:
+            restore()
+        status = state.refresh_status()
+        assert [ucid for ucid in range(1, 7) if status[ucid][1] is None] == [4, 5, 6]
+        fetched = state._conn.execute("SELECT COUNT(*) FROM coins WHERE last_fetched_at IS NOT NULL").fetchone()[0]
+        assert fetched == 6
+
+        # 再次同步：1-3 未变化也记录完成同步时间，4-6 向量化成功后补上
+        index = _FakeIndex()
+        restore = _patch(index)
+        try:
+            stats = main.run_sync_process(list(range(1, 7)), fingerprints, state=state)
+        finally:
+            restore()
+        assert stats["unchanged"] == 3 and stats["upserted"] == 3
+        refreshed = state.refresh_status()
+        assert all(refreshed[ucid][1] is not None for ucid in range(1, 7))
+        assert all(refreshed[ucid][1] > status[ucid][1] for ucid in range(1, 4))
+        state.close()
+    print("✅ 流水线完成同步时间测试通过")
+
+
+def test_pipeline_resume_from_journal():
+    """测试中断后依据进度日志只重做未写入的块"""
+    print("🧪 测试流水线断点续传...")
+    ucids = list(range(1, 11))
+    with tempfile.TemporaryDirectory() as tmp:
+        journal_dir = os.path.join(tmp, "journal")
+        index = _FakeIndex()
+        journal = SyncJournal.start(journal_dir, ucids, chunk_size=3)
+        restore = _patch(index, fail_ucid=5)
+        try:
+            main.run_sync_process(ucids, {}, journal)
+        finally:
+            restore()
+        assert len(journal.committed_fingerprints) == 7
+
+        resumed = SyncJournal.load(journal_dir)
+        assert resumed.ucids == ucids and resumed.chunk_size == 3
+        fingerprints = dict(resumed.committed_fingerprints)
+        index = _FakeIndex()
+        restore = _patch(index)
+        try:
+            stats = main.run_sync_process(resumed.ucids, fingerprints, resumed)
+        finally:
+            restore()
+    assert index.fetch_calls == [[4, 5, 6]]
+    assert stats["resumed"] == 7 and stats["upserted"] == 3
+    assert len(fingerprints) == 10
+    print("✅ 流水线断点续传测试通过")
+
+
+if __name__ == "__main__":
+    test_pipeline_upserts_all_chunks()
+    test_pipeline_skips_failed_chunk()
+    test_pipeline_aborts_on_auth_error()
+    test_pipeline_change_detection()
+    test_pipeline_records_synced_after_commit()
+    test_pipeline_resume_from_journal()
+    print("\n🎉 流水线测试全部通过！")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试按阶段剖析：未启用时为空上下文，启用后写出 CPU、内存与火焰图调用栈报告
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import profiler
+from config import PROFILE_CONFIG
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+def test_profile_disabled_is_noop():
+    """测试未启用剖析时不创建剖析器，也不写报告"""
+    print("🧪 测试未启用剖析...")
+    assert profiler.profile_stage("fetch") is profiler.profile_stage("process")
+    with profiler.profile_stage("fetch"):
+        pass
+    assert profiler.write_profile_report("full_sync") is None
+    print("✅ 未启用剖析测试通过")
+
+
+def test_profile_report():
+    """测试多个线程中的阶段分别汇总，并写出各类报告文件"""
+    print("🧪 测试剖析报告...")
+    original_dir = PROFILE_CONFIG["output_dir"]
+    with tempfile.TemporaryDirectory() as tmp:
+        PROFILE_CONFIG["output_dir"] = tmp
+        try:
+            profiler.enable_profiling()
+            retained = []
+
+            def process():
+                with profiler.profile_stage("process"):
+                    retained.append(["x" * 100 for _ in range(2000)])
+                    _busy(0.1)
+
+            thread = threading.Thread(target=process)
+            thread.start()
+            thread.join()
+            with profiler.profile_stage("upsert"):
+                _busy(0.05)
+            directory = profiler.write_profile_report("full_sync")
+        finally:
+            PROFILE_CONFIG["output_dir"] = original_dir
+
+        files = set(os.listdir(directory))
+        for stage in ("process", "upsert"):
+            assert {f"{stage}.prof", f"{stage}.cpu.txt", f"{stage}.mem.txt"} <= files
+        with open(os.path.join(directory, "process.cpu.txt"), encoding="utf-8") as f:
+            assert "_busy" in f.read()
+        with open(os.path.join(directory, "process.mem.txt"), encoding="utf-8") as f:
+            assert "test_profiler.py" in f.read()
+        with open(os.path.join(directory, "stacks.folded"), encoding="utf-8") as f:
+            stacks = f.read().splitlines()
+        assert any(line.startswith("process;") and "_busy" in line for line in stacks)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
+    assert profiler.profile_stage("fetch") is profiler._NULL_STAGE
+    print("✅ 剖析报告测试通过")
+
+
+if __name__ == "__main__":
+    print("🚀 开始剖析测试")
+    print("=" * 50)
+    test_profile_disabled_is_noop()
+    test_profile_report()
+    print("=" * 50)
+    print("🎉 所有测试通过！")
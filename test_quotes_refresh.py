@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+测试行情快速刷新：只推送发生变化的市场字段
+"""
+
+import os
+import tempfile
+
+import quotes_refresh
+from state_store import StateStore
+
+
+class _FakeIndex:
+    def __init__(self):
+        self.updates = {}
+
+    def update(self, id, set_metadata):
+        self.updates[id] = set_metadata
+
+
+def test_quotes_refresh_pushes_only_changes():
+    """测试只有变化的字段会通过 update 写入，且结果会记录到状态库"""
+    print("🧪 测试行情快速刷新...")
+    market = {
+        "1": {"circulating_supply": 100, "total_supply": 200, "quote": {"USD": {"fully_diluted_valuation": 5.5}}},
+        "2": {"circulating_supply": 300, "total_supply": 400, "quote": {"USD": {"fully_diluted_valuation": 7.0}}},
+    }
+    index = _FakeIndex()
+    originals = (quotes_refresh.fetch_market_data, quotes_refresh.init_pinecone_client,
+                 quotes_refresh.get_or_create_index)
+    quotes_refresh.fetch_market_data = lambda ucids, dead_letters=None: {str(u): market[str(u)] for u in ucids if str(u) in market}
+    quotes_refresh.init_pinecone_client = lambda: object()
+    quotes_refresh.get_or_create_index = lambda pc: index
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            state = StateStore(os.path.join(tmp, "state.db"))
+            state.record_market_values({
+                1: {"circulating_supply": 100, "total_supply": 200, "fdv": 5.5},
+                2: {"circulating_supply": 250, "total_supply": 400, "fdv": 7.0},
+            })
+            stats = quotes_refresh.run_quotes_refresh([1, 2, 3], state)
+            assert state.market_values([2])[2]["circulating_supply"] == 300
+            state.close()
+    finally:
+        (quotes_refresh.fetch_market_data, quotes_refresh.init_pinecone_client,
+         quotes_refresh.get_or_create_index) = originals
+
+    assert stats == {"fetched": 2, "changed": 1, "updated": 1, "unchanged": 1}
+    assert index.updates == {"cmc-2": {"circulating_supply": 300}}
+    print("✅ 行情快速刷新测试通过")
+
+
+if __name__ == "__main__":
+    test_quotes_refresh_pushes_only_changes()
+    print("\n🎉 行情快速刷新测试全部通过！")
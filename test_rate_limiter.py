@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+测试令牌桶限流器的突发容量与补充速率
+"""
+
+import time
+from rate_limiter import TokenBucket
+
+
+def test_burst_then_throttle():
+    """测试桶满时允许突发，耗尽后按速率放行"""
+    print("🧪 测试令牌桶突发与限速...")
+    bucket = TokenBucket(rate_per_minute=600, capacity=3)  # 每秒 10 个令牌
+
+    for _ in range(3):
+        assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    print("✅ 突发容量测试通过")
+
+    start = time.monotonic()
+    waited = bucket.acquire()
+    elapsed = time.monotonic() - start
+    assert 0.05 <= elapsed < 0.5
+    assert waited > 0
+    print("✅ 限速等待测试通过")
+
+
+def test_invalid_rate():
+    """测试非法速率参数"""
+    print("🧪 测试非法速率参数...")
+    try:
+        TokenBucket(rate_per_minute=0)
+    except ValueError:
+        print("✅ 非法速率参数测试通过")
+        return
+    raise AssertionError("速率为 0 时应抛出 ValueError")
+
+
+if __name__ == "__main__":
+    test_burst_then_throttle()
+    test_invalid_rate()
+    print("\n🎉 限流器测试全部通过！")
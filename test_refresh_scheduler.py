@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+测试按排名分层的刷新调度：到期判断、优先级排序与单次数量上限
+"""
+
+import os
+import tempfile
+import time
+
+from refresh_scheduler import select_due_ucids, tier_for
+from state_store import StateStore
+
+
+def test_tier_for_rank():
+    """测试排名与档位的对应关系，没有排名的代币归入最后一档"""
+    assert tier_for(1)["name"] == "hot"
+    assert tier_for(201)["name"] == "warm"
+    assert tier_for(4000)["name"] == "mid"
+    assert tier_for(9000)["name"] == "tail"
+    assert tier_for(None)["name"] == "tail"
+
+
+def test_select_due_ucids():
+    """测试只选出到期代币，新代币与逾期最多的代币优先，并受单次数量上限约束"""
+    print("🧪 测试分层刷新调度...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StateStore(os.path.join(tmp, "state.db"))
+        store.record_fetched([1, 2, 3, 4, 6], ranks={1: 10, 2: 500, 3: 3000, 4: 8000, 6: 20})
+        store.record_synced([1, 2, 3, 4])
+        now = time.time() + 2 * 3600  # 两小时后：只有 hot 档到期
+
+        assert select_due_ucids(store, [1, 2, 3, 4], now=now) == [1]
+        # 5 从未同步过，总是排在最前
+        assert select_due_ucids(store, [1, 2, 3, 4, 5], now=now) == [5, 1]
+        # 6 拉取成功但未完成写入，与从未同步过的代币一样到期
+        assert select_due_ucids(store, [1, 6], now=time.time()) == [6]
+
+        later = time.time() + 30 * 3600  # 30 小时后：hot / warm / mid 都到期，hot 逾期最多
+        assert select_due_ucids(store, [1, 2, 3, 4], now=later) == [1, 2, 3]
+        assert select_due_ucids(store, [1, 2, 3, 4], now=later, limit=2) == [1, 2]
+        store.close()
+    print("✅ 分层刷新调度测试通过")
+
+
+if __name__ == "__main__":
+    test_tier_for_rank()
+    test_select_due_ucids()
+    print("\n🎉 分层刷新调度测试全部通过！")
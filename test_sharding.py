@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试分片同步：分片参数解析、按哈希的确定性划分与分片状态库合并
+"""
+
+import os
+import tempfile
+
+from sharding import parse_shard, select_shard, shard_of
+from state_store import StateStore, STATUS_DELETED, STATUS_MISSING
+
+
+def test_parse_and_partition():
+    """测试分片参数解析，以及所有 UCID 恰好被划分到一个分片"""
+    print("🧪 测试分片划分...")
+    assert parse_shard("1/4") == (1, 4)
+    for spec in ("4/4", "-1/2", "1", "a/b", "0/0"):
+        try:
+            parse_shard(spec)
+        except ValueError:
+            continue
+        raise AssertionError(f"{spec} 应当解析失败")
+
+    ucids = list(range(1, 1001))
+    shards = [select_shard(ucids, i, 4) for i in range(4)]
+    assert sorted(u for shard in shards for u in shard) == ucids
+    assert all(150 < len(shard) < 350 for shard in shards)
+    assert shard_of(12345, 4) == shard_of(12345, 4)
+    print("✅ 分片划分测试通过")
+
+
+def test_merge_shard_states():
+    """测试合并时只采用所属分片的记录，分片中已消失的代币标记为缺失，credits 累加且重复合并不重复计入"""
+    print("🧪 测试分片状态库合并...")
+    ucids = list(range(1, 21))
+    with tempfile.TemporaryDirectory() as tmp:
+        base = StateStore(os.path.join(tmp, "state.db"))
+        base.mark_seen(ucids + [99])
+        base.set_meta("cmc_credits:2026-01-01", "5")
+
+        for index in range(2):
+            path = os.path.join(tmp, f"shard-{index}.db")
+            shard = StateStore(path)
+            owned = select_shard(ucids, index, 2)
+            shard.mark_seen(owned)
+            shard.record_upserted({str(u): {"text": f"t{u}", "meta": f"m{u}"} for u in owned})
+            shard.record_market_values({u: {"fdv": float(u)} for u in owned})
+            # 分片库中即使出现不属于自己的代币，合并时也会被忽略
+            shard.record_upserted({str(u): {"text": "wrong", "meta": "wrong"} for u in ucids if u not in owned})
+            shard.set_meta("cmc_credits:2026-01-01", "10")
+            shard.close()
+            base.merge_shard(path, lambda ucid, i=index: shard_of(ucid, 2) == i)
+
+        assert base.active_ucids() == set(ucids)
+        status = base._conn.execute("SELECT status FROM coins WHERE ucid = 99").fetchone()[0]
+        assert status == STATUS_MISSING
+        assert base.fingerprints() == {str(u): {"text": f"t{u}", "meta": f"m{u}"} for u in ucids}
+        assert base.market_values(ucids)[7]["fdv"] == 7.0
+        assert base.get_meta("cmc_credits:2026-01-01") == "25"
+
+        # 同一天重复合并（如分片 --resume 后）只计入分片计数新增的部分
+        path = os.path.join(tmp, "shard-0.db")
+        base.merge_shard(path, lambda ucid: shard_of(ucid, 2) == 0)
+        assert base.get_meta("cmc_credits:2026-01-01") == "25"
+        shard = StateStore(path)
+        shard.set_meta("cmc_credits:2026-01-01", "14")
+        shard.close()
+        base.merge_shard(path, lambda ucid: shard_of(ucid, 2) == 0)
+        base.merge_shard(path, lambda ucid: shard_of(ucid, 2) == 0)
+        assert base.get_meta("cmc_credits:2026-01-01") == "29"
+        base.close()
+    print("✅ 分片状态库合并测试通过")
+
+
+def test_merge_partial_shard_keeps_existing_columns():
+    """测试分片只对代币做过 mark_seen 时，合并不会清空本库已有的指纹与时间戳；分片删除的代币按分片清空指纹"""
+    print("🧪 测试部分列分片的合并...")
+    with tempfile.TemporaryDirectory() as tmp:
+        base = StateStore(os.path.join(tmp, "state.db"))
+        base.mark_seen([1, 2])
+        base.record_upserted({"1": {"text": "t1", "meta": "m1"}, "2": {"text": "t2", "meta": "m2"}})
+        base.record_synced([1, 2])
+        synced_at = base.refresh_status()[1][1]
+
+        path = os.path.join(tmp, "shard-0.db")
+        shard = StateStore(path)
+        shard.mark_seen([1, 2])
+        shard.record_deleted([2])
+        shard.close()
+        base.merge_shard(path, lambda ucid: True)
+
+        assert base.fingerprints() == {"1": {"text": "t1", "meta": "m1"}}
+        assert base.refresh_status()[1][1] == synced_at
+        status = base._conn.execute("SELECT status FROM coins WHERE ucid = 2").fetchone()[0]
+        assert status == STATUS_DELETED
+        base.close()
+    print("✅ 部分列分片的合并测试通过")
+
+
+if __name__ == "__main__":
+    test_parse_and_partition()
+    test_merge_shard_states()
+    test_merge_partial_shard_keeps_existing_columns()
+    print("\n🎉 分片同步测试全部通过！")
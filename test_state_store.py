@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试 SQLite 状态库：UCID 状态、指纹读写与旧版 JSON 快照导入
+"""
+
+import json
+import os
+import tempfile
+
+from state_store import StateStore
+
+
+def test_mark_seen_and_fingerprints():
+    """测试 UCID 状态增量更新与指纹读写"""
+    print("🧪 测试状态库 UCID 状态与指纹...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StateStore(os.path.join(tmp, "state.db"))
+        assert store.mark_seen([1, 2, 3]) == 3
+        assert store.mark_seen([2, 3, 4]) == 1
+        assert store.active_ucids() == {2, 3, 4}
+        assert store.mark_seen([9], reconcile=False) == 1
+        assert store.active_ucids() == {2, 3, 4, 9}
+        assert store.max_ucid() == 9
+
+        store.record_fetched([2, 3], ranks={2: 10})
+        store.record_upserted({"2": {"text": "t2", "meta": "m2"}})
+        assert store.fingerprints() == {"2": {"text": "t2", "meta": "m2"}}
+        rank = store._conn.execute("SELECT rank FROM coins WHERE ucid = 2").fetchone()[0]
+        assert rank == 10
+        store.close()
+    print("✅ 状态库 UCID 状态与指纹测试通过")
+
+
+def test_dead_letters_expire_and_clear():
+    """测试死信记录在冷却期内生效、过期后重试、成功拉取后清除"""
+    print("🧪 测试状态库死信列表...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StateStore(os.path.join(tmp, "state.db"))
+        store.record_dead_letters({5: "HTTP 400", 6: "HTTP 400"})
+        store.record_dead_letters({5: "HTTP 400"})
+        assert store.dead_letter_ucids() == {5, 6}
+        failures = store._conn.execute("SELECT failures FROM dead_letters WHERE ucid = 5").fetchone()[0]
+        assert failures == 2
+
+        store._conn.execute("UPDATE dead_letters SET failed_at = 0 WHERE ucid = 6")
+        assert store.dead_letter_ucids() == {5}
+        store.record_fetched([5])
+        assert store.dead_letter_ucids() == set()
+        store.close()
+    print("✅ 状态库死信列表测试通过")
+
+
+def test_import_legacy_snapshot_once():
+    """测试旧版 JSON 快照只导入一次"""
+    print("🧪 测试旧版快照导入...")
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "ucids_snapshot.json")
+        with open(snapshot, "w") as f:
+            json.dump([1, 2], f)
+
+        store = StateStore(os.path.join(tmp, "state.db"))
+        store.import_legacy_snapshot(snapshot)
+        assert store.active_ucids() == {1, 2}
+
+        store.mark_seen([2])
+        store.import_legacy_snapshot(snapshot)
+        assert store.active_ucids() == {2}
+        store.close()
+    print("✅ 旧版快照导入测试通过")
+
+
+if __name__ == "__main__":
+    test_mark_seen_and_fingerprints()
+    test_dead_letters_expire_and_clear()
+    test_import_legacy_snapshot_once()
+    print("\n🎉 状态库测试全部通过！")
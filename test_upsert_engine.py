@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+测试上传引擎：按字节数打包、并发上传、过大批次拆分与失败隔离
+"""
+
+import threading
+
+import pinecone_manager
+from config import UPSERT_CONFIG
+
+
+class _FlakyIndex:
+    """单次请求超过 max_vectors 条时报“过大”，包含 bad_id 的请求总是失败"""
+
+    def __init__(self, max_vectors=None, bad_id=None):
+        self.max_vectors = max_vectors
+        self.bad_id = bad_id
+        self.stored = set()
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors):
+        with self._lock:
+            self.requests.append(len(vectors))
+        if self.max_vectors and len(vectors) > self.max_vectors:
+            raise Exception("(413) Request entity too large")
+        if any(v["id"] == self.bad_id for v in vectors):
+            raise Exception("(400) Bad Request: invalid metadata")
+        with self._lock:
+            self.stored.update(v["id"] for v in vectors)
+        return {"upserted_count": len(vectors)}
+
+
+def _vectors(count, dim=8, description_len=0):
+    return [{"id": f"cmc-{i}", "values": [0.1] * dim, "metadata": {"description": "x" * description_len}}
+            for i in range(count)]
+
+
+def test_pack_batches_by_bytes():
+    """测试批次按估算字节数与条数上限打包"""
+    print("🧪 测试按字节数打包批次...")
+    original = dict(UPSERT_CONFIG)
+    UPSERT_CONFIG.update(max_request_bytes=5000, max_batch_vectors=3)
+    try:
+        batches = pinecone_manager._pack_batches(_vectors(10, description_len=1500))
+    finally:
+        UPSERT_CONFIG.update(original)
+    assert all(batch_bytes <= 5000 for _, batch_bytes in batches)
+    assert all(len(batch) <= 3 for batch, _ in batches)
+    assert sum(len(batch) for batch, _ in batches) == 10
+    print("✅ 按字节数打包测试通过")
+
+
+def test_split_oversized_and_isolate_bad_vector():
+    """测试过大批次自动拆分，单条坏数据被隔离而不影响其他向量"""
+    print("🧪 测试拆分与失败隔离...")
+    original = dict(UPSERT_CONFIG)
+    UPSERT_CONFIG.update(max_retries=1, concurrency=2)
+    try:
+        index = _FlakyIndex(max_vectors=4, bad_id="cmc-7")
+        upserted = pinecone_manager.upsert_data_to_pinecone(index, _vectors(20), report_stats=False)
+    finally:
+        UPSERT_CONFIG.update(original)
+    assert upserted == 19
+    assert "cmc-7" not in index.stored and len(index.stored) == 19
+    print("✅ 拆分与失败隔离测试通过")
+
+
+def test_oversize_error_detection():
+    """测试只有 413 与 gRPC 消息长度超限才按请求体过大拆分，错误信息中偶然出现的数字或措辞不算"""
+    print("🧪 测试请求体过大的错误识别...")
+    oversize = Exception("(413)\nReason: Payload Too Large")
+    status_error = Exception("Payload Too Large")
+    status_error.status = 413
+    grpc_error = Exception("<_InactiveRpcError: StatusCode.RESOURCE_EXHAUSTED, "
+                           "Received message larger than max (message length 5000000)>")
+    assert all(pinecone_manager._is_oversize_error(e) for e in (oversize, status_error, grpc_error))
+    others = (Exception("(400) Bad Request: metadata size exceeds the limit for vector cmc-413"),
+              Exception("(503) Service Unavailable: too large a backlog, retry later"))
+    assert not any(pinecone_manager._is_oversize_error(e) for e in others)
+    print("✅ 请求体过大的错误识别测试通过")
+
+
+if __name__ == "__main__":
+    test_pack_batches_by_bytes()
+    test_split_oversized_and_isolate_bad_vector()
+    test_oversize_error_detection()
+    print("\n🎉 上传引擎测试全部通过！")
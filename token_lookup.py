@@ -0,0 +1,25 @@
+import argparse
+import json
+from pinecone_manager import init_pinecone_client, get_or_create_index, fetch_token_metadata
+
+def lookup_tokens(ucids):
+    """从当前一代读取代币的完整元数据并打印；被移入 blob 存储的字段会还原为完整值"""
+    pc_client = init_pinecone_client()
+    if not pc_client:
+        return
+    index = get_or_create_index(pc_client)
+    if not index:
+        return
+    found = fetch_token_metadata(index, ucids)
+    for ucid in ucids:
+        if ucid not in found:
+            print(f"⚠️ 索引中没有 UCID {ucid}")
+            continue
+        print(f"🔎 UCID {ucid}:")
+        print(json.dumps(found[ucid], ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看代币在 Pinecone 中的完整元数据")
+    parser.add_argument("ucids", metavar="UCID", type=int, nargs="+", help="要查看的代币 UCID")
+    args = parser.parse_args()
+    lookup_tokens(args.ucids)
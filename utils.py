@@ -1,27 +1,37 @@
-import json
-from typing import List, Set
+import sqlite3
+from typing import Dict, List, Set
+from state_store import get_state_store
 
-SNAPSHOT_FILE = "ucids_snapshot.json"
-
-def save_ucids_snapshot(ucids: List[int]):
-    """将 UCID 列表保存到快照文件中"""
+def save_ucids_snapshot(ucids: List[int], reconcile: bool = True):
+    """
+    将最新 UCID 列表增量写入状态库：列表中的代币标记为 active。
+    reconcile 为 True（全量列表）时其余代币标记为 missing；增量发现的结果应传 False。
+    """
     try:
-        with open(SNAPSHOT_FILE, 'w') as f:
-            json.dump(ucids, f)
-        print(f"✅ 成功将 {len(ucids)} 个 UCID 保存到快照文件: {SNAPSHOT_FILE}")
-    except IOError as e:
-        print(f"❌ 保存 UCID 快照文件失败: {e}")
+        added = get_state_store().mark_seen(ucids, reconcile)
+        print(f"✅ 成功将 {len(ucids)} 个 UCID 写入状态库（新增 {added} 个）")
+    except sqlite3.Error as e:
+        print(f"❌ 保存 UCID 快照到状态库失败: {e}")
 
 def load_ucids_snapshot() -> Set[int]:
-    """从快照文件加载 UCID 列表，并返回一个集合以便快速查找"""
+    """从状态库加载当前 active 的 UCID 集合"""
     try:
-        with open(SNAPSHOT_FILE, 'r') as f:
-            ucids = json.load(f)
-        print(f"✅ 成功从快照文件加载 {len(ucids)} 个 UCID")
-        return set(ucids)
-    except FileNotFoundError:
-        print(f"⚠️ 未找到 UCID 快照文件。")
+        ucids = get_state_store().active_ucids()
+    except sqlite3.Error as e:
+        print(f"❌ 从状态库加载 UCID 快照失败: {e}")
         return set()
-    except (IOError, json.JSONDecodeError) as e:
-        print(f"❌ 加载 UCID 快照文件失败: {e}")
-        return set()
\ No newline at end of file
+    if ucids:
+        print(f"✅ 成功从状态库加载 {len(ucids)} 个 UCID")
+    else:
+        print(f"⚠️ 状态库中没有 UCID 快照。")
+    return ucids
+
+def load_fingerprints() -> Dict[str, Dict[str, str]]:
+    """从状态库加载代币指纹，返回 {ucid 字符串: {"text": 哈希, "meta": 哈希}}"""
+    try:
+        fingerprints = get_state_store().fingerprints()
+    except sqlite3.Error as e:
+        print(f"❌ 从状态库加载代币指纹失败: {e}")
+        return {}
+    print(f"✅ 成功加载 {len(fingerprints)} 个代币指纹")
+    return fingerprints